@@ -1,31 +1,75 @@
 # Written by Navjeet for HW3
 
-from flask import Flask, jsonify, send_from_directory, request, session, redirect, url_for
+from flask import Flask, Response, jsonify, send_from_directory, request, session, redirect, url_for, g, abort, stream_with_context
 import os
 from flask_cors import CORS
 import requests
-from pymongo import MongoClient
+from pymongo import MongoClient, timeout as mongo_timeout
 from bson.objectid import ObjectId
 from datetime import datetime, timezone
 from jose import jwt
 import time
-
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyOAuth
-from spotipy.cache_handler import FlaskSessionCacheHandler
+import math
+
+from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
+from spotipy.cache_handler import MemoryCacheHandler
+
+from fanout import fan_out, fan_out_as_completed
+from metrics import registry, mongo_listener, instrument_flask, cache_collector
+from static_files import StaticManifest, send_asset, is_asset_path
+from response_encoding import use_fast_json, compress_responses
+from spotify_cache import CachedSpotify, TTLCache, artist_cache
+from rate_limit import RateLimitedSpotify, spotify_budget, retry_after_seconds
+from http_pool import spotify_session, use_accounts_url, SPOTIFY_TIMEOUT
+from auth import SpotifyAuth, NoCacheHandler
+from catalog import Catalog
+from search_index import (
+    PrefixIndex, SEARCH_KINDS, TYPEAHEAD_MIN_QUERY, normalize, search_track, search_artist, search_album
+)
+from library_sync import LibrarySync, discover_artist_ids
+from response_cache import ResponseCache, BROWSE_CACHE_STALE
+from schema import migrate, schema_version, LATEST_VERSION
+from identity import IdentityResolver
+from feedback_queue import FeedbackWriter, FeedbackBackpressure
+from recommender import ArtistAffinity
+from deck_queue import DeckQueues, DeckSnapshots, DECK_SNAPSHOT_TTL
+from pagination import CursorCodec, InvalidCursor
+from projection import (
+    TRACK_FIELDS, ALBUM_FIELDS, DEFAULT_ALBUM_FIELDS, InvalidFields,
+    parse_fields, project_tracks, project_albums, first_image_url, spotify_url
+)
 
 
 static_path = os.getenv('STATIC_PATH','static')
 template_path = os.getenv('TEMPLATE_PATH','templates')
+# The built frontend, listed once at startup so serving a file never probes the disk
+frontend_files = StaticManifest(static_path)
+frontend_pages = StaticManifest(template_path)
 # Mongo connection
 mongo_uri = os.getenv("MONGO_URI")
-mongo = MongoClient(mongo_uri)
+# Every command is timed for /metrics. connect=False: nothing is opened until the first
+# command, so a client built in gunicorn's master (preload_app) connects in each worker
+mongo = MongoClient(mongo_uri, connect=False, event_listeners=[mongo_listener])
 db = mongo.get_default_database()
+# Typeahead index of the tracks, artists and albums this process has seen
+search_index = PrefixIndex()
+# Tracks and artists seen in Spotify responses, shared by all workers
+catalog = Catalog(db, on_record=search_index.add_spotify)
+# Every user's saved and top tracks, synced from Spotify in the background
+library = LibrarySync(db)
+# Likes and dislikes are written to Mongo in the background, in bulk
+feedback_writer = FeedbackWriter(db.user_feedback).register_shutdown()
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 CORS(app)
+# Per-route timings and upstream calls for /metrics, and sampled debug logs
+instrument_flask(app)
+# jsonify encodes with orjson when it is installed, and large bodies are compressed
+use_fast_json(app)
+compress_responses(app)
 
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "secret-dev-key")
+identity = IdentityResolver(app.secret_key)
 
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
@@ -39,45 +83,87 @@ scope = (
 )
 
 # Configure Spotipy's OAuth  handler
-# Tells Spotipy to store the token in Flask's session
-cache_handler = FlaskSessionCacheHandler(session) 
-sp_oauth = SpotifyOAuth(
+# It is shared by every request, so it must not hold anyone's token: tokens are kept
+# in each user's own session by store_token(), never in the handler's cache
+sp_oauth = use_accounts_url(SpotifyOAuth(
     client_id=SPOTIFY_CLIENT_ID,
     client_secret=SPOTIFY_CLIENT_SECRET,
     # This is where Spotify will redirect after authorization (login)
     redirect_uri=redirect_uri, 
     scope=scope,
-    cache_handler=cache_handler,
-    show_dialog=True
-)
-# Create a Spotify client instance with the OAuth manager
-# It will use sp_oauth to automatically handle getting the token and refreshing it
-sp = Spotify(auth_manager=sp_oauth)
+    cache_handler=NoCacheHandler(),
+    show_dialog=True,
+    # Token exchanges and refreshes reuse the pooled connections too
+    requests_session=spotify_session(),
+    requests_timeout=SPOTIFY_TIMEOUT
+))
+# Code exchange and single-flight token refresh on top of sp_oauth
+spotify_auth = SpotifyAuth(sp_oauth)
+
+# Browse data (new releases, categories) is the same for every user in a market, so it is
+# fetched with the app's own client credentials token: refreshing a cached response in the
+# background doesn't depend on anyone's session
+browse_client = RateLimitedSpotify(auth_manager=use_accounts_url(SpotifyClientCredentials(
+    client_id=SPOTIFY_CLIENT_ID,
+    client_secret=SPOTIFY_CLIENT_SECRET,
+    cache_handler=MemoryCacheHandler(),
+    requests_session=spotify_session(),
+    requests_timeout=SPOTIFY_TIMEOUT
+)))
+# Browse responses, in this process and in Mongo for the other workers
+browse_cache = ResponseCache(db.response_cache)
+
+# Spotify's several-albums endpoint accepts at most 20 ids per call
+ALBUMS_BATCH_SIZE = 20
 
 def store_token(token_info: dict):
     session["token_info"] = token_info
     session.permanent = True    
 
-def get_spotify_client() -> Spotify | None:
-    token = session.get("token_info")
+def get_session_token() -> dict | None:
+    """The caller's own token, refreshed first if it expired"""
+    token_info = session.get("token_info")
+    if not token_info:
+        return None
+    # Concurrent requests of the same user share one refresh
+    token_info, refreshed = spotify_auth.fresh_token(token_info)
+    if refreshed:
+        store_token(token_info)
+    return token_info
+
+def get_spotify_client() -> CachedSpotify | None:
+    """A Spotify client bound to the caller's own token"""
+    token = get_session_token()
     if not token:
         return None
-    if sp_oauth.is_token_expired(token):
-        token = sp_oauth.refresh_access_token(token["refresh_token"])
-        store_token(token)
-    return Spotify(auth=token["access_token"])
+    # One client per request, however many helpers ask for it. Clients are cheap:
+    # they all share the pooled HTTP session and the process-wide request budget.
+    # Artist-level calls go through the process-wide cache shared by all users,
+    # and the tracks and artists in every response land in the catalog.
+    if "spotify_client" not in g:
+        g.spotify_client = CachedSpotify(RateLimitedSpotify(auth=token["access_token"]), catalog=catalog)
+    return g.spotify_client
+
+def is_throttled(e) -> bool:
+    """Spotify rate limited us, or we shed the call to stay within our budget"""
+    return getattr(e, 'http_status', None) == 429
+
+def spotify_busy_response(e):
+    # 503 rather than 500 so clients back off and retry instead of giving up
+    retry_after = max(1, math.ceil(retry_after_seconds(getattr(e, 'headers', None))))
+    return jsonify({"error": "Spotify is busy, please retry shortly."}), 503, {"Retry-After": str(retry_after)}
 
 # Helper function to check if the user is logged in
 def validate_user_token():
-    token_info = sp_oauth.get_cached_token()
+    token_info = session.get("token_info")
 
     # Check if the token exists and is valid
-    if not token_info or not sp_oauth.validate_token(token_info):
+    if not token_info or not token_info.get('access_token') or spotify_auth.is_expired(token_info):
         # If the token is not valid, try to refresh it
         if token_info and token_info.get('refresh_token'):
             app.logger.info(f"SPOTIPY: Token for {request.path} - Attempting to refresh.")
             try:
-                sp_oauth.refresh_access_token(token_info['refresh_token'])
+                get_session_token()
                 app.logger.info(f"SPOTIPY: Token for {request.path} - Refreshed successfully.")
                 return None # Token refreshed, proceed
             except Exception as e:
@@ -89,9 +175,34 @@ def validate_user_token():
             app.logger.warn(f"SPOTIPY: Token for {request.path} - No valid token/refresh token. User needs to re-authenticate.")
             return jsonify({"error": "User not authenticated or token expired. Please log in again."}), 401
     
-    app.logger.debug(f"SPOTIPY: Token for {request.path} - Token is valid.")
+    app.logger.debug("SPOTIPY: Token for %s - Token is valid.", request.path)
     return None # Token is valid, proceed
 
+# Helper function to get the caller's Spotify user id
+# It comes from the session or the signed X-User-Token header when possible, and only
+# falls back to a (cached) current_user() call when neither is available.
+def get_current_user_id(sp_client=None) -> str | None:
+    user = getattr(request, "user", None) or {}
+    token_info = session.get("token_info") or {}
+
+    def fetch_profile():
+        profile = (sp_client or get_spotify_client()).current_user()
+        # Remember who this is so the next request doesn't need the fallback
+        session["user"] = {
+            "name": profile.get('display_name'),
+            "email": profile.get('email'),
+            "id": profile['id'],
+            "moderator": False
+        }
+        return profile
+
+    return identity.resolve_user_id(
+        session_user_id=user.get("id"),
+        identity_token=request.headers.get("X-User-Token"),
+        access_token=token_info.get("access_token"),
+        fetch_profile=fetch_profile,
+        refresh_token=token_info.get("refresh_token")
+    )
 
 # Endpoint to handle Spotify authorization
 # This route is used to redirect the user to Spotify's authorization page 
@@ -99,10 +210,15 @@ def validate_user_token():
 @app.route("/spotify/authorize")
 def home():
     app.logger.debug("SPOTIPY: Entered /spotify/authorize (home route)")
-    if not sp_oauth.validate_token(sp_oauth.get_cached_token()):
+    try:
+        token_info = get_session_token()
+    except Exception as e:
+        app.logger.info(f"SPOTIPY: Could not refresh the session's token: {str(e)}")
+        token_info = None
+    if not token_info:
         app.logger.debug("SPOTIPY: Token not valid or not found, getting auth URL.")
         auth_url = sp_oauth.get_authorize_url()
-        app.logger.debug(f"SPOTIPY: Generated Spotify auth_url: {auth_url}")
+        app.logger.debug("SPOTIPY: Generated Spotify auth_url: %s", auth_url)
         # Redirect the user to Spotify's authorization page to have them login
         return redirect(auth_url)
     
@@ -116,24 +232,25 @@ def spotify_token():
     # Get JSON data sent by the frontend (Specifically the 'code')
     data = request.get_json()
     code = data.get('code')
-    app.logger.debug(f"SPOTIPY: /api/spotify/token received code: {'YES' if code else 'NO'}")
+    app.logger.debug("SPOTIPY: /api/spotify/token received code: %s", 'YES' if code else 'NO')
 
     if not code:
         return jsonify({"error": "No code provided"}), 400
     
     try:
         # Exchange the code for an access token
-        token_info = sp_oauth.get_access_token(code, check_cache=False)
+        token_info = spotify_auth.exchange_code(code)
 
         if not token_info:
             app.logger.error("SPOTIPY: Failed to get token info from Spotify from /api/spotify/token.")
             return jsonify({"error": "Failed to get token info"}), 500
         
-        app.logger.debug(f"SPOTIPY: /api/spotify/token - Token info received: {token_info}")
+        app.logger.debug("SPOTIPY: /api/spotify/token - Token info received: %s", token_info)
         
-        # get the user's Spotify profile
-        spotify_user_profile = sp.current_user()
-        app.logger.debug(f"SPOTIPY: /api/spotify/token - Fetched Spotify user profile: {spotify_user_profile}")
+        # Keep the token in this user's session only, then get their Spotify profile with it
+        store_token(token_info)
+        spotify_user_profile = get_spotify_client().current_user()
+        app.logger.debug("SPOTIPY: /api/spotify/token - Fetched Spotify user profile: %s", spotify_user_profile)
 
         # Prepare to store user info in session
         user_info = {
@@ -144,9 +261,11 @@ def spotify_token():
         }
         # Store user info in session 
         session["user"] = user_info 
-        app.logger.debug(f"SPOTIPY: /api/spotify/token - User info stored in session. Session data: {dict(session)}")
-        # Send a response back to the frontend with the user info
-        return jsonify({"success": True, "user": user_info})
+        # Start pulling their library, so library reads are local by the time they are needed
+        library.request_sync(user_info["id"], get_spotify_client())
+        app.logger.debug("SPOTIPY: /api/spotify/token - User info stored in session. Session data: %s", session)
+        # Send a response back to the frontend with the user info and a signed identity token
+        return jsonify({"success": True, "user": user_info, "identity_token": identity.issue_token(user_info["id"], token_info.get("refresh_token"))})
     except Exception as e:
         app.logger.error(f"SPOTIPY: Error in /api/spotify/token: {str(e)}")
         return jsonify({"error": "An error occurred during Spotify token exchange."}), 500
@@ -161,8 +280,12 @@ def api_get_playlists():
         return auth_error
 
     try:
-        playlists_result = sp.current_user_playlists(limit=50) # Get up to 50 playlists
-        app.logger.debug(f"APP: /api/playlists - Playlists fetched from Spotify: {'Data received' if playlists_result else 'No data'}")
+        sp_client = get_spotify_client()
+        if not sp_client:
+            return jsonify({"error": "Failed to get Spotify client"}), 500
+
+        playlists_result = sp_client.current_user_playlists(limit=50) # Get up to 50 playlists
+        app.logger.debug("APP: /api/playlists - Playlists fetched from Spotify: %s", 'Data received' if playlists_result else 'No data')
 
         playlists_data = []
         if playlists_result and playlists_result.get('items'):
@@ -181,17 +304,59 @@ def api_get_playlists():
                 }
                 playlists_data.append(playlist_info)
 
-        app.logger.debug(f"APP: /api/playlists - Processed {len(playlists_data)} playlists.")
+        app.logger.debug("APP: /api/playlists - Processed %s playlists.", len(playlists_data))
         return jsonify(playlists_data)
 
     except Exception as e:
         app.logger.error(f"APP: /api/playlists - Error fetching playlists: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         if hasattr(e, 'http_status') and e.http_status == 401: # Spotify API returned 401
              session.clear() 
              return jsonify({"error": "Spotify authorization error. Please log in again."}), 401
         return jsonify({"error": "Failed to fetch playlists from Spotify"}), 500
 
 
+def search_response(results) -> dict:
+    """The tracks, artists and albums of a Spotify search, compacted for the frontend"""
+    # Spotipy returns a dict with keys like 'tracks', 'artists', 'albums',
+    # each containing a Paging Object with an 'items' list.
+    processed_results = {}
+    if results:
+        if 'tracks' in results and results['tracks']:
+            processed_results['tracks'] = [search_track(item) for item in results['tracks'].get('items', [])]
+        
+        if 'artists' in results and results['artists']:
+            processed_results['artists'] = [search_artist(item) for item in results['artists'].get('items', [])]
+
+        if 'albums' in results and results['albums']:
+            processed_results['albums'] = [search_album(item) for item in results['albums'].get('items', [])]
+    return processed_results
+
+# Spotify search results, the same for every user. Keys are normalized queries, so
+# "Daft Punk" and "daft  punk" share an entry, and concurrent identical searches share one call.
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 3600))
+search_cache = TTLCache(int(os.getenv("SEARCH_CACHE_SIZE", 2000)), {"search": SEARCH_CACHE_TTL}, stale_on_error=True)
+
+def search_key(query: str, types, limit: int) -> tuple:
+    # Only case and spacing, field filters like artist:... must survive
+    return " ".join(query.casefold().split()), tuple(sorted(types)), limit
+
+def search_albums(results) -> list:
+    return ((results or {}).get('albums') or {}).get('items', [])
+
+def cached_search(sp_client, query: str, types, limit: int):
+    """Spotify's search results for the query, from the search cache when another request already asked"""
+    key = search_key(query, types, limit)
+
+    def load():
+        results = sp_client.search(q=key[0], type=list(key[1]), limit=limit)
+        # Tracks and artists reach the typeahead index through the catalog, albums don't
+        search_index.add_spotify(albums=search_albums(results))
+        return results
+
+    return search_cache.get_or_load("search", key, load)
+
 @app.route("/api/spotify/search")
 def api_spotify_search():
     app.logger.debug("APP: Entered /api/spotify/search route")
@@ -211,65 +376,201 @@ def api_spotify_search():
         app.logger.warn("APP: /api/spotify/search - No query provided.")
         return jsonify({"error": "Search query parameter 'q' is required"}), 400
 
-    app.logger.debug(f"APP: /api/spotify/search - Query: '{query}', Types: {search_types_list}, Limit: {limit_per_type}")
+    app.logger.debug("APP: /api/spotify/search - Query: '%s', Types: %s, Limit: %s", query, search_types_list, limit_per_type)
 
     try:
-        # The sp.search method can take a list of types
-        results = sp.search(q=query, type=search_types_list, limit=limit_per_type)
+        sp_client = get_spotify_client()
+        if not sp_client:
+            return jsonify({"error": "Failed to get Spotify client"}), 500
+
+        # The search method can take a list of types
+        results = cached_search(sp_client, query, search_types_list, limit_per_type)
         app.logger.debug("APP: /api/spotify/search - Search results from Spotify received.")
         
-        # Process results to send a cleaner structure if desired, or send as is
-        # Spotipy returns a dict with keys like 'tracks', 'artists', 'albums',
-        # each containing a Paging Object with an 'items' list.
-        
-        # Example of structuring the response:
-        processed_results = {}
-        if results:
-            if 'tracks' in results and results['tracks']:
-                processed_results['tracks'] = [{
-                    "id": item.get('id'),
-                    "name": item.get('name'),
-                    "artists": [{"name": artist.get('name'), "id": artist.get('id')} for artist in item.get('artists', [])],
-                    "album_name": item.get('album', {}).get('name'),
-                    "image_url": item.get('album', {}).get('images')[0].get('url') if item.get('album', {}).get('images') else None,
-                    "url": item.get('external_urls', {}).get('spotify')
-                } for item in results['tracks'].get('items', [])]
-            
-            if 'artists' in results and results['artists']:
-                processed_results['artists'] = [{
-                    "id": item.get('id'),
-                    "name": item.get('name'),
-                    "image_url": item.get('images')[0].get('url') if item.get('images') else None,
-                    "genres": item.get('genres', []),
-                    "url": item.get('external_urls', {}).get('spotify')
-                } for item in results['artists'].get('items', [])]
-
-            if 'albums' in results and results['albums']:
-                 processed_results['albums'] = [{
-                    "id": item.get('id'),
-                    "name": item.get('name'),
-                    "artists": [{"name": artist.get('name'), "id": artist.get('id')} for artist in item.get('artists', [])],
-                    "image_url": item.get('images')[0].get('url') if item.get('images') else None,
-                    "release_date": item.get('release_date'),
-                    "total_tracks": item.get('total_tracks'),
-                    "url": item.get('external_urls', {}).get('spotify')
-                } for item in results['albums'].get('items', [])]
-
-        return jsonify(processed_results)
+        return jsonify(search_response(results))
 
     except Exception as e:
         app.logger.error(f"APP: /api/spotify/search - Error during Spotify search: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         if hasattr(e, 'http_status') and e.http_status == 401:
              session.clear()
              return jsonify({"error": "Spotify authorization error during search. Please log in again."}), 401
         return jsonify({"error": "Failed to perform search on Spotify"}), 500
+
+# Typeahead results that are enough to answer from the local index alone
+TYPEAHEAD_MIN_RESULTS = int(os.getenv("TYPEAHEAD_MIN_RESULTS", 3))
+TYPEAHEAD_LIMIT = 5
+
+@app.route("/api/search/typeahead")
+def api_search_typeahead():
+    """Suggestions while the user types, answered from the local index when it knows
+    enough matches and from (cached) Spotify searches otherwise"""
+    auth_error = validate_user_token()
+    if auth_error:
+        return auth_error
+
+    query = request.args.get('q', '')
+    kinds = [t.strip() for t in request.args.get('type', 'track,artist,album').split(',') if t.strip() in SEARCH_KINDS]
+    limit = min(max(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), 1), 10)
+    if not kinds:
+        return jsonify({"error": "type must list track, artist or album"}), 400
+
+    # The first typeahead of this worker loads the catalog into the index
+    search_index.warm_in_background(db)
+
+    user = getattr(request, "user", None) or {}
+    boost = library_track_ids(user["id"]) if user.get("id") else frozenset()
+    results = search_index.search(query, kinds, limit, boost)
+    if sum(len(items) for items in results.values()) >= TYPEAHEAD_MIN_RESULTS or len(normalize(query)) < TYPEAHEAD_MIN_QUERY:
+        return jsonify(dict(results, source="index"))
+
+    try:
+        sp_client = get_spotify_client()
+        if not sp_client:
+            return jsonify({"error": "Failed to get Spotify client"}), 500
+        # Search what the index was asked, so the next similar query is answered locally
+        remote = search_response(cached_search(sp_client, query, kinds, limit))
+        return jsonify(dict({SEARCH_KINDS[kind]: remote.get(SEARCH_KINDS[kind], []) for kind in kinds}, source="spotify"))
+    except Exception as e:
+        app.logger.error(f"APP: /api/search/typeahead - Error during Spotify search: {str(e)}")
+        # What the index has beats an error while typing
+        return jsonify(dict(results, source="index"))
+
+# Saved track ids of recent users, which rank first in their typeahead results
+library_ids_cache = TTLCache(1000, {"library_ids": 300})
+
+def library_track_ids(user_id) -> frozenset:
+    try:
+        return library_ids_cache.get_or_load("library_ids", user_id, lambda: library.track_ids(user_id))
+    except Exception as e:
+        app.logger.error(f"APP: Could not load the library of {user_id}: {str(e)}")
+        return frozenset()
     
     
 # Add these routes to your Flask app
 
+# Tracks per deck page unless ?limit= says otherwise
+DECK_PAGE_SIZE = int(os.getenv("DECK_PAGE_SIZE", 20))
+# Generated decks are kept for a while so every page of one walk through a deck
+# comes from the same snapshot instead of being rebuilt, in Mongo for the other workers
+deck_snapshots = DeckSnapshots(
+    db.deck_snapshots, TTLCache(int(os.getenv("DECK_SNAPSHOT_CACHE_SIZE", 2000)), {"deck": DECK_SNAPSHOT_TTL})
+)
+deck_cursors = CursorCodec(app.secret_key)
+
+def get_deck_limit() -> int:
+    return min(max(int(request.args.get('limit', DECK_PAGE_SIZE)), 1), 50)
+
+def deck_page(deck, key, build):
+    """One ?cursor=&limit= page of a generated deck, build() makes the whole deck"""
+    cursor = deck_cursors.decode(request.args.get('cursor'), deck, key)
+    fields = parse_fields(request.args.get('fields'), TRACK_FIELDS)
+    limit = get_deck_limit()
+    # Snapshots hold compact tracks so they stay small
+    tracks = deck_snapshots.get(cursor["s"]) if cursor else None
+    if tracks is None:
+        # First page, or the snapshot expired: the walk starts over on a new one
+        tracks = project_tracks(build())
+        snapshot, offset = deck_snapshots.create(tracks), 0
+    else:
+        snapshot, offset = cursor["s"], cursor["o"]
+    restarted = bool(cursor) and snapshot != cursor["s"]
+    return jsonify(deck_response(deck, key, tracks, snapshot, offset, limit, fields, restarted))
+
+def deck_response(deck, key, tracks, snapshot, offset, limit, fields, restarted) -> dict:
+    """The page of a snapshot at offset, with the cursor to the next one"""
+    next_offset = offset + limit
+    next_cursor = None
+    if next_offset < len(tracks):
+        next_cursor = deck_cursors.encode({"d": deck, "k": key, "s": snapshot, "o": next_offset})
+    return {"tracks": project_tracks(tracks[offset:next_offset], fields), "next_cursor": next_cursor, "restarted": restarted}
+
+def queue_response(deck, user_id, cursor, tracks, generation, fields) -> dict:
+    """A page popped off a queue, with the cursor to the next one. A cursor from before the
+    queue was rebuilt (new ratings) gets the head of the new queue, flagged as a restart."""
+    next_cursor = deck_cursors.encode({"d": deck, "k": user_id, "g": generation}) if tracks else None
+    restarted = bool(cursor) and cursor["g"] != generation
+    return {"tracks": project_tracks(tracks, fields), "next_cursor": next_cursor, "restarted": restarted}
+
+def queue_page(deck, user_id, sp_client):
+    """One ?cursor=&limit= page of a queue-backed deck, pages are popped off the user's queue"""
+    cursor = deck_cursors.decode(request.args.get('cursor'), deck, user_id)
+    fields = parse_fields(request.args.get('fields'), TRACK_FIELDS)
+    tracks, generation = deck_queues.next(user_id, deck, get_deck_limit(), sp_client)
+    return jsonify(queue_response(deck, user_id, cursor, tracks, generation, fields))
+
+def invalid_cursor_response(e):
+    return jsonify({"error": f"Invalid cursor: {str(e)}"}), 400
+
+def invalid_fields_response(e):
+    return jsonify({"error": str(e)}), 400
+
+def compact_deck(build):
+    """Wrap a deck builder so its queue is stored as compact tracks"""
+    return lambda sp_client, user_id: project_tracks(build(sp_client, user_id))
+
+# Popular artists across different genres, for users without saved tracks
+POPULAR_ARTISTS = [
+    "4NHQUGzhtTLFvgF5SZesLK",  # Tame Impala (Psychedelic Rock)
+    "06HL4z0CvFAxyc27GXpf02",  # Taylor Swift (Pop)
+    "3TVXtAsR1Inumwj472S9r4",  # Drake (Hip Hop)
+    "1HY2Jd0NmPuamShAr6KMms",  # Lady Gaga (Pop)
+    "4q3ewBCX7sLwd24UFkeCZp",  # Eminem (Hip Hop)
+    "1dfeR4HaWDbWqFHLkxsg1d",  # Queen (Rock)
+    "7dGJo4pcD2V6oG8kP0tJRR",  # Eminem (Alternative)
+    "0du5cEVh5yTK9QJze8zA0C",  # Bruno Mars (Pop/R&B)
+    "53XhwfbYqKCa1cC15pYq2q",  # Imagine Dragons (Alternative Rock)
+    "1uNFoZAHBGtllmzznpCI3s",  # Justin Bieber (Pop)
+]
+
+def build_discover_deck(sp_client, user_id=None) -> list:
+    """Tracks from the artists in the user's saved tracks, or from popular artists across different genres"""
+    # The most saved artists of the user's whole library, once it is synced
+    artist_ids = discover_artist_ids(library.state_of(user_id)) if user_id else []
+    if not artist_ids:
+        # Get user's saved tracks to understand their taste
+        user_tracks = []
+        try:
+            saved_tracks = sp_client.current_user_saved_tracks(limit=50)
+            user_tracks = [track['track'] for track in saved_tracks['items']]
+        except Exception as e:
+            app.logger.info(f"No saved tracks found or error accessing them: {str(e)}")
+        for track in user_tracks[:20]:  # Use first 20 tracks
+            for artist in track['artists']:
+                if artist['id'] not in artist_ids:
+                    artist_ids.append(artist['id'])
+    
+    # If user has saved tracks, get artists from those
+    if artist_ids:
+        # Get top tracks from these artists in parallel
+        all_tracks = []
+        results = fan_out(
+            lambda artist_id: sp_client.artist_top_tracks(artist_id, country='US'),
+            artist_ids[:10],  # Limit to 10 artists to avoid rate limits
+            on_error=lambda artist_id, e: app.logger.error(f"Error getting top tracks for artist {artist_id}: {str(e)}")
+        )
+        for top_tracks in results:
+            all_tracks.extend(top_tracks['tracks'][:3])  # Top 3 tracks per artist
+        
+        if all_tracks:
+            return all_tracks
+    
+    # Fallback: Get tracks from popular artists across different genres
+    all_tracks = []
+    results = fan_out(
+        lambda artist_id: sp_client.artist_top_tracks(artist_id, country='US'),
+        POPULAR_ARTISTS,
+        on_error=lambda artist_id, e: app.logger.error(f"Error getting top tracks for artist {artist_id}: {str(e)}")
+    )
+    for top_tracks in results:
+        all_tracks.extend(top_tracks['tracks'][:2])  # Top 2 tracks per artist
+    
+    return all_tracks
+
 @app.route('/api/spotify/discover-tracks')
 def discover_tracks():
-    """Get initial tracks from popular artists across different genres"""
+    """Get the next tracks of the user's discover deck"""
     error_response = validate_user_token()
     if error_response:
         return error_response
@@ -279,65 +580,56 @@ def discover_tracks():
         if not sp_client:
             return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Get user's saved tracks to understand their taste
-        user_tracks = []
-        try:
-            saved_tracks = sp_client.current_user_saved_tracks(limit=50)
-            user_tracks = [track['track'] for track in saved_tracks['items']]
-        except Exception as e:
-            app.logger.info(f"No saved tracks found or error accessing them: {str(e)}")
-        
-        # If user has saved tracks, get artists from those
-        if user_tracks:
-            artist_ids = []
-            for track in user_tracks[:20]:  # Use first 20 tracks
-                for artist in track['artists']:
-                    if artist['id'] not in artist_ids:
-                        artist_ids.append(artist['id'])
-            
-            # Get top tracks from these artists
-            all_tracks = []
-            for artist_id in artist_ids[:10]:  # Limit to 10 artists to avoid rate limits
-                try:
-                    top_tracks = sp_client.artist_top_tracks(artist_id, country='US')
-                    all_tracks.extend(top_tracks['tracks'][:3])  # Top 3 tracks per artist
-                except Exception as e:
-                    app.logger.error(f"Error getting top tracks for artist {artist_id}: {str(e)}")
-                    continue
-            
-            if all_tracks:
-                return jsonify({"tracks": all_tracks})
+        user_id = get_current_user_id(sp_client)
+        if not user_id:
+            return jsonify({"error": "Could not identify user. Please log in again."}), 401
         
-        # Fallback: Get tracks from popular artists across different genres
-        # Define some popular artist IDs across different genres
-        popular_artists = [
-            "4NHQUGzhtTLFvgF5SZesLK",  # Tame Impala (Psychedelic Rock)
-            "06HL4z0CvFAxyc27GXpf02",  # Taylor Swift (Pop)
-            "3TVXtAsR1Inumwj472S9r4",  # Drake (Hip Hop)
-            "1HY2Jd0NmPuamShAr6KMms",  # Lady Gaga (Pop)
-            "4q3ewBCX7sLwd24UFkeCZp",  # Eminem (Hip Hop)
-            "1dfeR4HaWDbWqFHLkxsg1d",  # Queen (Rock)
-            "7dGJo4pcD2V6oG8kP0tJRR",  # Eminem (Alternative)
-            "0du5cEVh5yTK9QJze8zA0C",  # Bruno Mars (Pop/R&B)
-            "53XhwfbYqKCa1cC15pYq2q",  # Imagine Dragons (Alternative Rock)
-            "1uNFoZAHBGtllmzznpCI3s",  # Justin Bieber (Pop)
-        ]
-        
-        all_tracks = []
-        for artist_id in popular_artists:
-            try:
-                top_tracks = sp_client.artist_top_tracks(artist_id, country='US')
-                all_tracks.extend(top_tracks['tracks'][:2])  # Top 2 tracks per artist
-            except Exception as e:
-                app.logger.error(f"Error getting top tracks for artist {artist_id}: {str(e)}")
-                continue
-        
-        return jsonify({"tracks": all_tracks})
+        # Served from the user's precomputed queue, refilled in the background
+        return queue_page("discover", user_id, sp_client)
         
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    except InvalidFields as e:
+        return invalid_fields_response(e)
     except Exception as e:
         app.logger.error(f"Error in discover_tracks: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to fetch tracks"}), 500
 
+def build_artist_deck(sp_client, artist_id) -> list:
+    """Top tracks of an artist followed by tracks from their albums"""
+    # Get artist's top tracks
+    top_tracks = sp_client.artist_top_tracks(artist_id, country='US')
+    
+    # Get artist's albums and more tracks
+    albums = sp_client.artist_albums(artist_id, album_type='album,single', limit=10)
+    album_ids = [album['id'] for album in albums['items']]
+    album_tracks = []
+    
+    # Fetch the full albums in bulk (up to 20 per call) instead of one album_tracks call per album
+    for start in range(0, len(album_ids), ALBUMS_BATCH_SIZE):
+        batch = album_ids[start:start + ALBUMS_BATCH_SIZE]
+        try:
+            full_albums = sp_client.albums(batch)
+        except Exception as e:
+            app.logger.error(f"Error getting tracks from albums {','.join(batch)}: {str(e)}")
+            continue
+        
+        for album in full_albums['albums']:
+            if not album:  # Spotify returns null for ids it can't find
+                continue
+            for track in album.get('tracks', {}).get('items', [])[:5]:
+                # Add album info to track
+                album_tracks.append(dict(track, album={
+                    'id': album['id'],
+                    'name': album['name'],
+                    'images': album['images']
+                }))
+    
+    # Combine top tracks and album tracks
+    return top_tracks['tracks'] + album_tracks
+
 @app.route('/api/spotify/artist-tracks/<artist_id>')
 def get_artist_tracks(artist_id):
     """Get more tracks from a specific artist"""
@@ -350,37 +642,37 @@ def get_artist_tracks(artist_id):
         if not sp_client:
             return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Get artist's top tracks
-        top_tracks = sp_client.artist_top_tracks(artist_id, country='US')
-        
-        # Get artist's albums and more tracks
-        albums = sp_client.artist_albums(artist_id, album_type='album,single', limit=10)
-        album_tracks = []
-        
-        for album in albums['items']:
-            try:
-                tracks = sp_client.album_tracks(album['id'], limit=5)
-                for track in tracks['items']:
-                    # Add album info to track
-                    track['album'] = {
-                        'id': album['id'],
-                        'name': album['name'],
-                        'images': album['images']
-                    }
-                    album_tracks.append(track)
-            except Exception as e:
-                app.logger.error(f"Error getting tracks from album {album['id']}: {str(e)}")
-                continue
-        
-        # Combine top tracks and album tracks
-        all_tracks = top_tracks['tracks'] + album_tracks
-        
-        return jsonify({"tracks": all_tracks})
+        return deck_page("artist", artist_id, lambda: build_artist_deck(sp_client, artist_id))
         
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    except InvalidFields as e:
+        return invalid_fields_response(e)
     except Exception as e:
         app.logger.error(f"Error getting artist tracks: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to fetch artist tracks"}), 500
 
+def build_genre_deck(sp_client, genre) -> list:
+    """Top tracks of artists in a genre"""
+    # Search for artists in the genre
+    search_results = sp_client.search(
+        q=f'genre:"{genre}"', 
+        type='artist', 
+        limit=10
+    )
+    
+    all_tracks = []
+    results = fan_out(
+        lambda artist: sp_client.artist_top_tracks(artist['id'], country='US'),
+        search_results['artists']['items'],
+        on_error=lambda artist, e: app.logger.error(f"Error getting top tracks for artist {artist['id']}: {str(e)}")
+    )
+    for top_tracks in results:
+        all_tracks.extend(top_tracks['tracks'][:3])  # Top 3 tracks per artist
+    return all_tracks
+
 @app.route('/api/spotify/genre-tracks/<genre>')
 def get_genre_tracks(genre):
     """Get tracks from artists in a specific genre"""
@@ -393,28 +685,33 @@ def get_genre_tracks(genre):
         if not sp_client:
             return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Search for artists in the genre
-        search_results = sp_client.search(
-            q=f'genre:"{genre}"', 
-            type='artist', 
-            limit=10
-        )
-        
-        all_tracks = []
-        for artist in search_results['artists']['items']:
-            try:
-                top_tracks = sp_client.artist_top_tracks(artist['id'], country='US')
-                all_tracks.extend(top_tracks['tracks'][:3])  # Top 3 tracks per artist
-            except Exception as e:
-                app.logger.error(f"Error getting top tracks for artist {artist['id']}: {str(e)}")
-                continue
-        
-        return jsonify({"tracks": all_tracks})
+        return deck_page("genre", genre, lambda: build_genre_deck(sp_client, genre))
         
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    except InvalidFields as e:
+        return invalid_fields_response(e)
     except Exception as e:
         app.logger.error(f"Error getting genre tracks: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to fetch genre tracks"}), 500
 
+def build_similar_artists_deck(sp_client, artist_id) -> list:
+    """Top tracks of artists related to the given artist"""
+    # Get related artists
+    related_artists = sp_client.artist_related_artists(artist_id)
+    
+    all_tracks = []
+    results = fan_out(
+        lambda artist: sp_client.artist_top_tracks(artist['id'], country='US'),
+        related_artists['artists'][:10],  # Limit to 10 related artists
+        on_error=lambda artist, e: app.logger.error(f"Error getting top tracks for related artist {artist['id']}: {str(e)}")
+    )
+    for top_tracks in results:
+        all_tracks.extend(top_tracks['tracks'][:2])  # Top 2 tracks per artist
+    return all_tracks
+
 @app.route('/api/spotify/similar-artists/<artist_id>')
 def get_similar_artists_tracks(artist_id):
     """Get tracks from artists similar to the given artist"""
@@ -427,24 +724,56 @@ def get_similar_artists_tracks(artist_id):
         if not sp_client:
             return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Get related artists
-        related_artists = sp_client.artist_related_artists(artist_id)
-        
-        all_tracks = []
-        for artist in related_artists['artists'][:10]:  # Limit to 10 related artists
-            try:
-                top_tracks = sp_client.artist_top_tracks(artist['id'], country='US')
-                all_tracks.extend(top_tracks['tracks'][:2])  # Top 2 tracks per artist
-            except Exception as e:
-                app.logger.error(f"Error getting top tracks for related artist {artist['id']}: {str(e)}")
-                continue
-        
-        return jsonify({"tracks": all_tracks})
+        return deck_page("similar", artist_id, lambda: build_similar_artists_deck(sp_client, artist_id))
         
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    except InvalidFields as e:
+        return invalid_fields_response(e)
     except Exception as e:
         app.logger.error(f"Error getting similar artists tracks: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to fetch similar artists tracks"}), 500
 
+# Most ratings one /api/feedback/batch request may carry
+MAX_FEEDBACK_BATCH = 100
+
+def feedback_documents(user_id, ratings, tracks) -> list:
+    """The feedback documents for the ratings of tracks we know, tracks maps ids to catalog docs"""
+    now = datetime.now(timezone.utc)
+    feedback_docs = []
+    for item in ratings:
+        track_info = tracks.get(item['track_id'])
+        if not track_info:
+            continue
+        feedback_docs.append({
+            "user_id": user_id,
+            "track_id": item['track_id'],
+            "rating": item['rating'],
+            "track_name": track_info['name'],
+            "artists": [{"id": artist['id'], "name": artist['name']} for artist in track_info['artists']],
+            "timestamp": now
+        })
+    return feedback_docs
+
+def queue_feedback(user_id, ratings, sp_client) -> list:
+    """Hand ratings to the write-behind queue and return the ids of the tracks that were accepted"""
+    # Get track info to store artist data, Spotify is only asked for tracks the catalog doesn't have
+    tracks = catalog.get_tracks([item['track_id'] for item in ratings], sp_client)
+    feedback_docs = feedback_documents(user_id, ratings, tracks)
+
+    # Upserted by (user_id, track_id) when the queue flushes
+    feedback_writer.submit(feedback_docs)
+    if feedback_docs:
+        # New feedback changes the ranking, rebuild the personalized deck in the background
+        deck_queues.request_refill(user_id, "personalized", sp_client, reset=True)
+    return [doc['track_id'] for doc in feedback_docs]
+
+def feedback_backpressure_response(e):
+    app.logger.warning(f"Feedback queue is full: {str(e)}")
+    return jsonify({"error": "Too much feedback is waiting to be stored, please retry shortly."}), 503, {"Retry-After": "1"}
+
 # Store user preferences for better recommendations
 @app.route('/api/feedback/<track_id>', methods=['PUT'])
 def store_feedback(track_id):
@@ -458,9 +787,10 @@ def store_feedback(track_id):
         if not sp_client:
             return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Get user info
-        user_info = sp_client.current_user()
-        user_id = user_info['id']
+        # Get user id without a Spotify round-trip
+        user_id = get_current_user_id(sp_client)
+        if not user_id:
+            return jsonify({"error": "Could not identify user. Please log in again."}), 401
         
         data = request.get_json()
         rating = data.get('rating')  # 'like' or 'dislike'
@@ -468,112 +798,172 @@ def store_feedback(track_id):
         if rating not in ['like', 'dislike']:
             return jsonify({"error": "Invalid rating"}), 400
         
-        # Get track info to store artist and genre data
-        track_info = sp_client.track(track_id)
-        
-        # Store feedback in database
-        feedback_data = {
-            "user_id": user_id,
-            "track_id": track_id,
-            "rating": rating,
-            "track_name": track_info['name'],
-            "artists": [{"id": artist['id'], "name": artist['name']} for artist in track_info['artists']],
-            "timestamp": datetime.now(timezone.utc)
-        }
-        
-        # Upsert feedback (update if exists, insert if doesn't)
-        db.user_feedback.update_one(
-            {"user_id": user_id, "track_id": track_id},
-            {"$set": feedback_data},
-            upsert=True
-        )
+        # Same pipeline as the batch endpoint, with a single rating
+        if not queue_feedback(user_id, [{"track_id": track_id, "rating": rating}], sp_client):
+            return jsonify({"error": "Track not found"}), 404
         
         return jsonify({"message": "Feedback stored successfully"})
         
+    except FeedbackBackpressure as e:
+        return feedback_backpressure_response(e)
     except Exception as e:
         app.logger.error(f"Error storing feedback: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to store feedback"}), 500
 
-@app.route('/api/spotify/personalized-tracks')
-def get_personalized_tracks():
-    """Get tracks based on user's previous likes"""
+@app.route('/api/feedback/batch', methods=['POST'])
+def store_feedback_batch():
+    """Store many likes/dislikes at once, e.g. {"ratings": [{"track_id": "...", "rating": "like"}]}"""
     error_response = validate_user_token()
     if error_response:
         return error_response
     
+    data = request.get_json(silent=True) or {}
+    ratings = data.get('ratings')
+    if not isinstance(ratings, list) or not ratings:
+        return jsonify({"error": "A non-empty 'ratings' list is required"}), 400
+    if len(ratings) > MAX_FEEDBACK_BATCH:
+        return jsonify({"error": f"At most {MAX_FEEDBACK_BATCH} ratings per request"}), 400
+    for item in ratings:
+        if not isinstance(item, dict) or not item.get('track_id') or item.get('rating') not in ['like', 'dislike']:
+            return jsonify({"error": "Each rating needs a track_id and a rating of 'like' or 'dislike'"}), 400
+    
     try:
         sp_client = get_spotify_client()
         if not sp_client:
             return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Get user info
-        user_info = sp_client.current_user()
-        user_id = user_info['id']
+        user_id = get_current_user_id(sp_client)
+        if not user_id:
+            return jsonify({"error": "Could not identify user. Please log in again."}), 401
         
-        # Get user's liked tracks from database
-        liked_feedback = list(db.user_feedback.find({
-            "user_id": user_id,
-            "rating": "like"
-        }).sort("timestamp", -1).limit(20))
+        accepted = queue_feedback(user_id, ratings, sp_client)
+        rejected = sorted({item['track_id'] for item in ratings} - set(accepted))
         
-        if not liked_feedback:
-            # If no likes yet, fall back to discover_tracks
-            return discover_tracks()
+        # 202: the ratings are queued and will be written shortly
+        return jsonify({"accepted": len(accepted), "rejected": rejected}), 202
         
-        # Extract artist IDs from liked tracks
-        artist_ids = []
-        for feedback in liked_feedback:
-            for artist in feedback['artists']:
-                if artist['id'] not in artist_ids:
-                    artist_ids.append(artist['id'])
-        
-        all_tracks = []
-        
-        # Get more tracks from liked artists
-        for artist_id in artist_ids[:10]:  # Limit to prevent rate limits
-            try:
-                top_tracks = sp_client.artist_top_tracks(artist_id, country='US')
-                all_tracks.extend(top_tracks['tracks'][:3])
-                
-                # Also get tracks from related artists
-                related_artists = sp_client.artist_related_artists(artist_id)
-                for related_artist in related_artists['artists'][:3]:  # 3 related artists
-                    related_top_tracks = sp_client.artist_top_tracks(related_artist['id'], country='US')
-                    all_tracks.extend(related_top_tracks['tracks'][:2])  # 2 tracks each
-                    
-            except Exception as e:
-                app.logger.error(f"Error getting personalized tracks for artist {artist_id}: {str(e)}")
-                continue
+    except FeedbackBackpressure as e:
+        return feedback_backpressure_response(e)
+    except Exception as e:
+        app.logger.error(f"Error storing feedback batch: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
+        return jsonify({"error": "Failed to store feedback"}), 500
+
+# Most ratings the recommender reads per user, newest first
+FEEDBACK_HISTORY_LIMIT = int(os.getenv("FEEDBACK_HISTORY_LIMIT", 5000))
+
+def build_personalized_deck(sp_client, user_id) -> list:
+    """Tracks ranked by the user's previous likes and dislikes"""
+    # Build the user's artist affinity from all their likes and dislikes
+    feedback = db.user_feedback.find(
+        {"user_id": user_id},
+        {"_id": 0, "track_id": 1, "rating": 1, "timestamp": 1, "artists": 1}
+    ).sort("timestamp", -1).limit(FEEDBACK_HISTORY_LIMIT)
+    affinity = ArtistAffinity.from_feedback(feedback)
+    
+    # Seed the candidate pool with the artists the user likes most
+    artist_ids = affinity.top_artists(10)
+    if not artist_ids:
+        # If no likes yet, fall back to the discover deck
+        return build_discover_deck(sp_client, user_id)
+    
+    def log_artist_error(artist_id, e):
+        app.logger.error(f"Error getting personalized tracks for artist {artist_id}: {str(e)}")
+
+    # Get top tracks and related artists for the liked artists in parallel
+    liked_results = fan_out(
+        lambda artist_id: (
+            artist_id,
+            sp_client.artist_top_tracks(artist_id, country='US'),
+            sp_client.artist_related_artists(artist_id)
+        ),
+        artist_ids,  # Limited to 10 to prevent rate limits
+        on_error=log_artist_error
+    )
+
+    # Then get tracks from 3 related artists of each liked artist in one more parallel round
+    related_ids = []
+    for _, _, related_artists in liked_results:
+        for related_artist in related_artists['artists'][:3]:
+            related_ids.append(related_artist['id'])
+    related_results = dict(fan_out(
+        lambda related_id: (related_id, sp_client.artist_top_tracks(related_id, country='US')),
+        list(dict.fromkeys(related_ids)),
+        on_error=log_artist_error
+    ))
+
+    all_tracks = []
+    for _, top_tracks, related_artists in liked_results:
+        all_tracks.extend(top_tracks['tracks'][:3])
+        for related_artist in related_artists['artists'][:3]:
+            if related_artist['id'] in related_results:
+                all_tracks.extend(related_results[related_artist['id']]['tracks'][:2])  # 2 tracks each
+    
+    # Score the candidates against the affinity, dropping duplicates and tracks the user already rated
+    return affinity.rank(all_tracks)
+
+# Per-user deck queues, refilled in the background. Pending feedback is flushed
+# first so a rebuild after a swipe already sees it.
+deck_queues = DeckQueues(
+    db.deck_queues,
+    {"discover": compact_deck(build_discover_deck), "personalized": compact_deck(build_personalized_deck)},
+    before_refill=feedback_writer.flush
+)
+
+@app.route('/api/spotify/personalized-tracks')
+def get_personalized_tracks():
+    """Get the next tracks of the user's personalized deck"""
+    error_response = validate_user_token()
+    if error_response:
+        return error_response
+    
+    try:
+        sp_client = get_spotify_client()
+        if not sp_client:
+            return jsonify({"error": "Failed to get Spotify client"}), 500
         
-        # Remove duplicates based on track ID
-        seen_tracks = set()
-        unique_tracks = []
-        for track in all_tracks:
-            if track['id'] not in seen_tracks:
-                seen_tracks.add(track['id'])
-                unique_tracks.append(track)
+        # Get user id without a Spotify round-trip
+        user_id = get_current_user_id(sp_client)
+        if not user_id:
+            return jsonify({"error": "Could not identify user. Please log in again."}), 401
         
-        return jsonify({"tracks": unique_tracks})
+        # Served from the user's precomputed queue, rebuilt in the background after new feedback
+        return queue_page("personalized", user_id, sp_client)
         
+    except InvalidCursor as e:
+        return invalid_cursor_response(e)
+    except InvalidFields as e:
+        return invalid_fields_response(e)
     except Exception as e:
         app.logger.error(f"Error getting personalized tracks: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to fetch personalized tracks"}), 500
     
 	
 @app.route("/api/save/<track_id>", methods=["PUT"])
 def save_track(track_id):
-    app.logger.debug(f"APP: Entered /api/save/{track_id} route")
+    app.logger.debug("APP: Entered /api/save/%s route", track_id)
 
     auth_error = validate_user_token()
     if auth_error:
         return auth_error
     
     try:
-        sp.current_user_saved_tracks_add([track_id])
-        app.logger.debug(f"APP: /api/save - successfully saved track {track_id} for user")
+        sp_client = get_spotify_client()
+        if not sp_client:
+            return jsonify({"error": "Failed to get Spotify client"}), 500
+
+        sp_client.current_user_saved_tracks_add([track_id])
+        app.logger.debug("APP: /api/save - successfully saved track %s for user", track_id)
         return jsonify({"success": True, "message": f"Track {track_id} saved successfully"}), 200
     except Exception as e:
         app.logger.error(f"APP: /api/save - Error saving track {track_id}: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
 
         return jsonify({"error": f"Failed to save track {track_id}"}), 500
 
@@ -588,12 +978,12 @@ def save_track(track_id):
 
 @app.before_request
 def user():
-    app.logger.debug(f"APP: @before_request triggered for path: {request.path}")
-    app.logger.debug(f"APP: @before_request - Incoming request headers: {request.headers}") 
-    app.logger.debug(f"APP: @before_request - Full session data at start: {dict(session)}")
+    app.logger.debug("APP: @before_request triggered for path: %s", request.path)
+    app.logger.debug("APP: @before_request - Incoming request headers: %s", request.headers)
+    app.logger.debug("APP: @before_request - Full session data at start: %s", session)
     if "user" in session:
         request.user = session["user"]
-        app.logger.debug(f"APP: @before_request - User successfully loaded from session: {request.user}")
+        app.logger.debug("APP: @before_request - User successfully loaded from session: %s", request.user)
     else:
         request.user = None
         app.logger.debug("APP: @before_request - No 'user' key found in session for this request.")
@@ -610,25 +1000,135 @@ def logout():
 
 @app.route("/api/me")
 def get_me():
-    app.logger.debug(f"APP: Entered /api/me. Current session data: {dict(session)}") 
-    app.logger.debug(f"APP: /api/me - request.user (set by @app.before_request) is: {request.user}")
+    app.logger.debug("APP: Entered /api/me. Current session data: %s", session)
+    app.logger.debug("APP: /api/me - request.user (set by @app.before_request) is: %s", request.user)
     return jsonify(request.user)
 
 @app.route('/')
 @app.route('/<path:path>')
 def serve_frontend(path=''):
-    if path != '' and os.path.exists(os.path.join(static_path,path)):
-        return send_from_directory(static_path, path)
-    return send_from_directory(template_path, 'index.html')
+    asset = frontend_files.get(path)
+    if asset:
+        return send_asset(asset)
+    # A missing file is a 404, not the app: a stale page asking for an old hashed bundle
+    # must not get index.html back as JavaScript
+    if is_asset_path(path):
+        abort(404)
+    index = frontend_pages.get('index.html')
+    if not index:
+        abort(404)
+    return send_asset(index)
 
 @app.route('/login')
 def login_frontend():
     return send_from_directory(template_path, 'login.html')
 
+# Creates the MongoDB indexes and applies pending schema migrations: `flask --app app migrate`
+@app.cli.command("migrate")
+def migrate_command():
+    applied = migrate(db)
+    print(f"Applied migrations: {applied or 'none'}. Schema version is {schema_version(db)}.")
+
+# Cache hit rates, the Spotify budget and the typeahead index, read when scraped
+registry.collector(cache_collector(
+    {"artist": artist_cache, "browse": browse_cache, "search": search_cache,
+     "library_ids": library_ids_cache, "deck_snapshots": deck_snapshots.cache},
+    budget=spotify_budget, index=search_index
+))
+
+# Prometheus metrics of this worker
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+# Liveness: the process is up and serving requests
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+# Longest a readiness check waits on Mongo
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", 2))
+
+# Readiness: Mongo answers and the schema is migrated, so this worker can take traffic
+@app.route("/readyz")
+def readyz():
+    checks = {}
+    try:
+        with mongo_timeout(READINESS_TIMEOUT):
+            mongo.admin.command("ping")
+            checks["mongo"] = "ok"
+            version = schema_version(db)
+        checks["schema"] = "ok" if version >= LATEST_VERSION else f"at version {version}, expected {LATEST_VERSION}"
+    except Exception as e:
+        app.logger.error(f"APP: /readyz - Mongo check failed: {str(e)}")
+        checks.setdefault("mongo", "unavailable")
+        checks["schema"] = "unknown"
+    ready = all(status == "ok" for status in checks.values())
+    return jsonify({"status": "ready" if ready else "not ready", "checks": checks}), 200 if ready else 503
+
 @app.route("/test-mongo")
 def test_mongo():
     return jsonify({"collections": db.list_collection_names()})
 
+def cached_json_response(body: dict, cached):
+    """A JSON response that browsers may reuse while the cached data behind it is fresh.
+    A request whose If-None-Match still matches gets a bodiless 304 instead."""
+    now = time.time()
+    response = jsonify(body)
+    # private: only the user's own browser may keep it, the route needs a login
+    response.headers["Cache-Control"] = f"private, max-age={cached.max_age(now)}, stale-while-revalidate={BROWSE_CACHE_STALE}"
+    response.headers["Age"] = str(cached.age(now))
+    response.add_etag()
+    return response.make_conditional(request)
+
+def browse_categories_page(limit: int, offset: int, country=None, locale=None):
+    """One page of Spotify's browse categories and the cache entry it came from"""
+    # Build parameters dictionary
+    params = {
+        'limit': limit,
+        'offset': offset
+    }
+    if locale:
+        params['locale'] = locale
+    if country:
+        params['country'] = country
+
+    # Call Spotify's browse categories endpoint, unless another request already did
+    cached = browse_cache.get_or_load("categories", (limit, offset, country, locale), lambda: browse_client.categories(**params))
+    categories_result = cached.value
+    app.logger.debug("APP: browse categories - Categories fetched: %s", 'Data received' if categories_result else 'No data')
+
+    categories_data = []
+    if categories_result and categories_result.get('categories') and categories_result['categories'].get('items'):
+        for item in categories_result['categories']['items']:
+            # Get the first icon URL if available
+            icon_url = None
+            if item.get('icons') and len(item['icons']) > 0:
+                icon_url = item['icons'][0].get('url')
+
+            category_info = {
+                "id": item.get('id'),
+                "name": item.get('name'),
+                "href": item.get('href'),
+                "icons": item.get('icons', []),
+                "image": icon_url  # For easier frontend access
+            }
+            categories_data.append(category_info)
+
+    app.logger.debug("APP: browse categories - Processed %s categories.", len(categories_data))
+
+    # Return the data in a format similar to your existing endpoints
+    categories_info = categories_result.get('categories', {}) if categories_result else {}
+    return {
+        "items": categories_data,
+        "total": categories_info.get('total', 0),
+        "limit": categories_info.get('limit', limit),
+        "offset": categories_info.get('offset', offset),
+        "next": categories_info.get('next'),
+        "previous": categories_info.get('previous'),
+        "href": categories_info.get('href')
+    }, cached
+
 @app.route("/api/browse-categories")
 def api_get_browse_categories():
     app.logger.debug("APP: Entered /api/browse-categories route")
@@ -641,61 +1141,86 @@ def api_get_browse_categories():
     limit = int(request.args.get('limit', 20))  # Default to 20, max 50
     offset = int(request.args.get('offset', 0))  # Default to 0
     locale = request.args.get('locale', None)  # Optional locale parameter
+    country = request.args.get('country', None)  # Optional market
     
     # Ensure limit is within Spotify's bounds
     limit = min(max(limit, 1), 50)
 
     try:
-        # Call Spotify's browse categories endpoint
-        # Build parameters dictionary
-        params = {
-            'limit': limit,
-            'offset': offset
-        }
-        if locale:
-            params['locale'] = locale
-
-        categories_result = sp.categories(**params)
-        app.logger.debug(f"APP: /api/browse-categories - Categories fetched from Spotify: {'Data received' if categories_result else 'No data'}")
-
-        categories_data = []
-        if categories_result and categories_result.get('categories') and categories_result['categories'].get('items'):
-            for item in categories_result['categories']['items']:
-                # Get the first icon URL if available
-                icon_url = None
-                if item.get('icons') and len(item['icons']) > 0:
-                    icon_url = item['icons'][0].get('url')
-
-                category_info = {
-                    "id": item.get('id'),
-                    "name": item.get('name'),
-                    "href": item.get('href'),
-                    "icons": item.get('icons', []),
-                    "image": icon_url  # For easier frontend access
-                }
-                categories_data.append(category_info)
-
-        app.logger.debug(f"APP: /api/browse-categories - Processed {len(categories_data)} categories.")
-        
-        # Return the data in a format similar to your existing endpoints
-        categories_info = categories_result.get('categories', {}) if categories_result else {}
-        return jsonify({
-            "items": categories_data,
-            "total": categories_info.get('total', 0),
-            "limit": categories_info.get('limit', limit),
-            "offset": categories_info.get('offset', offset),
-            "next": categories_info.get('next'),
-            "previous": categories_info.get('previous'),
-            "href": categories_info.get('href')
-        })
-
+        return cached_json_response(*browse_categories_page(limit, offset, country, locale))
     except Exception as e:
         app.logger.error(f"APP: /api/browse-categories - Error fetching browse categories: {str(e)}")
-        if hasattr(e, 'http_status') and e.http_status == 401:  # Spotify API returned 401
-            session.clear() 
-            return jsonify({"error": "Spotify authorization error. Please log in again."}), 401
+        if is_throttled(e):
+            return spotify_busy_response(e)
         return jsonify({"error": "Failed to fetch browse categories from Spotify"}), 500
 
+def library_track(track, added_at) -> dict:
+    """The flat track shape the home page lists the user's tracks with"""
+    album = track.get('album', {})
+    return {
+        "id": track.get('id'),
+        "name": track.get('name'),
+        "artists": ", ".join(artist.get('name', '') for artist in track.get('artists', [])),
+        "album_name": album.get('name'),
+        "image": first_image_url(album.get('images')),
+        "added_at": added_at,
+        "duration_ms": track.get('duration_ms'),
+        "url": spotify_url(track),
+        "preview_url": track.get('preview_url'),
+        "popularity": track.get('popularity', 0)
+    }
+
+def synced_tracks_page(user_id, state: dict, limit: int, offset: int) -> dict:
+    """user_tracks_page() from the user's synced library, without asking Spotify"""
+    saved = library.saved_page(user_id, limit, offset)
+    if saved or state.get("saved_total"):
+        tracks_data = [library_track(track, added_at) for track, added_at in saved]
+        total, source = state["saved_total"], "saved_tracks"
+    else:
+        tracks_data = [library_track(track, None) for track in state.get("top_tracks", [])[:limit]]
+        total, source = len(tracks_data), "top_tracks"
+    return {"items": tracks_data, "total": total, "limit": limit, "offset": offset, "source": source}
+
+def user_tracks_page(sp_client, limit: int, offset: int, user_id=None) -> dict:
+    """The user's saved tracks, or their top tracks if they have saved none"""
+    # Served from the synced library when there is one, kept up to date in the background
+    if user_id:
+        state = library.state_of(user_id)
+        if library.is_stale(state):
+            library.request_sync(user_id, sp_client)
+        if state:
+            return synced_tracks_page(user_id, state, limit, offset)
+
+    # Not synced yet, ask Spotify
+    # First try to get user's saved tracks (using existing scope user-library-read)
+    saved_tracks_result = sp_client.current_user_saved_tracks(limit=limit, offset=offset)
+    app.logger.debug("APP: user tracks - User's saved tracks fetched from Spotify: %s", 'Data received' if saved_tracks_result else 'No data')
+
+    tracks_data = []
+    if saved_tracks_result and saved_tracks_result.get('items'):
+        for item in saved_tracks_result['items']:
+            tracks_data.append(library_track(item.get('track', {}), item.get('added_at')))
+
+    # If no saved tracks, fall back to top tracks (using existing scope user-top-read)
+    if not tracks_data:
+        app.logger.debug("APP: user tracks - No saved tracks found, falling back to top tracks")
+        top_tracks_result = sp_client.current_user_top_tracks(limit=limit, time_range="short_term")
+        
+        if top_tracks_result and top_tracks_result.get('items'):
+            for track in top_tracks_result['items']:
+                tracks_data.append(library_track(track, None))  # Top tracks don't have added_at
+
+    app.logger.debug("APP: user tracks - Processed %s user tracks.", len(tracks_data))
+    
+    # Return the data in a format consistent with your existing endpoints
+    return {
+        "items": tracks_data,
+        "total": len(tracks_data),
+        "limit": limit,
+        "offset": offset,
+        "source": "saved_tracks" if saved_tracks_result and saved_tracks_result.get('items') else "top_tracks"
+    }
+
 @app.route("/api/user-tracks")
 def api_get_user_tracks():
     app.logger.debug("APP: Entered /api/user-tracks route")
@@ -712,81 +1237,48 @@ def api_get_user_tracks():
     limit = min(max(limit, 1), 50)
 
     try:
-        # First try to get user's saved tracks (using existing scope user-library-read)
-        saved_tracks_result = sp.current_user_saved_tracks(limit=limit, offset=offset)
-        app.logger.debug(f"APP: /api/user-tracks - User's saved tracks fetched from Spotify: {'Data received' if saved_tracks_result else 'No data'}")
-
-        tracks_data = []
-        if saved_tracks_result and saved_tracks_result.get('items'):
-            for item in saved_tracks_result['items']:
-                track = item.get('track', {})
-                album = track.get('album', {})
-                
-                # Get the first image URL if available
-                image_url = None
-                if album.get('images') and len(album['images']) > 0:
-                    image_url = album['images'][0].get('url')
-
-                track_info = {
-                    "id": track.get('id'),
-                    "name": track.get('name'),
-                    "artists": ", ".join(artist.get('name', '') for artist in track.get('artists', [])),
-                    "album_name": album.get('name'),
-                    "image": image_url,
-                    "added_at": item.get('added_at'),
-                    "duration_ms": track.get('duration_ms'),
-                    "url": track.get('external_urls', {}).get('spotify'),
-                    "preview_url": track.get('preview_url'),
-                    "popularity": track.get('popularity', 0)
-                }
-                tracks_data.append(track_info)
-
-        # If no saved tracks, fall back to top tracks (using existing scope user-top-read)
-        if not tracks_data:
-            app.logger.debug("APP: /api/user-tracks - No saved tracks found, falling back to top tracks")
-            top_tracks_result = sp.current_user_top_tracks(limit=limit, time_range="short_term")
-            
-            if top_tracks_result and top_tracks_result.get('items'):
-                for track in top_tracks_result['items']:
-                    album = track.get('album', {})
-                    
-                    # Get the first image URL if available
-                    image_url = None
-                    if album.get('images') and len(album['images']) > 0:
-                        image_url = album['images'][0].get('url')
-
-                    track_info = {
-                        "id": track.get('id'),
-                        "name": track.get('name'),
-                        "artists": ", ".join(artist.get('name', '') for artist in track.get('artists', [])),
-                        "album_name": album.get('name'),
-                        "image": image_url,
-                        "added_at": None,  # Top tracks don't have added_at
-                        "duration_ms": track.get('duration_ms'),
-                        "url": track.get('external_urls', {}).get('spotify'),
-                        "preview_url": track.get('preview_url'),
-                        "popularity": track.get('popularity', 0)
-                    }
-                    tracks_data.append(track_info)
-
-        app.logger.debug(f"APP: /api/user-tracks - Processed {len(tracks_data)} user tracks.")
-        
-        # Return the data in a format consistent with your existing endpoints
-        return jsonify({
-            "items": tracks_data,
-            "total": len(tracks_data),
-            "limit": limit,
-            "offset": offset,
-            "source": "saved_tracks" if saved_tracks_result and saved_tracks_result.get('items') else "top_tracks"
-        })
+        sp_client = get_spotify_client()
+        if not sp_client:
+            return jsonify({"error": "Failed to get Spotify client"}), 500
+
+        return jsonify(user_tracks_page(sp_client, limit, offset, get_current_user_id(sp_client)))
 
     except Exception as e:
         app.logger.error(f"APP: /api/user-tracks - Error fetching user tracks: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
         if hasattr(e, 'http_status') and e.http_status == 401:  # Spotify API returned 401
             session.clear() 
             return jsonify({"error": "Spotify authorization error. Please log in again."}), 401
         return jsonify({"error": "Failed to fetch user tracks from Spotify"}), 500
 
+def new_releases_page(limit: int, offset: int, country=None, fields=DEFAULT_ALBUM_FIELDS):
+    """One page of Spotify's new releases and the cache entry it came from"""
+    # Call Spotify's browse new releases endpoint, unless another request already did
+    cached = browse_cache.get_or_load(
+        "new_releases", (limit, offset, country),
+        lambda: browse_client.new_releases(country=country, limit=limit, offset=offset)
+    )
+    new_releases_result = cached.value
+    app.logger.debug("APP: new releases - New releases fetched: %s", 'Data received' if new_releases_result else 'No data')
+
+    releases_data = []
+    if new_releases_result and new_releases_result.get('albums') and new_releases_result['albums'].get('items'):
+        # available_markets is left out unless asked for with ?fields=
+        releases_data = project_albums(new_releases_result['albums']['items'], fields)
+
+    app.logger.debug("APP: new releases - Processed %s new releases.", len(releases_data))
+    
+    # Return the data in a format similar to your existing endpoints
+    return {
+        "items": releases_data,
+        "total": new_releases_result.get('albums', {}).get('total', 0),
+        "limit": limit,
+        "offset": offset,
+        "next": new_releases_result.get('albums', {}).get('next'),
+        "previous": new_releases_result.get('albums', {}).get('previous')
+    }, cached
+
 @app.route("/api/new-releases")
 def api_get_new_releases():
     app.logger.debug("APP: Entered /api/new-releases route")
@@ -798,55 +1290,102 @@ def api_get_new_releases():
     # Get query parameters with defaults
     limit = int(request.args.get('limit', 20))  # Default to 20, max 50
     offset = int(request.args.get('offset', 0))  # Default to 0
+    country = request.args.get('country', None)  # Optional market
     
     # Ensure limit is within Spotify's bounds
     limit = min(max(limit, 1), 50)
 
     try:
-        # Call Spotify's browse new releases endpoint
-        new_releases_result = sp.new_releases(limit=limit, offset=offset)
-        app.logger.debug(f"APP: /api/new-releases - New releases fetched from Spotify: {'Data received' if new_releases_result else 'No data'}")
+        fields = parse_fields(request.args.get('fields'), ALBUM_FIELDS, DEFAULT_ALBUM_FIELDS)
+    except InvalidFields as e:
+        return invalid_fields_response(e)
 
-        releases_data = []
-        if new_releases_result and new_releases_result.get('albums') and new_releases_result['albums'].get('items'):
-            for item in new_releases_result['albums']['items']:
-                image_url = None
-                # Get the first image URL if available
-                if item.get('images') and len(item['images']) > 0:
-                    image_url = item['images'][0].get('url')
+    try:
+        return cached_json_response(*new_releases_page(limit, offset, country, fields))
+    except Exception as e:
+        app.logger.error(f"APP: /api/new-releases - Error fetching new releases: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
+        return jsonify({"error": "Failed to fetch new releases from Spotify"}), 500
 
-                release_info = {
-                    "id": item.get('id'),
-                    "name": item.get('name'),
-                    "artists": ", ".join(artist.get('name', '') for artist in item.get('artists', [])),
-                    "album_type": item.get('album_type'),
-                    "release_date": item.get('release_date'),
-                    "total_tracks": item.get('total_tracks'),
-                    "url": item.get('external_urls', {}).get('spotify'),
-                    "image": image_url,
-                    "available_markets": item.get('available_markets', [])
-                }
-                releases_data.append(release_info)
+# Longest the home page waits for any of its sections
+HOME_DEADLINE = float(os.getenv("HOME_DEADLINE", 5))
+
+def home_sections(sp_client, user_id=None, country=None) -> dict:
+    """What the home page shows, each section loaded on its own"""
+    return {
+        "user_tracks": lambda: user_tracks_page(sp_client, 10, 0, user_id),
+        "browse_categories": lambda: browse_categories_page(12, 0, country)[0],
+        "new_releases": lambda: new_releases_page(10, 0, country)[0],
+    }
+
+def home_section_error(e) -> dict:
+    """Why a section is missing, in the status its own route would have answered with"""
+    if isinstance(e, TimeoutError):
+        return {"error": "Timed out loading this section", "status": 504}
+    if is_throttled(e):
+        retry_after = max(1, math.ceil(retry_after_seconds(getattr(e, 'headers', None))))
+        return {"error": "Spotify is busy, please retry shortly.", "status": 503, "retry_after": retry_after}
+    if getattr(e, 'http_status', None) == 401:
+        return {"error": "Spotify authorization error. Please log in again.", "status": 401}
+    return {"error": "Failed to load this section from Spotify", "status": 500}
+
+# The home page in one round trip: the sections are fetched concurrently and a failed or
+# slow section is reported on its own instead of failing the others.
+# With Accept: application/x-ndjson every section is sent as a line of its own as soon as it is ready.
+@app.route("/api/home")
+def api_get_home():
+    app.logger.debug("APP: Entered /api/home route")
 
-        app.logger.debug(f"APP: /api/new-releases - Processed {len(releases_data)} new releases.")
-        
-        # Return the data in a format similar to your existing endpoints
-        return jsonify({
-            "items": releases_data,
-            "total": new_releases_result.get('albums', {}).get('total', 0),
-            "limit": limit,
-            "offset": offset,
-            "next": new_releases_result.get('albums', {}).get('next'),
-            "previous": new_releases_result.get('albums', {}).get('previous')
-        })
+    auth_error = validate_user_token()
+    if auth_error:
+        return auth_error
+
+    sp_client = get_spotify_client()
+    if not sp_client:
+        return jsonify({"error": "Failed to get Spotify client"}), 500
 
+    try:
+        user_id = get_current_user_id(sp_client)
     except Exception as e:
-        app.logger.error(f"APP: /api/new-releases - Error fetching new releases: {str(e)}")
-        if hasattr(e, 'http_status') and e.http_status == 401:  # Spotify API returned 401
-            session.clear() 
-            return jsonify({"error": "Spotify authorization error. Please log in again."}), 401
-        return jsonify({"error": "Failed to fetch new releases from Spotify"}), 500
+        app.logger.info(f"APP: /api/home - Could not identify user, their tracks come from Spotify: {str(e)}")
+        user_id = None
+    sections = home_sections(sp_client, user_id, request.args.get('country', None))
+    names = list(sections)
+    failures = []
+
+    def on_error(name, e):
+        app.logger.error(f"APP: /api/home - Error loading {name}: {str(e)}")
+        failures.append((name, home_section_error(e)))
+
+    completed = fan_out_as_completed(
+        lambda name: sections[name](), names, max_concurrency=len(names), deadline=HOME_DEADLINE, on_error=on_error
+    )
+
+    if request.accept_mimetypes.best == "application/x-ndjson":
+        # The sections are fetched while the body is sent, so the request context (and with
+        # it the request's metrics, finished at teardown) is kept until the last line is out
+        @stream_with_context
+        def stream():
+            try:
+                for index, data in completed:
+                    while failures:
+                        name, error = failures.pop(0)
+                        yield app.json.dumps({"section": name, "error": error}) + "\n"
+                    yield app.json.dumps({"section": names[index], "data": data}) + "\n"
+                for name, error in failures:
+                    yield app.json.dumps({"section": name, "error": error}) + "\n"
+            finally:
+                # The client may have gone away: cancel the sections not started yet
+                completed.close()
+        return Response(stream(), mimetype="application/x-ndjson", headers={"Cache-Control": "no-store"})
+
+    loaded = {names[index]: data for index, data in completed}
+    return jsonify({"sections": loaded, "errors": dict(failures)})
 
 if __name__ == '__main__':
+    # Make sure the indexes exist before serving, this is a no-op once they do
+    migrate(db)
+    # Development server only, production runs under gunicorn (see gunicorn.conf.py)
     debug_mode = os.getenv('FLASK_ENV') != 'production'
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8000)),debug=debug_mode)
@@ -1,6 +1,15 @@
+import gzip
+import json
 import pytest
-from app import app
-from unittest.mock import patch
+import mongomock
+import metrics
+from app import app, cached_search, deck_snapshots
+from unittest.mock import patch, MagicMock
+from rate_limit import SpotifyThrottled
+from schema import LATEST_VERSION
+from response_cache import ResponseCache
+from search_index import PrefixIndex
+from spotify_cache import TTLCache
 
 # In order to understand how to write the tests, first we looked at the lab slides, then we had to do some reading from pytest documentation and flask documentation. We also read up on documentation in NYT's response fields to help make tests on articles.
 # Here are the links of the documentation that we used. 
@@ -12,9 +21,30 @@ from unittest.mock import patch
 @pytest.fixture
 def client():
     app.config["TESTING"] = True
-    with app.test_client() as client:
+    # Deck snapshots are shared through Mongo, keep them in memory
+    with patch.object(deck_snapshots, "collection", mongomock.MongoClient().db.deck_snapshots), \
+         app.test_client() as client:
         yield client
 
+# Test that liveness needs nothing and readiness reports Mongo and schema problems with a 503
+def test_health_endpoints(client):
+    assert client.get("/healthz").status_code == 200
+
+    with patch("app.mongo"), patch("app.schema_version", return_value=LATEST_VERSION):
+        ready = client.get("/readyz")
+    with patch("app.mongo"), patch("app.schema_version", return_value=LATEST_VERSION - 1):
+        unmigrated = client.get("/readyz")
+    with patch("app.mongo") as mongo:
+        mongo.admin.command.side_effect = RuntimeError("no servers")
+        unreachable = client.get("/readyz")
+
+    assert ready.status_code == 200
+    assert ready.json["checks"] == {"mongo": "ok", "schema": "ok"}
+    assert unmigrated.status_code == 503
+    assert unmigrated.json["checks"]["mongo"] == "ok"
+    assert unreachable.status_code == 503
+    assert unreachable.json["checks"]["mongo"] == "unavailable"
+
 # Test that the /spotify/authorize route redirects to Spotify login
 def test_spotify_authorize_redirect(client):
     with patch("app.sp_oauth.get_cached_token", return_value=None), \
@@ -51,7 +81,337 @@ def test_mongo_endpoint(client):
         assert res.status_code == 200
         assert "collections" in res.json
 
+# Test that /api/spotify/artist-tracks builds the album tracks from one bulk albums call instead of one call per album
+def test_artist_tracks_batches_album_fetches(client):
+    albums = [{"id": f"album{i}", "name": f"Album {i}", "images": []} for i in range(10)]
+    sp_client = MagicMock()
+    sp_client.artist_top_tracks.return_value = {"tracks": [{"id": "top1"}]}
+    sp_client.artist_albums.return_value = {"items": albums}
+    sp_client.albums.return_value = {"albums": [
+        dict(album, tracks={"items": [{"id": f"{album['id']}-t{n}"} for n in range(8)]}) for album in albums
+    ]}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client):
+        res = client.get("/api/spotify/artist-tracks/artist1?limit=50")
+        rest = client.get(f"/api/spotify/artist-tracks/artist1?limit=50&cursor={res.json['next_cursor']}")
+
+    assert res.status_code == 200
+    assert sp_client.albums.call_count == 1
+    assert sp_client.album_tracks.call_count == 0
+    tracks = res.json["tracks"] + rest.json["tracks"]
+    assert len(tracks) == 1 + 10 * 5
+    assert tracks[1]["album"] == {"id": "album0", "name": "Album 0", "image": None}
+    assert rest.json["next_cursor"] is None
+
+# Test that deck pages follow the cursor through one snapshot of the deck and reject foreign cursors
+def test_deck_cursor_pagination(client):
+    sp_client = MagicMock()
+    sp_client.artist_related_artists.return_value = {"artists": [{"id": f"artist{i}"} for i in range(5)]}
+    sp_client.artist_top_tracks.side_effect = lambda artist_id, country: {"tracks": [{"id": f"{artist_id}-{n}"} for n in range(2)]}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.fan_out", side_effect=lambda fn, items, **kwargs: [fn(item) for item in items]):
+        pages = [client.get("/api/spotify/similar-artists/seed?limit=4")]
+        while pages[-1].json["next_cursor"]:
+            pages.append(client.get(f"/api/spotify/similar-artists/seed?limit=4&cursor={pages[-1].json['next_cursor']}"))
+        foreign = client.get(f"/api/spotify/similar-artists/other?cursor={pages[0].json['next_cursor']}")
+        garbage = client.get("/api/spotify/similar-artists/seed?cursor=not-a-cursor")
+
+    assert [len(page.json["tracks"]) for page in pages] == [4, 4, 2]
+    assert len({track["id"] for page in pages for track in page.json["tracks"]}) == 10
+    assert sp_client.artist_related_artists.call_count == 1
+    assert foreign.status_code == 400
+    assert garbage.status_code == 400
+
+# Test that a page lands on the same snapshot in a worker that didn't build it, and that a
+# cursor whose snapshot expired starts over on a new one, flagged as a restart
+def test_deck_snapshots_are_shared_between_workers(client):
+    sp_client = MagicMock()
+    sp_client.artist_related_artists.return_value = {"artists": [{"id": f"artist{i}"} for i in range(5)]}
+    sp_client.artist_top_tracks.side_effect = lambda artist_id, country: {"tracks": [{"id": f"{artist_id}-{n}"} for n in range(2)]}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.fan_out", side_effect=lambda fn, items, **kwargs: [fn(item) for item in items]):
+        first = client.get("/api/spotify/similar-artists/shared?limit=4").json
+        deck_snapshots.cache.clear()  # Another worker's cache
+        second = client.get(f"/api/spotify/similar-artists/shared?limit=4&cursor={first['next_cursor']}").json
+        deck_snapshots.collection.delete_many({})
+        deck_snapshots.cache.clear()
+        expired = client.get(f"/api/spotify/similar-artists/shared?limit=4&cursor={first['next_cursor']}").json
+
+    assert sp_client.artist_related_artists.call_count == 2
+    assert [track["id"] for track in second["tracks"]] == ["artist2-0", "artist2-1", "artist3-0", "artist3-1"]
+    assert not second["restarted"]
+    assert expired["restarted"]
+    assert [track["id"] for track in expired["tracks"]] == [track["id"] for track in first["tracks"]]
+
+# Test that deck pages and new releases send compact objects, narrowed with ?fields=
+def test_compact_payloads(client):
+    markets = ["US", "GB"] * 90
+    sp_client = MagicMock()
+    sp_client.artist_related_artists.return_value = {"artists": [{"id": "artist1"}]}
+    sp_client.artist_top_tracks.return_value = {"tracks": [
+        {"id": "track1", "name": "Song", "artists": [{"id": "artist1", "name": "Artist"}], "available_markets": markets}
+    ]}
+    album = {"id": "album1", "name": "Album", "artists": [{"name": "Artist"}], "images": [], "available_markets": markets}
+
+    sp_client.new_releases.return_value = {"albums": {"items": [album], "total": 1}}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.browse_client", sp_client), \
+         patch("app.browse_cache", ResponseCache(MagicMock(find_one=MagicMock(return_value=None)))):
+        tracks = client.get("/api/spotify/similar-artists/seed")
+        narrowed = client.get("/api/spotify/similar-artists/seed?fields=id,name")
+        unknown = client.get("/api/spotify/similar-artists/seed?fields=available_markets")
+        releases = client.get("/api/new-releases")
+        releases_with_markets = client.get("/api/new-releases?fields=id,available_markets")
+
+    assert tracks.json["tracks"][0]["artists"] == [{"id": "artist1", "name": "Artist"}]
+    assert "available_markets" not in tracks.json["tracks"][0]
+    assert narrowed.json["tracks"] == [{"id": "track1", "name": "Song"}]
+    assert unknown.status_code == 400
+    assert releases.json["items"][0]["artists"] == "Artist"
+    assert "available_markets" not in releases.json["items"][0]
+    assert releases_with_markets.json["items"] == [{"id": "album1", "available_markets": markets}]
+
+# Test that browse responses are fetched once with the app's token and revalidated with ETags
+def test_browse_responses_are_cached(client):
+    browse_client = MagicMock()
+    browse_client.categories.return_value = {"categories": {"items": [{"id": "pop", "name": "Pop", "icons": []}], "total": 1}}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client") as get_spotify_client, \
+         patch("app.browse_client", browse_client), \
+         patch("app.browse_cache", ResponseCache(MagicMock(find_one=MagicMock(return_value=None)), ttl=600)):
+        first = client.get("/api/browse-categories?limit=12")
+        revalidated = client.get("/api/browse-categories?limit=12", headers={"If-None-Match": first.headers["ETag"]})
+        other_market = client.get("/api/browse-categories?limit=12&country=SE")
+
+    assert first.status_code == 200
+    assert first.json["items"][0]["id"] == "pop"
+    assert first.headers["Cache-Control"].startswith("private, max-age=")
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    assert other_market.status_code == 200
+    assert browse_client.categories.call_count == 2
+    browse_client.categories.assert_called_with(limit=12, offset=0, country="SE")
+    get_spotify_client.assert_not_called()
+
+# Test that the home feed loads its sections together and reports a failed section on its own
+def test_home_feed_partial_failure(client):
+    sp_client = MagicMock()
+    sp_client.current_user_saved_tracks.side_effect = SpotifyThrottled(2.5)
+    browse_client = MagicMock()
+    browse_client.categories.return_value = {"categories": {"items": [{"id": "pop", "name": "Pop", "icons": []}], "total": 1}}
+    browse_client.new_releases.return_value = {"albums": {"items": [{"id": "album1", "name": "Album", "artists": [], "images": []}], "total": 1}}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.browse_client", browse_client), \
+         patch("app.browse_cache", ResponseCache(MagicMock(find_one=MagicMock(return_value=None)))):
+        home = client.get("/api/home")
+        streamed = client.get("/api/home", headers={"Accept": "application/x-ndjson"})
+
+    assert home.status_code == 200
+    assert set(home.json["sections"]) == {"browse_categories", "new_releases"}
+    assert home.json["sections"]["new_releases"]["items"][0]["id"] == "album1"
+    assert home.json["errors"]["user_tracks"] == {"error": "Spotify is busy, please retry shortly.", "status": 503, "retry_after": 3}
+
+    assert streamed.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in streamed.data.decode().splitlines()]
+    assert {line["section"] for line in lines} == {"user_tracks", "browse_categories", "new_releases"}
+    assert [line["error"]["status"] for line in lines if "error" in line] == [503]
+
+# Test that a streamed home feed is recorded once its last section has been sent, not when
+# the view returns, so the Spotify calls made while streaming are counted with it
+def test_streamed_home_feed_metrics():
+    sp_client = MagicMock()
+    sp_client.current_user_saved_tracks.return_value = {"items": [], "total": 0}
+    browse_client = MagicMock()
+    browse_client.categories.return_value = {"categories": {"items": [], "total": 0}}
+    browse_client.new_releases.return_value = {"albums": {"items": [], "total": 0}}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.browse_client", browse_client), \
+         patch("app.browse_cache", ResponseCache(MagicMock(find_one=MagicMock(return_value=None)))), \
+         patch("metrics.finish_request", wraps=metrics.finish_request) as finish_request:
+        # A client that doesn't keep the request context around after the response
+        streamed = app.test_client().get("/api/home", headers={"Accept": "application/x-ndjson"})
+        finished_before_body = finish_request.call_count
+        lines = streamed.get_data(as_text=True).splitlines()
+
+    assert len(lines) == 3
+    assert finished_before_body == 0
+    finish_request.assert_called_once()
+    assert finish_request.call_args.args[1:4] == ("/api/home", "GET", 200)
+
+# Test that a throttled Spotify call turns into a 503 with Retry-After instead of a 500
+def test_throttled_deck_returns_503(client):
+    sp_client = MagicMock()
+    sp_client.artist_related_artists.side_effect = SpotifyThrottled(2.5)
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client):
+        res = client.get("/api/spotify/similar-artists/seed")
+
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "3"
+
+# Test that the user's tracks come from their synced library, and a library never synced is synced in the background
+def test_user_tracks_from_synced_library(client):
+    with client.session_transaction() as sess:
+        sess["user"] = {"id": "user1", "name": "Navjeet"}
+    sp_client = MagicMock()
+    sp_client.current_user_saved_tracks.return_value = {"items": [], "total": 0}
+    sp_client.current_user_top_tracks.return_value = {"items": []}
+    track = {"id": "track1", "name": "Song", "artists": [{"id": "artist1", "name": "Artist"}], "album": {"name": "Album", "images": []}}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.library") as library:
+        library.state_of.return_value = {"saved_total": 1200}
+        library.is_stale.return_value = False
+        library.saved_page.return_value = [(track, "2024-01-01T00:00:00Z")]
+        synced = client.get("/api/user-tracks?limit=1&offset=5")
+        library.state_of.return_value = None
+        library.is_stale.return_value = True
+        unsynced = client.get("/api/user-tracks")
+
+    assert synced.json["items"][0]["name"] == "Song"
+    assert (synced.json["total"], synced.json["source"]) == (1200, "saved_tracks")
+    library.saved_page.assert_called_once_with("user1", 1, 5)
+    assert unsynced.json["source"] == "top_tracks"
+    library.request_sync.assert_called_once_with("user1", sp_client)
+    sp_client.current_user_saved_tracks.assert_called_once_with(limit=20, offset=0)
+
+# Test that typeahead answers from the local index and searches Spotify once per normalized query on a miss
+def test_typeahead_index_then_cached_search(client):
+    sp_client = MagicMock()
+    sp_client.search.return_value = {"albums": {"items": [
+        {"id": f"album{n}", "name": f"Discovery {n}", "artists": [{"id": "dp", "name": "Daft Punk"}], "images": []} for n in range(3)
+    ]}}
+    index = PrefixIndex()
+    index.add_spotify(tracks=[{"id": f"t{n}", "name": f"Around the World {n}", "artists": [{"id": "dp", "name": "Daft Punk"}]} for n in range(3)])
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.search_index", index), \
+         patch("app.search_cache", TTLCache(10, {})), \
+         patch("app.db"):
+        local = client.get("/api/search/typeahead?q=daft%20aro")
+        remote = client.get("/api/search/typeahead?q=Discov&type=album")
+        again = client.get("/api/search/typeahead?q=discov%20&type=album")
+        indexed = client.get("/api/search/typeahead?q=discovery&type=album")
+        bad_limit = client.get("/api/search/typeahead?q=daft%20aro&limit=abc")
+
+    assert local.json["source"] == "index"
+    # A limit that isn't a number falls back to the default instead of failing the keystroke
+    assert bad_limit.status_code == 200 and bad_limit.json == local.json
+    assert [t["id"] for t in local.json["tracks"]] == ["t0", "t1", "t2"]
+    assert remote.json["source"] == "spotify"
+    assert [a["id"] for a in remote.json["albums"]] == ["album0", "album1", "album2"]
+    # The remote results were indexed, so the next queries are local
+    assert again.json == dict(remote.json, source="index")
+    assert indexed.json["source"] == "index"
+    sp_client.search.assert_called_once_with(q="discov", type=["album"], limit=5)
+
+    with patch("app.search_cache", TTLCache(10, {})):
+        cached_search(sp_client, "Daft  Punk", ["track", "album"], 10)
+        cached_search(sp_client, "daft punk", ["album", "track"], 10)
+    sp_client.search.assert_called_with(q="daft punk", type=["album", "track"], limit=10)
+    assert sp_client.search.call_count == 2
+
+# Test that a like costs no identity lookup upstream when the user id is already in the session
+def test_feedback_uses_session_user_id(client):
+    with client.session_transaction() as sess:
+        sess["user"] = {"id": "user1", "name": "Navjeet"}
+    sp_client = MagicMock()
+    track = {"id": "track1", "name": "Song", "artists": [{"id": "artist1", "name": "Artist"}]}
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client), \
+         patch("app.catalog.get_tracks", return_value={"track1": track}), \
+         patch("app.feedback_writer") as feedback_writer, \
+         patch("app.deck_queues") as deck_queues:
+        res = client.put("/api/feedback/track1", json={"rating": "like"})
+
+    assert res.status_code == 200
+    sp_client.current_user.assert_not_called()
+    [feedback] = feedback_writer.submit.call_args[0][0]
+    assert (feedback["user_id"], feedback["track_id"], feedback["rating"]) == ("user1", "track1", "like")
+    deck_queues.request_refill.assert_called_once_with("user1", "personalized", sp_client, reset=True)
+
+# Test that the batch endpoint acknowledges known tracks right away and reports unknown ones
+def test_feedback_batch(client):
+    with client.session_transaction() as sess:
+        sess["user"] = {"id": "user1"}
+    track = {"id": "track1", "name": "Song", "artists": [{"id": "artist1", "name": "Artist"}]}
+    ratings = [{"track_id": "track1", "rating": "like"}, {"track_id": "missing", "rating": "dislike"}]
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=MagicMock()), \
+         patch("app.catalog.get_tracks", return_value={"track1": track}), \
+         patch("app.feedback_writer") as feedback_writer, \
+         patch("app.deck_queues"):
+        res = client.post("/api/feedback/batch", json={"ratings": ratings})
+        bad = client.post("/api/feedback/batch", json={"ratings": [{"track_id": "t", "rating": "meh"}]})
+
+    assert res.status_code == 202
+    assert res.json == {"accepted": 1, "rejected": ["missing"]}
+    assert len(feedback_writer.submit.call_args[0][0]) == 1
+    assert bad.status_code == 400
+
+# Test that /metrics reports per-route timings and the Spotify calls made from fan-out threads
+def test_metrics_endpoint(client):
+    from metrics import observe_spotify
+    sp_client = MagicMock()
+    sp_client.artist_related_artists.return_value = {"artists": [{"id": f"artist{i}"} for i in range(3)]}
+
+    def top_tracks(artist_id, country):
+        observe_spotify("GET", f"artists/{artist_id}/top-tracks", 200, 0.002)
+        return {"tracks": [{"id": f"{artist_id}-0"}]}
+    sp_client.artist_top_tracks.side_effect = top_tracks
+
+    with patch("app.validate_user_token", return_value=None), \
+         patch("app.get_spotify_client", return_value=sp_client):
+        assert client.get("/api/spotify/similar-artists/metrics-seed").status_code == 200
+    body = client.get("/metrics").get_data(as_text=True)
+
+    route = 'route="/api/spotify/similar-artists/<artist_id>"'
+    assert f'http_request_duration_seconds_count{{{route},method="GET",status="200"}}' in body
+    assert f'http_request_spotify_calls_bucket{{{route},le="5"}} 1' in body
+    assert 'spotify_request_duration_seconds_count{method="artist_top_tracks",status="200"}' in body
+    assert 'cache_misses_total{cache="search"}' in body
+
+# Test that built files are served precompressed with long-lived caching, and missing ones are 404s
+def test_serve_frontend_files(client, tmp_path):
+    from static_files import StaticManifest, compress_tree
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "index-Bx3kQ9aZ.js").write_text("console.log('hello');\n" * 200)
+    (tmp_path / "index.html").write_text("<!doctype html><div id=app></div>")
+    compress_tree(str(tmp_path))
+    manifest = StaticManifest(str(tmp_path))
 
-      
-    
+    with patch("app.frontend_files", manifest), patch("app.frontend_pages", manifest):
+        script = client.get("/assets/index-Bx3kQ9aZ.js", headers={"Accept-Encoding": "gzip, deflate"})
+        plain = client.get("/assets/index-Bx3kQ9aZ.js")
+        page = client.get("/explore")
+        revalidated = client.get("/", headers={"If-None-Match": page.headers["ETag"]})
+        missing = client.get("/assets/index-Old12345.js")
 
+    assert script.headers["Content-Encoding"] == "gzip"
+    assert script.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert "Accept-Encoding" in script.headers["Vary"]
+    assert gzip.decompress(script.data) == plain.data
+    assert "Content-Encoding" not in plain.headers
+    assert script.headers["ETag"] != plain.headers["ETag"]
+    assert page.data.startswith(b"<!doctype html>")
+    assert page.headers["Cache-Control"] == "no-cache"
+    assert not page.headers["ETag"].startswith("W/")
+    assert revalidated.status_code == 304
+    assert missing.status_code == 404
@@ -0,0 +1,539 @@
+# Async (ASGI) variant of the backend: uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 3
+# The fan-out heavy routes (the Spotify deck and search routes and the feedback routes)
+# run natively on asyncio here, with httpx for Spotify and Motor for Mongo, so a request
+# waiting on I/O holds no thread and one worker can serve many users at once.
+# Every other route is the Flask app, mounted underneath: both share one URL space, the
+# Flask session cookie, identity tokens, deck cursors and the same response contracts.
+
+import os
+import math
+import logging
+import functools
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Route, Mount
+
+from app import (
+    app as flask_app, identity, spotify_auth, deck_cursors, deck_snapshots, deck_response, queue_response,
+    search_response, search_index, search_cache, search_key, search_albums, feedback_documents,
+    DECK_PAGE_SIZE, MAX_FEEDBACK_BATCH, FEEDBACK_HISTORY_LIMIT, ALBUMS_BATCH_SIZE, POPULAR_ARTISTS
+)
+from async_spotify import AsyncSpotify, async_http_client
+from catalog import AsyncCatalog
+from deck_queue import AsyncDeckQueues, AsyncDeckSnapshots
+from fanout import fan_out_async
+from library_sync import discover_artist_ids
+from metrics import MetricsMiddleware, mongo_listener
+from feedback_queue import AsyncFeedbackWriter, FeedbackBackpressure
+from pagination import InvalidCursor
+from projection import TRACK_FIELDS, InvalidFields, parse_fields, project_tracks
+from rate_limit import retry_after_seconds
+from recommender import ArtistAffinity
+from response_encoding import API_COMPRESS_MIN_SIZE, API_GZIP_LEVEL
+
+logger = logging.getLogger(__name__)
+
+# The Flask session cookie, read and written the way Flask does
+session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+SESSION_COOKIE = flask_app.config["SESSION_COOKIE_NAME"]
+SESSION_LIFETIME = int(flask_app.permanent_session_lifetime.total_seconds())
+
+
+def load_session(request) -> dict:
+    cookie = request.cookies.get(SESSION_COOKIE)
+    if not cookie:
+        return {}
+    try:
+        return session_serializer.loads(cookie, max_age=SESSION_LIFETIME)
+    except BadSignature:
+        return {}
+
+
+def save_session(response, session: dict):
+    if not session:
+        response.delete_cookie(SESSION_COOKIE, httponly=True)
+        return
+    response.set_cookie(
+        SESSION_COOKIE, session_serializer.dumps(session),
+        max_age=SESSION_LIFETIME if session.get("_permanent") else None,
+        httponly=True, samesite=flask_app.config["SESSION_COOKIE_SAMESITE"],
+        secure=flask_app.config["SESSION_COOKIE_SECURE"]
+    )
+
+
+class APIJSONResponse(JSONResponse):
+    """Encoded by the Flask app's JSON provider, orjson when it is installed, like jsonify"""
+
+    def render(self, content) -> bytes:
+        return flask_app.json.dumps(content, separators=(",", ":")).encode()
+
+
+def json_response(content, status_code=200, headers=None):
+    return APIJSONResponse(content, status_code=status_code, headers=headers)
+
+
+async def authorize(request):
+    """validate_user_token() for the async routes, None if the caller may proceed"""
+    session = request.state.session = load_session(request)
+    request.state.session_changed = False
+    token_info = session.get("token_info")
+    if token_info and token_info.get('access_token') and not spotify_auth.is_expired(token_info):
+        return None
+
+    request.state.session_changed = True
+    if token_info and token_info.get('refresh_token'):
+        logger.info(f"SPOTIPY: Token for {request.url.path} - Attempting to refresh.")
+        try:
+            # Refreshes are rare and single-flight across both apps, a thread is fine for them
+            session["token_info"], _ = await run_in_threadpool(spotify_auth.fresh_token, token_info)
+            session["_permanent"] = True
+            return None
+        except Exception as e:
+            logger.error(f"SPOTIPY: Token for {request.url.path} - Failed to refresh: {str(e)}")
+            session.clear()
+            return json_response({"error": "Session expired, failed to refresh token. Please log in again."}, 401)
+    session.clear()
+    logger.warning(f"SPOTIPY: Token for {request.url.path} - No valid token/refresh token. User needs to re-authenticate.")
+    return json_response({"error": "User not authenticated or token expired. Please log in again."}, 401)
+
+
+def authorized(handler):
+    """Only run the handler for a logged-in caller, and send the session back if it changed"""
+    @functools.wraps(handler)
+    async def endpoint(request):
+        response = await authorize(request)
+        if response is None:
+            response = await handler(request)
+        if request.state.session_changed:
+            save_session(response, request.state.session)
+        return response
+    return endpoint
+
+
+def get_spotify_client(request) -> AsyncSpotify:
+    """A Spotify client bound to the caller's own token, sharing the process-wide HTTP pool"""
+    services = request.app.state.services
+    return AsyncSpotify(services.http, request.state.session["token_info"]["access_token"], catalog=services.catalog)
+
+
+async def get_current_user_id(request, sp_client) -> str | None:
+    session = request.state.session
+    return await identity.resolve_user_id_async(
+        session_user_id=(session.get("user") or {}).get("id"),
+        identity_token=request.headers.get("X-User-Token"),
+        access_token=session["token_info"].get("access_token"),
+        fetch_profile=sp_client.current_user,
+        refresh_token=session["token_info"].get("refresh_token")
+    )
+
+
+def is_throttled(e) -> bool:
+    return getattr(e, 'http_status', None) == 429
+
+
+def spotify_busy_response(e):
+    retry_after = max(1, math.ceil(retry_after_seconds(getattr(e, 'headers', None))))
+    return json_response({"error": "Spotify is busy, please retry shortly."}, 503, {"Retry-After": str(retry_after)})
+
+
+def invalid_cursor_response(e):
+    return json_response({"error": f"Invalid cursor: {str(e)}"}, 400)
+
+
+def invalid_fields_response(e):
+    return json_response({"error": str(e)}, 400)
+
+
+def feedback_backpressure_response(e):
+    logger.warning(f"Feedback queue is full: {str(e)}")
+    return json_response({"error": "Too much feedback is waiting to be stored, please retry shortly."}, 503, {"Retry-After": "1"})
+
+
+async def search(request):
+    query = request.query_params.get('q')
+    search_types_list = [t.strip() for t in request.query_params.get('type', 'track,artist,album').split(',')]
+    limit_per_type = int(request.query_params.get('limit', 10))
+
+    if not query:
+        return json_response({"error": "Search query parameter 'q' is required"}, 400)
+
+    try:
+        sp_client = get_spotify_client(request)
+        key = search_key(query, search_types_list, limit_per_type)
+
+        async def load():
+            results = await sp_client.search(q=key[0], type=list(key[1]), limit=limit_per_type)
+            search_index.add_spotify(albums=search_albums(results))
+            return results
+
+        # The same cache as the Flask app's search, shared in this process
+        results = await search_cache.get_or_load_async("search", key, load)
+        return json_response(search_response(results))
+
+    except Exception as e:
+        logger.error(f"APP: /api/spotify/search - Error during Spotify search: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
+        if getattr(e, 'http_status', None) == 401:
+            request.state.session.clear()
+            request.state.session_changed = True
+            return json_response({"error": "Spotify authorization error during search. Please log in again."}, 401)
+        return json_response({"error": "Failed to perform search on Spotify"}, 500)
+
+
+def get_deck_limit(request) -> int:
+    return min(max(int(request.query_params.get('limit', DECK_PAGE_SIZE)), 1), 50)
+
+
+async def deck_page(request, deck, key, build):
+    """One ?cursor=&limit= page of a generated deck, snapshots and cursors are shared with the Flask app"""
+    cursor = deck_cursors.decode(request.query_params.get('cursor'), deck, key)
+    fields = parse_fields(request.query_params.get('fields'), TRACK_FIELDS)
+    limit = get_deck_limit(request)
+    snapshots = request.app.state.services.deck_snapshots
+    tracks = await snapshots.get(cursor["s"]) if cursor else None
+    if tracks is None:
+        # First page, or the snapshot expired: the walk starts over on a new one
+        tracks = project_tracks(await build())
+        snapshot, offset = await snapshots.create(tracks), 0
+    else:
+        snapshot, offset = cursor["s"], cursor["o"]
+    restarted = bool(cursor) and snapshot != cursor["s"]
+    return json_response(deck_response(deck, key, tracks, snapshot, offset, limit, fields, restarted))
+
+
+async def queue_page(request, deck, user_id, sp_client):
+    """One ?cursor=&limit= page of a queue-backed deck, pages are popped off the user's queue"""
+    cursor = deck_cursors.decode(request.query_params.get('cursor'), deck, user_id)
+    fields = parse_fields(request.query_params.get('fields'), TRACK_FIELDS)
+    tracks, generation = await request.app.state.services.deck_queues.next(user_id, deck, get_deck_limit(request), sp_client)
+    return json_response(queue_response(deck, user_id, cursor, tracks, generation, fields))
+
+
+def deck_route(deck, build, error_message, failure_message):
+    """A route serving pages of a generated deck, build(sp_client, key) makes the whole deck"""
+    @authorized
+    async def route(request):
+        key = next(iter(request.path_params.values()))
+        try:
+            sp_client = get_spotify_client(request)
+            return await deck_page(request, deck, key, lambda: build(sp_client, key))
+        except InvalidCursor as e:
+            return invalid_cursor_response(e)
+        except InvalidFields as e:
+            return invalid_fields_response(e)
+        except Exception as e:
+            logger.error(f"{error_message}: {str(e)}")
+            if is_throttled(e):
+                return spotify_busy_response(e)
+            return json_response({"error": failure_message}, 500)
+    return route
+
+
+def queue_route(deck, error_message, failure_message):
+    """A route serving pages of a queue-backed deck"""
+    @authorized
+    async def route(request):
+        try:
+            sp_client = get_spotify_client(request)
+            user_id = await get_current_user_id(request, sp_client)
+            if not user_id:
+                return json_response({"error": "Could not identify user. Please log in again."}, 401)
+            return await queue_page(request, deck, user_id, sp_client)
+        except InvalidCursor as e:
+            return invalid_cursor_response(e)
+        except InvalidFields as e:
+            return invalid_fields_response(e)
+        except Exception as e:
+            logger.error(f"{error_message}: {str(e)}")
+            if is_throttled(e):
+                return spotify_busy_response(e)
+            return json_response({"error": failure_message}, 500)
+    return route
+
+
+def log_artist_error(artist_id, e):
+    logger.error(f"Error getting top tracks for artist {artist_id}: {str(e)}")
+
+
+async def build_discover_deck(db, sp_client, user_id=None) -> list:
+    """Tracks from the artists in the user's saved tracks, or from popular artists across different genres"""
+    # The most saved artists of the user's whole library, once the Flask app has synced it
+    artist_ids = discover_artist_ids(await db.library_sync.find_one({"_id": user_id}, {"top_artists": 1})) if user_id else []
+    if not artist_ids:
+        user_tracks = []
+        try:
+            saved_tracks = await sp_client.current_user_saved_tracks(limit=50)
+            user_tracks = [track['track'] for track in saved_tracks['items']]
+        except Exception as e:
+            logger.info(f"No saved tracks found or error accessing them: {str(e)}")
+        for track in user_tracks[:20]:
+            for artist in track['artists']:
+                if artist['id'] not in artist_ids:
+                    artist_ids.append(artist['id'])
+
+    if artist_ids:
+        all_tracks = []
+        results = await fan_out_async(
+            lambda artist_id: sp_client.artist_top_tracks(artist_id, country='US'), artist_ids[:10], on_error=log_artist_error
+        )
+        for top_tracks in results:
+            all_tracks.extend(top_tracks['tracks'][:3])
+        if all_tracks:
+            return all_tracks
+
+    all_tracks = []
+    results = await fan_out_async(
+        lambda artist_id: sp_client.artist_top_tracks(artist_id, country='US'), POPULAR_ARTISTS, on_error=log_artist_error
+    )
+    for top_tracks in results:
+        all_tracks.extend(top_tracks['tracks'][:2])
+    return all_tracks
+
+
+async def build_artist_deck(sp_client, artist_id) -> list:
+    """Top tracks of an artist followed by tracks from their albums"""
+    top_tracks = await sp_client.artist_top_tracks(artist_id, country='US')
+    albums = await sp_client.artist_albums(artist_id, album_type='album,single', limit=10)
+    album_ids = [album['id'] for album in albums['items']]
+
+    async def fetch_albums(batch):
+        return await sp_client.albums(batch)
+
+    # Every batch of up to 20 albums at once
+    batches = [album_ids[start:start + ALBUMS_BATCH_SIZE] for start in range(0, len(album_ids), ALBUMS_BATCH_SIZE)]
+    album_tracks = []
+    for full_albums in await fan_out_async(
+        fetch_albums, batches,
+        on_error=lambda batch, e: logger.error(f"Error getting tracks from albums {','.join(batch)}: {str(e)}")
+    ):
+        for album in full_albums['albums']:
+            if not album:
+                continue
+            for track in album.get('tracks', {}).get('items', [])[:5]:
+                album_tracks.append(dict(track, album={'id': album['id'], 'name': album['name'], 'images': album['images']}))
+    return top_tracks['tracks'] + album_tracks
+
+
+async def build_genre_deck(sp_client, genre) -> list:
+    """Top tracks of artists in a genre"""
+    search_results = await sp_client.search(q=f'genre:"{genre}"', type='artist', limit=10)
+    all_tracks = []
+    results = await fan_out_async(
+        lambda artist: sp_client.artist_top_tracks(artist['id'], country='US'),
+        search_results['artists']['items'],
+        on_error=lambda artist, e: log_artist_error(artist['id'], e)
+    )
+    for top_tracks in results:
+        all_tracks.extend(top_tracks['tracks'][:3])
+    return all_tracks
+
+
+async def build_similar_artists_deck(sp_client, artist_id) -> list:
+    """Top tracks of artists related to the given artist"""
+    related_artists = await sp_client.artist_related_artists(artist_id)
+    all_tracks = []
+    results = await fan_out_async(
+        lambda artist: sp_client.artist_top_tracks(artist['id'], country='US'),
+        related_artists['artists'][:10],
+        on_error=lambda artist, e: log_artist_error(artist['id'], e)
+    )
+    for top_tracks in results:
+        all_tracks.extend(top_tracks['tracks'][:2])
+    return all_tracks
+
+
+async def build_personalized_deck(db, sp_client, user_id) -> list:
+    """Tracks ranked by the user's previous likes and dislikes"""
+    feedback = await db.user_feedback.find(
+        {"user_id": user_id},
+        {"_id": 0, "track_id": 1, "rating": 1, "timestamp": 1, "artists": 1}
+    ).sort("timestamp", -1).limit(FEEDBACK_HISTORY_LIMIT).to_list(length=FEEDBACK_HISTORY_LIMIT)
+    affinity = ArtistAffinity.from_feedback(feedback)
+
+    artist_ids = affinity.top_artists(10)
+    if not artist_ids:
+        return await build_discover_deck(db, sp_client, user_id)
+
+    async def liked(artist_id):
+        return artist_id, await sp_client.artist_top_tracks(artist_id, country='US'), await sp_client.artist_related_artists(artist_id)
+
+    async def related(related_id):
+        return related_id, await sp_client.artist_top_tracks(related_id, country='US')
+
+    liked_results = await fan_out_async(liked, artist_ids, on_error=log_artist_error)
+    related_ids = [artist['id'] for _, _, related_artists in liked_results for artist in related_artists['artists'][:3]]
+    related_results = dict(await fan_out_async(related, list(dict.fromkeys(related_ids)), on_error=log_artist_error))
+
+    all_tracks = []
+    for _, top_tracks, related_artists in liked_results:
+        all_tracks.extend(top_tracks['tracks'][:3])
+        for related_artist in related_artists['artists'][:3]:
+            if related_artist['id'] in related_results:
+                all_tracks.extend(related_results[related_artist['id']]['tracks'][:2])
+    return affinity.rank(all_tracks)
+
+
+def compact_deck(build):
+    async def build_compact(sp_client, user_id):
+        return project_tracks(await build(sp_client, user_id))
+    return build_compact
+
+
+async def queue_feedback(request, user_id, ratings, sp_client) -> list:
+    """Hand ratings to the write-behind queue and return the ids of the tracks that were accepted"""
+    services = request.app.state.services
+    tracks = await services.catalog.get_tracks([item['track_id'] for item in ratings], sp_client)
+    feedback_docs = feedback_documents(user_id, ratings, tracks)
+    await services.feedback_writer.submit(feedback_docs)
+    if feedback_docs:
+        services.deck_queues.request_refill(user_id, "personalized", sp_client, reset=True)
+    return [doc['track_id'] for doc in feedback_docs]
+
+
+async def request_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+@authorized
+async def store_feedback(request):
+    try:
+        sp_client = get_spotify_client(request)
+        user_id = await get_current_user_id(request, sp_client)
+        if not user_id:
+            return json_response({"error": "Could not identify user. Please log in again."}, 401)
+
+        rating = (await request_json(request) or {}).get('rating')
+        if rating not in ['like', 'dislike']:
+            return json_response({"error": "Invalid rating"}, 400)
+
+        if not await queue_feedback(request, user_id, [{"track_id": request.path_params['track_id'], "rating": rating}], sp_client):
+            return json_response({"error": "Track not found"}, 404)
+        return json_response({"message": "Feedback stored successfully"})
+
+    except FeedbackBackpressure as e:
+        return feedback_backpressure_response(e)
+    except Exception as e:
+        logger.error(f"Error storing feedback: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
+        return json_response({"error": "Failed to store feedback"}, 500)
+
+
+@authorized
+async def store_feedback_batch(request):
+    data = await request_json(request)
+    ratings = data.get('ratings') if isinstance(data, dict) else None
+    if not isinstance(ratings, list) or not ratings:
+        return json_response({"error": "A non-empty 'ratings' list is required"}, 400)
+    if len(ratings) > MAX_FEEDBACK_BATCH:
+        return json_response({"error": f"At most {MAX_FEEDBACK_BATCH} ratings per request"}, 400)
+    for item in ratings:
+        if not isinstance(item, dict) or not item.get('track_id') or item.get('rating') not in ['like', 'dislike']:
+            return json_response({"error": "Each rating needs a track_id and a rating of 'like' or 'dislike'"}, 400)
+
+    try:
+        sp_client = get_spotify_client(request)
+        user_id = await get_current_user_id(request, sp_client)
+        if not user_id:
+            return json_response({"error": "Could not identify user. Please log in again."}, 401)
+
+        accepted = await queue_feedback(request, user_id, ratings, sp_client)
+        rejected = sorted({item['track_id'] for item in ratings} - set(accepted))
+        return json_response({"accepted": len(accepted), "rejected": rejected}, 202)
+
+    except FeedbackBackpressure as e:
+        return feedback_backpressure_response(e)
+    except Exception as e:
+        logger.error(f"Error storing feedback batch: {str(e)}")
+        if is_throttled(e):
+            return spotify_busy_response(e)
+        return json_response({"error": "Failed to store feedback"}, 500)
+
+
+class Services:
+    """What the async routes of one process share: Mongo, the Spotify HTTP pool and the queues."""
+
+    def __init__(self, db, http):
+        self.db = db
+        self.http = http
+        self.catalog = AsyncCatalog(db, on_record=search_index.add_spotify)
+        self.feedback_writer = AsyncFeedbackWriter(db.user_feedback)
+        self.deck_queues = AsyncDeckQueues(
+            db.deck_queues,
+            {
+                "discover": compact_deck(functools.partial(build_discover_deck, db)),
+                "personalized": compact_deck(functools.partial(build_personalized_deck, db)),
+            },
+            before_refill=self.feedback_writer.flush
+        )
+        # Same local cache as the Flask app's snapshots, Mongo through Motor
+        self.deck_snapshots = AsyncDeckSnapshots(db.deck_snapshots, deck_snapshots.cache)
+
+    async def close(self):
+        await self.deck_queues.close()
+        await self.feedback_writer.close()
+        await self.catalog.close()
+        await self.http.aclose()
+
+
+def create_app(connect_db=None, transport=None) -> Starlette:
+    """The ASGI app. connect_db() returns (database, close function), by default from MONGO_URI;
+    transport replaces the HTTP transport to Spotify (for tests and load tests)."""
+
+    def connect_mongo():
+        client = AsyncIOMotorClient(os.getenv("MONGO_URI"), event_listeners=[mongo_listener])
+        return client.get_default_database(), client.close
+
+    @asynccontextmanager
+    async def lifespan(app):
+        db, close_db = (connect_db or connect_mongo)()
+        app.state.services = Services(db, async_http_client(transport))
+        try:
+            yield
+        finally:
+            await app.state.services.close()
+            close_db()
+
+    return Starlette(
+        routes=[
+            Route("/api/spotify/search", authorized(search)),
+            Route("/api/spotify/discover-tracks", queue_route("discover", "Error in discover_tracks", "Failed to fetch tracks")),
+            Route("/api/spotify/personalized-tracks", queue_route(
+                "personalized", "Error getting personalized tracks", "Failed to fetch personalized tracks"
+            )),
+            Route("/api/spotify/artist-tracks/{artist_id}", deck_route(
+                "artist", build_artist_deck, "Error getting artist tracks", "Failed to fetch artist tracks"
+            )),
+            Route("/api/spotify/genre-tracks/{genre}", deck_route(
+                "genre", build_genre_deck, "Error getting genre tracks", "Failed to fetch genre tracks"
+            )),
+            Route("/api/spotify/similar-artists/{artist_id}", deck_route(
+                "similar", build_similar_artists_deck, "Error getting similar artists tracks", "Failed to fetch similar artists tracks"
+            )),
+            Route("/api/feedback/batch", store_feedback_batch, methods=["POST"]),
+            Route("/api/feedback/{track_id}", store_feedback, methods=["PUT"]),
+            # Everything else is served by the Flask app, in a thread pool
+            Mount("/", WSGIMiddleware(flask_app)),
+        ],
+        # Flask compresses its own responses, GZipMiddleware leaves those alone
+        middleware=[
+            Middleware(MetricsMiddleware),
+            Middleware(GZipMiddleware, minimum_size=API_COMPRESS_MIN_SIZE, compresslevel=API_GZIP_LEVEL),
+        ],
+        lifespan=lifespan
+    )
+
+
+app = create_app()
@@ -0,0 +1,92 @@
+import time
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+import async_spotify
+from benchmarks.async_mongomock import AsyncDatabase
+from benchmarks.fake_spotify import async_transport, fake_track
+from rate_limit import RateBudget
+
+def logged_in(client, user_id="async-user"):
+    token_info = {"access_token": f"token-{user_id}", "refresh_token": "refresh", "expires_at": int(time.time()) + 3600}
+    client.cookies.set(asgi.SESSION_COOKIE, asgi.session_serializer.dumps({"token_info": token_info, "user": {"id": user_id}}))
+    return client
+
+@pytest.fixture
+def db():
+    return AsyncDatabase()
+
+@pytest.fixture
+def client(db, monkeypatch):
+    # A budget of its own, so a test that gets throttled doesn't hold the others back
+    monkeypatch.setattr(async_spotify, "spotify_budget", RateBudget())
+    app = asgi.create_app(connect_db=lambda: (db, lambda: None), transport=async_transport(latency=0))
+    with TestClient(app) as client:
+        yield client
+
+# Test that the async routes answer like the Flask ones and leave the rest to the mounted Flask app
+def test_async_routes_require_login_and_mount_flask(client):
+    assert client.get("/api/spotify/artist-tracks/async-artist0").status_code == 401
+    assert client.post("/api/feedback/batch", json={"ratings": []}).status_code == 401
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+# Test that a generated deck is paged with cursors and compact tracks
+def test_async_artist_deck_pages(client):
+    logged_in(client)
+    first = client.get("/api/spotify/artist-tracks/async-artist1?limit=5").json()
+    second = client.get(f"/api/spotify/artist-tracks/async-artist1?limit=5&cursor={first['next_cursor']}").json()
+    narrow = client.get("/api/spotify/artist-tracks/async-artist1?limit=1&fields=id,name").json()
+
+    assert [track["id"] for track in first["tracks"]] == [f"async-artist1-top{n}" for n in range(5)]
+    assert [track["id"] for track in second["tracks"]] == [f"async-artist1-top{n}" for n in range(5, 10)]
+    assert set(first["tracks"][0]["album"]) == {"id", "name", "image"}
+    assert narrow["tracks"] == [{"id": "async-artist1-top0", "name": "Track async-artist1-top0"}]
+    assert client.get("/api/spotify/artist-tracks/async-artist1?cursor=bogus").status_code == 400
+
+# Test that batched feedback is written through the async queue and shapes the personalized deck
+def test_async_feedback_and_personalized_deck(client, db):
+    logged_in(client)
+    response = client.post("/api/feedback/batch", json={"ratings": [
+        {"track_id": "async-liked-top1", "rating": "like"},
+        {"track_id": "async-liked-top2", "rating": "like"},
+    ]})
+    assert response.status_code == 202
+    assert response.json() == {"accepted": 2, "rejected": []}
+
+    client.portal.call(client.app.state.services.feedback_writer.flush)
+    stored = db.sync.user_feedback.find_one({"user_id": "async-user", "track_id": "async-liked-top1"})
+    assert stored["rating"] == "like"
+
+    liked_artist = fake_track("async-liked-top1")["artists"][0]["id"]
+    deck = client.get("/api/spotify/personalized-tracks?limit=50").json()
+    ids = [track["id"] for track in deck["tracks"]]
+    assert any(track_id.startswith(f"{liked_artist}-top") for track_id in ids)
+    assert "async-liked-top1" not in ids and deck["next_cursor"]
+
+# Test that a 429 from Spotify turns into a 503 with the Retry-After Spotify asked for
+def test_async_throttled_returns_503(db, monkeypatch):
+    monkeypatch.setattr(async_spotify, "spotify_budget", RateBudget())
+    fake = async_transport(latency=0)
+
+    async def throttle_top_tracks(request):
+        if request.url.path.endswith("/top-tracks"):
+            return httpx.Response(429, headers={"Retry-After": "7"}, json={"error": {"status": 429, "message": "Slow down"}})
+        return await fake.handle_async_request(request)
+
+    app = asgi.create_app(connect_db=lambda: (db, lambda: None), transport=httpx.MockTransport(throttle_top_tracks))
+    with TestClient(app) as client:
+        response = logged_in(client).get("/api/spotify/artist-tracks/async-throttled")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+
+# Test that a user without feedback gets the discover deck as their personalized deck
+def test_async_personalized_deck_without_feedback(client):
+    logged_in(client, "async-new-user")
+    deck = client.get("/api/spotify/personalized-tracks?limit=50").json()
+
+    saved_artists = {fake_track(f"saved{n}")["artists"][0]["id"] for n in range(20)}
+    assert deck["tracks"]
+    assert all(track["id"].rsplit("-top", 1)[0] in saved_artists for track in deck["tracks"])
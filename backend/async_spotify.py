@@ -0,0 +1,154 @@
+# Spotify Web API client for the asyncio app (asgi.py).
+# It makes the calls the deck and feedback routes need over one shared httpx.AsyncClient,
+# so a request waiting on Spotify holds no thread. It behaves like the synchronous client
+# stack: calls go through the process-wide RateBudget with the same retries, artist-level
+# calls are served from the shared artist cache, and tracks and artists in the responses
+# are recorded in the catalog.
+
+import os
+import time
+import random
+import asyncio
+import logging
+
+import httpx
+from spotipy.exceptions import SpotifyException
+
+from http_pool import (
+    SPOTIFY_API_URL, SPOTIFY_POOL_MAXSIZE, SPOTIFY_KEEPALIVE_IDLE, SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT
+)
+from metrics import observe_spotify
+from rate_limit import (
+    RateBudget, spotify_budget, token_key, retry_after_seconds, RETRYABLE_STATUSES,
+    SPOTIFY_BUDGET_WAIT, SPOTIFY_MAX_RETRIES, SPOTIFY_RETRY_BACKOFF
+)
+from spotify_cache import TTLCache, artist_cache, CATALOG_EXTRACTORS
+
+# Connections to Spotify the event loop may have open at once
+SPOTIFY_ASYNC_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_ASYNC_MAX_CONNECTIONS", 100))
+
+logger = logging.getLogger(__name__)
+
+
+def async_http_client(transport=None) -> httpx.AsyncClient:
+    """The pooled keep-alive client every AsyncSpotify of this process shares."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=SPOTIFY_ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=SPOTIFY_POOL_MAXSIZE,
+            keepalive_expiry=SPOTIFY_KEEPALIVE_IDLE
+        ),
+        timeout=httpx.Timeout(SPOTIFY_READ_TIMEOUT, connect=SPOTIFY_CONNECT_TIMEOUT),
+        transport=transport
+    )
+
+
+class AsyncSpotify:
+    """One user's Spotify client, cheap to make per request."""
+
+    def __init__(self, http: httpx.AsyncClient, access_token: str, budget: RateBudget = None,
+                 cache: TTLCache = None, catalog=None, base_url: str = SPOTIFY_API_URL,
+                 max_wait: float = SPOTIFY_BUDGET_WAIT, max_retries: int = SPOTIFY_MAX_RETRIES,
+                 backoff: float = SPOTIFY_RETRY_BACKOFF):
+        self.http = http
+        self.access_token = access_token
+        self.budget = budget or spotify_budget
+        self.base_url = base_url
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._cache = cache or artist_cache
+        self._catalog = catalog
+        self._budget_key = token_key(access_token)
+
+    def _retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def _call(self, method, path, params=None, payload=None):
+        url = path if path.startswith("http") else self.base_url + path
+        # Like requests, leave out parameters that aren't set
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        attempt = 0
+        while True:
+            delay = self.budget.reserve(self._budget_key, self.max_wait)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            retryable = method == "GET" and attempt < self.max_retries
+            started = time.perf_counter()
+            try:
+                response = await self.http.request(
+                    method, url, params=params, json=payload,
+                    headers={"Authorization": f"Bearer {self.access_token}"}
+                )
+            except httpx.TransportError:
+                observe_spotify(method, url, "error", time.perf_counter() - started)
+                if not retryable:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+            else:
+                observe_spotify(method, url, response.status_code, time.perf_counter() - started)
+                if response.status_code < 400:
+                    return response.json() if response.content else None
+                if response.status_code == 429:
+                    self.budget.throttled(retry_after_seconds(response.headers))
+                if not retryable or response.status_code not in RETRYABLE_STATUSES:
+                    raise self._error(response)
+                if response.status_code != 429:
+                    await asyncio.sleep(self._retry_delay(attempt))
+            attempt += 1
+            self.budget.count("retried")
+
+    @staticmethod
+    def _error(response) -> SpotifyException:
+        # The same exception spotipy raises, so routes handle both clients alike
+        try:
+            error = response.json().get("error", {})
+            msg, reason = error.get("message"), error.get("reason")
+        except (ValueError, AttributeError):
+            msg, reason = response.text or None, None
+        logger.error(f"SPOTIPY: {response.request.method} {response.url} returned {response.status_code} due to {msg}")
+        return SpotifyException(response.status_code, -1, f"{response.url}:\n {msg}", reason=reason, headers=response.headers)
+
+    async def _get_recorded(self, name, path, **params):
+        result = await self._call("GET", path, params)
+        if self._catalog and result:
+            tracks, artists = CATALOG_EXTRACTORS[name](result)
+            self._catalog.record(tracks=tracks, artists=artists)
+        return result
+
+    async def artist_top_tracks(self, artist_id, country="US"):
+        return await self._cache.get_or_load_async(
+            "artist_top_tracks", (artist_id, country),
+            lambda: self._get_recorded("artist_top_tracks", f"artists/{artist_id}/top-tracks", country=country)
+        )
+
+    async def artist_related_artists(self, artist_id):
+        return await self._cache.get_or_load_async(
+            "artist_related_artists", artist_id,
+            lambda: self._get_recorded("artist_related_artists", f"artists/{artist_id}/related-artists")
+        )
+
+    async def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        return await self._cache.get_or_load_async(
+            "artist_albums", (artist_id, album_type, country, limit, offset),
+            lambda: self._call("GET", f"artists/{artist_id}/albums", {
+                "album_type": album_type, "country": country, "limit": limit, "offset": offset
+            })
+        )
+
+    async def albums(self, albums):
+        return await self._get_recorded("albums", "albums/", ids=",".join(albums))
+
+    async def tracks(self, tracks, market=None):
+        return await self._call("GET", "tracks/", {"ids": ",".join(tracks), "market": market})
+
+    async def search(self, q, limit=10, offset=0, type="track", market=None):
+        if isinstance(type, (list, tuple)):
+            type = ",".join(type)
+        return await self._get_recorded("search", "search", q=q, limit=limit, offset=offset, type=type, market=market)
+
+    async def current_user_saved_tracks(self, limit=20, offset=0, market=None):
+        return await self._get_recorded("current_user_saved_tracks", "me/tracks", limit=limit, offset=offset, market=market)
+
+    async def current_user(self):
+        return await self._call("GET", "me/")
@@ -0,0 +1,58 @@
+# Per-request Spotify authentication.
+# Each user's token lives only in their own Flask session, and every request builds its
+# Spotify client from the caller's token, so no user-specific state is shared between
+# requests or threads. Expired tokens are refreshed once per refresh token however many
+# requests notice at the same time: concurrent refreshes share one call to Spotify's
+# accounts service, and requests still carrying the old token shortly afterwards get the
+# refreshed one instead of refreshing again.
+
+import os
+import hashlib
+from spotipy.cache_handler import CacheHandler
+
+from spotify_cache import TTLCache
+
+REFRESHED_TOKEN_TTL = int(os.getenv("REFRESHED_TOKEN_TTL", 300))  # how long a refresh result is handed to late requests
+REFRESHED_TOKEN_CACHE_SIZE = int(os.getenv("REFRESHED_TOKEN_CACHE_SIZE", 10000))
+
+
+class NoCacheHandler(CacheHandler):
+    """Keeps SpotifyOAuth from storing tokens itself; callers store them in the user's session."""
+
+    def get_cached_token(self):
+        return None
+
+    def save_token_to_cache(self, token_info):
+        pass
+
+
+class MissingRefreshToken(ValueError):
+    """The token expired and cannot be refreshed, the user has to log in again."""
+
+
+class SpotifyAuth:
+    def __init__(self, oauth, refresh_window: int = REFRESHED_TOKEN_TTL, cache_size: int = REFRESHED_TOKEN_CACHE_SIZE):
+        """oauth is a SpotifyOAuth whose cache handler stores nothing (NoCacheHandler)."""
+        self.oauth = oauth
+        self._refreshed = TTLCache(cache_size, {"refresh": refresh_window})
+
+    def exchange_code(self, code: str) -> dict:
+        return self.oauth.get_access_token(code, check_cache=False)
+
+    def is_expired(self, token_info: dict) -> bool:
+        return self.oauth.is_token_expired(token_info)
+
+    def fresh_token(self, token_info: dict) -> tuple:
+        """Return (token_info, refreshed), refreshing the token first if it has expired."""
+        if not self.is_expired(token_info):
+            return token_info, False
+        refresh_token = token_info.get("refresh_token")
+        if not refresh_token:
+            raise MissingRefreshToken("Token expired and there is no refresh token")
+        # Keyed by a digest so refresh tokens aren't kept around in memory
+        key = hashlib.sha256(refresh_token.encode()).hexdigest()
+        return self._refreshed.get_or_load("refresh", key, lambda: self.oauth.refresh_access_token(refresh_token)), True
+
+    def stats(self) -> dict:
+        stats = self._refreshed.stats()
+        return {"refreshes": stats["misses"], "shared": stats["hits"] + stats["coalesced"]}
@@ -0,0 +1,131 @@
+import json
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from unittest.mock import patch
+
+import pytest
+from spotipy.oauth2 import SpotifyOAuth
+from auth import SpotifyAuth, NoCacheHandler, MissingRefreshToken
+from http_pool import build_session
+
+USERS = 20
+REQUESTS_PER_USER = 10
+REFRESH_LATENCY = 0.1
+
+
+class FakeAccounts(BaseHTTPRequestHandler):
+    """Spotify's token endpoint: every refresh issues a new access token named after the refresh token."""
+    refreshes = Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        refresh_token = form["refresh_token"][0]
+        with self.lock:
+            self.refreshes[refresh_token] += 1
+            n = self.refreshes[refresh_token]
+        time.sleep(REFRESH_LATENCY)
+        body = json.dumps({
+            "access_token": f"access-{refresh_token}-{n}", "token_type": "Bearer", "expires_in": 3600, "scope": ""
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def token_url():
+    FakeAccounts.refreshes = Counter()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAccounts)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/api/token"
+    server.shutdown()
+    server.server_close()
+
+
+def make_auth(token_url):
+    oauth = SpotifyOAuth(
+        client_id="id", client_secret="secret", redirect_uri="http://localhost/callback",
+        cache_handler=NoCacheHandler(), requests_session=build_session()
+    )
+    oauth.OAUTH_TOKEN_URL = token_url
+    return SpotifyAuth(oauth)
+
+
+def expired_token(user):
+    return {"access_token": f"old-{user}", "refresh_token": f"refresh-{user}", "expires_at": 0, "scope": ""}
+
+
+# Test that many users refreshing at once each get their own token, with one refresh per user, in parallel
+def test_concurrent_refresh_isolation_and_throughput(token_url):
+    auth = make_auth(token_url)
+    calls = [user for user in range(USERS) for _ in range(REQUESTS_PER_USER)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=50) as pool:
+        results = list(pool.map(lambda user: (user, auth.fresh_token(expired_token(user))[0]), calls))
+    elapsed = time.perf_counter() - start
+
+    for user, token in results:
+        assert token["access_token"] == f"access-refresh-{user}-1"
+        assert token["refresh_token"] == f"refresh-{user}"
+    assert FakeAccounts.refreshes == Counter({f"refresh-{user}": 1 for user in range(USERS)})
+    assert auth.stats() == {"refreshes": USERS, "shared": USERS * (REQUESTS_PER_USER - 1)}
+    # Refreshes of different users don't wait for each other
+    assert elapsed < USERS * REFRESH_LATENCY / 2
+
+# Test that valid tokens are used as they are and expired ones without a refresh token are rejected
+def test_fresh_token_without_refresh(token_url):
+    auth = make_auth(token_url)
+    valid = {"access_token": "a", "refresh_token": "r", "expires_at": int(time.time()) + 3600}
+    assert auth.fresh_token(valid) == (valid, False)
+    with pytest.raises(MissingRefreshToken):
+        auth.fresh_token({"access_token": "a", "expires_at": 0})
+    assert not FakeAccounts.refreshes
+
+# Test that concurrent requests of different users through the app each see only their own Spotify data
+def test_app_requests_use_callers_token(token_url):
+    import app as app_module
+
+    class FakeSpotify:
+        def __init__(self, auth=None, **kwargs):
+            self.auth = auth
+
+        def current_user_playlists(self, limit=50):
+            return {"items": [{"id": self.auth, "name": self.auth, "owner": {}, "tracks": {}}]}
+
+    # Three tabs per user, all holding the same expired token
+    clients = []
+    for user in range(USERS):
+        for _ in range(3):
+            client = app_module.app.test_client()
+            with client.session_transaction() as sess:
+                sess["token_info"] = expired_token(user)
+            clients.append((user, client))
+
+    def get_playlists(user_client):
+        user, client = user_client
+        res = client.get("/api/playlists")
+        with client.session_transaction() as sess:
+            return user, res.status_code, res.json, sess["token_info"]["access_token"]
+
+    with patch.object(app_module.sp_oauth, "OAUTH_TOKEN_URL", token_url), \
+         patch("app.RateLimitedSpotify", FakeSpotify):
+        with ThreadPoolExecutor(max_workers=USERS) as pool:
+            results = list(pool.map(get_playlists, clients))
+
+    for user, status, body, stored_token in results:
+        assert status == 200
+        assert [playlist["name"] for playlist in body] == [f"access-refresh-{user}-1"]
+        assert stored_token == f"access-refresh-{user}-1"
+    assert FakeAccounts.refreshes == Counter({f"refresh-{user}": 1 for user in range(USERS)})
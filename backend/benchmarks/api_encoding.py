@@ -0,0 +1,61 @@
+# Bytes on the wire and CPU time of an API response: JSON encoder x compression, for a
+# 50-track deck page, raw Spotify tracks and the compact projection.
+# Run from backend/: python -m benchmarks.api_encoding [--tracks 50] [--markets 185]
+
+import argparse
+import gzip
+import json
+
+from projection import project_tracks
+from benchmarks.payloads import synthetic_tracks
+from benchmarks.recommender import timed
+from response_encoding import orjson, brotli, API_GZIP_LEVEL, API_BROTLI_QUALITY
+
+
+def encoders():
+    # Same output rules as Flask's providers: compact, sorted keys
+    found = {"json": lambda body: json.dumps(body, separators=(",", ":"), sort_keys=True, ensure_ascii=False).encode()}
+    if orjson:
+        found["orjson"] = lambda body: orjson.dumps(body, option=orjson.OPT_SORT_KEYS)
+    return found
+
+
+def compressors():
+    found = {
+        "identity": lambda data: data,
+        f"gzip-{API_GZIP_LEVEL}": lambda data: gzip.compress(data, compresslevel=API_GZIP_LEVEL, mtime=0),
+    }
+    if brotli:
+        found[f"br-{API_BROTLI_QUALITY}"] = lambda data: brotli.compress(data, quality=API_BROTLI_QUALITY)
+    return found
+
+
+def run(n_tracks=50, n_markets=185, repeat=100):
+    tracks = synthetic_tracks(n_tracks, n_markets)
+    payloads = {"raw": {"tracks": tracks}, "compact": {"tracks": project_tracks(tracks)}}
+    results = []
+    for payload_name, payload in payloads.items():
+        encoded = {}
+        for encoder_name, encode in encoders().items():
+            encoded[encoder_name] = encode(payload)
+            results.append({"payload": payload_name, "step": f"encode {encoder_name}",
+                            "bytes": len(encoded[encoder_name]), "ms": timed(lambda: encode(payload), repeat)[1]})
+        data = encoded["json"]
+        for compressor_name, compress in compressors().items():
+            if compressor_name == "identity":
+                continue
+            results.append({"payload": payload_name, "step": f"compress {compressor_name}",
+                            "bytes": len(compress(data)), "ms": timed(lambda: compress(data), repeat)[1]})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tracks", type=int, default=50)
+    parser.add_argument("--markets", type=int, default=185)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{args.tracks} tracks, {args.markets} markets per track and album (median of {args.repeat} runs)")
+    for result in run(args.tracks, args.markets, args.repeat):
+        print(f"  {result['payload']:<8} {result['step']:<16} {result['bytes']:>8} bytes   {result['ms']:.3f} ms")
@@ -0,0 +1,57 @@
+# The subset of Motor's API the asyncio app uses, over an in-memory mongomock database,
+# so the ASGI app can be tested and load tested without a Mongo server. Like Motor, the
+# blocking calls run in a thread so they don't hold up the event loop.
+
+import asyncio
+
+import mongomock
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, n):
+        self._cursor = self._cursor.limit(n)
+        return self
+
+    async def to_list(self, length=None):
+        docs = await asyncio.to_thread(list, self._cursor)
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list():
+            yield doc
+
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self.sync = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.sync.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self, db=None):
+        self.sync = db if db is not None else mongomock.MongoClient().get_database("test")
+
+    def __getattr__(self, name):
+        return AsyncCollection(self.sync[name])
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.sync[name])
@@ -0,0 +1,269 @@
+# Benchmark of every route of app.py, in process: Flask's test client against the fake Spotify
+# of benchmarks/fake_spotify.py, with simulated latency per call, and Mongo in mongomock
+# (the setup of benchmarks/load_app.py). Per endpoint it measures p50/p95 latency of sequential
+# requests, requests per second with --concurrency clients, Spotify calls per request, response
+# bytes (compressed, as a browser gets them) and peak Python memory per request (tracemalloc).
+# Results are kept as JSON baselines; comparing a run to one flags the endpoints that regressed:
+#   python -m benchmarks.endpoints --save baseline.json
+#   python -m benchmarks.endpoints --compare baseline.json   (exits 1 on a regression)
+# Under a real server and a real Mongo, use benchmarks/load_test.py instead.
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.load_test import ENDPOINTS, MONGO_ENDPOINTS, GENRES, ARTISTS, percentile
+
+# name -> (URL rule in app.py, method, path fn(rng), body fn(rng) or None)
+ROUTES = {
+    **{name: (rule, method, path, body) for name, ((_, method, path, body), rule) in {
+        "similar-artists": (ENDPOINTS["similar-artists"], "/api/spotify/similar-artists/<artist_id>"),
+        "artist-tracks": (ENDPOINTS["artist-tracks"], "/api/spotify/artist-tracks/<artist_id>"),
+        "genre-tracks": (ENDPOINTS["genre-tracks"], "/api/spotify/genre-tracks/<genre>"),
+        "search": (ENDPOINTS["search"], "/api/spotify/search"),
+        "new-releases": (ENDPOINTS["new-releases"], "/api/new-releases"),
+        "home": (ENDPOINTS["home"], "/api/home"),
+        "healthz": (ENDPOINTS["healthz"], "/healthz"),
+        "discover": (MONGO_ENDPOINTS["discover"], "/api/spotify/discover-tracks"),
+        "personalized": (MONGO_ENDPOINTS["personalized"], "/api/spotify/personalized-tracks"),
+        "feedback-batch": (MONGO_ENDPOINTS["feedback-batch"], "/api/feedback/batch"),
+    }.items()},
+    "typeahead": ("/api/search/typeahead", "GET", lambda rng: f"/api/search/typeahead?q={rng.choice(GENRES)[:rng.randint(2, 4)]}", None),
+    "feedback": ("/api/feedback/<track_id>", "PUT", lambda rng: f"/api/feedback/{rng.choice(ARTISTS)}-top{rng.randrange(10)}",
+                 lambda rng: {"rating": rng.choice(("like", "dislike"))}),
+    "save": ("/api/save/<track_id>", "PUT", lambda rng: f"/api/save/saved{rng.randrange(1000)}", None),
+    "playlists": ("/api/playlists", "GET", lambda rng: "/api/playlists", None),
+    "user-tracks": ("/api/user-tracks", "GET", lambda rng: f"/api/user-tracks?limit=20&offset={20 * rng.randrange(10)}", None),
+    "browse-categories": ("/api/browse-categories", "GET", lambda rng: "/api/browse-categories", None),
+    "me": ("/api/me", "GET", lambda rng: "/api/me", None),
+    "authorize": ("/spotify/authorize", "GET", lambda rng: "/spotify/authorize", None),
+    "metrics": ("/metrics", "GET", lambda rng: "/metrics", None),
+    "readyz": ("/readyz", "GET", lambda rng: "/readyz", None),
+    "test-mongo": ("/test-mongo", "GET", lambda rng: "/test-mongo", None),
+    "frontend": ("/<path:path>", "GET", lambda rng: "/discover", None),
+    "frontend-root": ("/", "GET", lambda rng: "/", None),
+    "login": ("/login", "GET", lambda rng: "/login", None),
+    "logout": ("/logout", "GET", lambda rng: "/logout", None),
+}
+# Routes not benchmarked: the code exchange needs Spotify's accounts service
+EXCLUDED_RULES = {"/api/spotify/token", "/static/<path:filename>"}
+
+# metric -> (worse when higher, relative tolerance, absolute tolerance): a change is a
+# regression only past both, so sub-millisecond noise on fast endpoints doesn't count
+THRESHOLDS = {
+    "p50_ms": (True, 0.25, 1.0),
+    "p95_ms": (True, 0.30, 2.0),
+    "rps": (False, 0.30, 5.0),
+    "spotify_calls": (True, 0.0, 0.05),
+    "response_bytes": (True, 0.05, 64),
+    "peak_kib": (True, 0.25, 32),
+}
+
+
+def unbenchmarked_rules(app) -> set:
+    """URL rules of the app that no entry of ROUTES covers"""
+    return {rule.rule for rule in app.url_map.iter_rules()} - {route[0] for route in ROUTES.values()} - EXCLUDED_RULES
+
+
+def load_app(spotify_latency_ms):
+    """The app of benchmarks/load_app.py, in process with Mongo in mongomock, its Spotify
+    client counting calls. Returns (app, the counting client class)."""
+    os.environ["LOAD_TEST_MONGOMOCK"] = "1"
+    os.environ["LOAD_TEST_SPOTIFY"] = "inprocess"
+    import app as app_module
+    import benchmarks.load_app
+    from benchmarks.fake_spotify import FakeSpotify
+
+    class CountingSpotify(FakeSpotify):
+        """The fake Spotify, counting the calls that reach it"""
+        calls = 0
+        lock = threading.Lock()
+
+        def __init__(self, auth=None, latency=spotify_latency_ms / 1000, **kwargs):
+            super().__init__(auth, latency, **kwargs)
+
+        def _respond(self, result):
+            with CountingSpotify.lock:
+                CountingSpotify.calls += 1
+            return super()._respond(result)
+
+    app_module.RateLimitedSpotify = CountingSpotify
+    app_module.browse_client = CountingSpotify()
+    return benchmarks.load_app.app, CountingSpotify
+
+
+def settle():
+    """Let the background writes of the last requests finish, so they are neither timed
+    with the next endpoint nor left to pile up (mongomock writes cost CPU, Mongo's don't)"""
+    import app as app_module
+
+    app_module.catalog.flush()
+    app_module.feedback_writer.flush()
+
+
+def user_headers(app, n=0) -> dict:
+    from identity import IdentityResolver
+
+    return {
+        "X-User-Token": IdentityResolver(app.secret_key).issue_token(f"bench-user-{n}"),
+        "Accept-Encoding": "br, gzip",
+    }
+
+
+def send(client, route, rng, headers):
+    _, method, path, body = route
+    return client.open(path(rng), method=method, json=body(rng) if body else None, headers=headers)
+
+
+def measure_sequential(app, spotify, route, requests, seed) -> dict:
+    """Latency, Spotify calls and bytes of requests one after the other"""
+    rng = random.Random(seed)
+    client = app.test_client()
+    headers = user_headers(app)
+    latencies, sizes, statuses = [], [], Counter()
+    calls_before = spotify.calls
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = send(client, route, rng, headers)
+        sizes.append(len(response.get_data()))
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] += 1
+    latencies.sort()
+    return {
+        "status": statuses.most_common(1)[0][0],
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "spotify_calls": (spotify.calls - calls_before) / requests,
+        "response_bytes": sum(sizes) / requests,
+    }
+
+
+def measure_throughput(app, route, requests, concurrency, seed) -> float:
+    """Requests per second with `concurrency` clients sending `requests` each"""
+    def client_loop(n):
+        rng = random.Random(seed + n)
+        client = app.test_client()
+        headers = user_headers(app, n)
+        for _ in range(requests):
+            send(client, route, rng, headers)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client_loop, range(concurrency)))
+    return requests * concurrency / (time.perf_counter() - start)
+
+
+def measure_memory(app, route, requests, seed) -> float:
+    """Largest peak of Python allocations during one request, in KiB"""
+    rng = random.Random(seed)
+    client = app.test_client()
+    headers = user_headers(app)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(requests):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            send(client, route, rng, headers).get_data()
+            peaks.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    return max(peaks)
+
+
+def run(endpoints=None, requests=50, concurrency=8, spotify_latency_ms=5, memory_requests=10, seed=1) -> dict:
+    app, spotify = load_app(spotify_latency_ms)
+    app.logger.disabled = True
+    names = endpoints or list(ROUTES)
+    results = {}
+    for name in names:
+        route = ROUTES[name]
+        # The first requests fill the caches, as in a warm worker; cold paths still show in p95
+        # since every run draws new artists, queries and pages
+        result = measure_sequential(app, spotify, route, requests, seed)
+        settle()
+        result["rps"] = measure_throughput(app, route, max(1, requests // concurrency), concurrency, seed + 1000)
+        settle()
+        result["peak_kib"] = measure_memory(app, route, memory_requests, seed + 2000)
+        settle()
+        results[name] = result
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.machine()}, {os.cpu_count()} CPUs",
+        "config": {"requests": requests, "concurrency": concurrency, "spotify_latency_ms": spotify_latency_ms,
+                   "memory_requests": memory_requests, "seed": seed},
+        "unbenchmarked": sorted(unbenchmarked_rules(app)),
+        "endpoints": results,
+    }
+
+
+def compare(baseline: dict, result: dict, scale: float = 1.0) -> list:
+    """(endpoint, metric, baseline value, new value) of every regression past THRESHOLDS,
+    relative tolerances multiplied by scale. A changed status code is a regression too."""
+    regressions = []
+    for name, new in result["endpoints"].items():
+        old = baseline["endpoints"].get(name)
+        if old is None:
+            continue
+        if new["status"] != old["status"]:
+            regressions.append((name, "status", old["status"], new["status"]))
+        for metric, (higher_is_worse, relative, absolute) in THRESHOLDS.items():
+            change = (new[metric] - old[metric]) if higher_is_worse else (old[metric] - new[metric])
+            if change > absolute and change > abs(old[metric]) * relative * scale:
+                regressions.append((name, metric, old[metric], new[metric]))
+    return regressions
+
+
+def print_result(result, baseline=None):
+    config = result["config"]
+    print(f"{len(result['endpoints'])} endpoints, {config['requests']} requests each, {config['concurrency']} concurrent clients, "
+          f"Spotify mocked at {config['spotify_latency_ms']:.0f} ms per call")
+    print(f"  {'endpoint':<18} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8} {'calls':>6} {'bytes':>8} {'peak KiB':>9}")
+    for name, r in result["endpoints"].items():
+        print(f"  {name:<18} {r['status']:>6} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['rps']:>8.1f} "
+              f"{r['spotify_calls']:>6.2f} {r['response_bytes']:>8.0f} {r['peak_kib']:>9.1f}")
+    if result["unbenchmarked"]:
+        print(f"  not benchmarked: {', '.join(result['unbenchmarked'])}")
+    if baseline and baseline["config"] != config:
+        print(f"  warning: the baseline was run with {baseline['config']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ROUTES), help="defaults to all")
+    parser.add_argument("--requests", type=int, default=50, help="sequential requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--spotify-latency-ms", type=float, default=5)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="flag regressions against a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="multiplies the relative tolerances of THRESHOLDS")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    result = run(args.endpoints, args.requests, args.concurrency, args.spotify_latency_ms)
+    print_result(result, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print(f"saved to {args.save}")
+    if baseline:
+        regressions = compare(baseline, result, args.tolerance)
+        for name, metric, before, after in regressions:
+            print(f"  REGRESSION {name} {metric}: {before:.2f} -> {after:.2f}" if isinstance(after, float)
+                  else f"  REGRESSION {name} {metric}: {before} -> {after}")
+        print(f"{len(regressions)} regressions against {args.compare}" if regressions else f"no regressions against {args.compare}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,140 @@
+# A fake Spotify with synthetic, deterministic data, for load tests of both apps.
+# FakeSpotify stands in for the spotipy client of the Flask app; async_transport() serves
+# the same data over HTTP for the AsyncSpotify client of the ASGI app, through the fake
+# Spotify server of fake_spotify_server.py, which can also run on its own.
+#
+# LOAD_TEST_SPOTIFY_LATENCY_MS  simulated time per Spotify call (default 20)
+
+import os
+import time
+import zlib
+
+import httpx
+
+SPOTIFY_LATENCY = float(os.getenv("LOAD_TEST_SPOTIFY_LATENCY_MS", 20)) / 1000
+# Saved tracks in every fake user's library
+FAKE_LIBRARY_SIZE = 200
+
+
+def fake_track(track_id: str) -> dict:
+    n = zlib.crc32(track_id.encode())
+    artist_id = f"artist{n % 200}"
+    return {
+        "id": track_id,
+        "name": f"Track {track_id}",
+        "artists": [{"id": artist_id, "name": f"Artist {artist_id}"}],
+        "album": {"id": f"album{n % 500}", "name": f"Album {n % 500}", "images": [{"url": f"https://i.scdn.co/image/{n}"}]},
+        "available_markets": ["US", "GB", "DE", "FR", "SE"] * 37,
+        "duration_ms": 150000 + n % 100000,
+        "popularity": n % 100,
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+
+def fake_artist(artist_id: str) -> dict:
+    n = zlib.crc32(artist_id.encode())
+    return {
+        "id": artist_id,
+        "name": f"Artist {artist_id}",
+        "genres": [f"genre{n % 20}"],
+        "images": [{"url": f"https://i.scdn.co/image/{artist_id}"}],
+        "popularity": n % 100,
+        "external_urls": {"spotify": f"https://open.spotify.com/artist/{artist_id}"},
+    }
+
+
+def fake_album(album_id: str) -> dict:
+    return {
+        "id": album_id,
+        "name": f"Album {album_id}",
+        "artists": [{"id": "artist0", "name": "Artist 0"}],
+        "album_type": "album",
+        "release_date": "2024-01-01",
+        "total_tracks": 8,
+        "images": [{"url": f"https://i.scdn.co/image/{album_id}"}],
+        "available_markets": ["US", "GB", "DE", "FR", "SE"] * 37,
+        "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+        "tracks": {"items": [{"id": f"{album_id}-t{n}", "name": f"Track {n}", "artists": [{"id": "artist0", "name": "Artist 0"}]} for n in range(8)]},
+    }
+
+
+class FakeSpotify:
+    """Answers the calls the routes make with synthetic data, after `latency` seconds."""
+
+    def __init__(self, auth=None, latency: float = SPOTIFY_LATENCY, **kwargs):
+        self.auth = auth
+        self.latency = latency
+
+    def _respond(self, result):
+        if self.latency:
+            time.sleep(self.latency)
+        return result
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        return self._respond({"tracks": [fake_track(f"{artist_id}-top{n}") for n in range(10)]})
+
+    def artist_related_artists(self, artist_id):
+        n = zlib.crc32(artist_id.encode())
+        return self._respond({"artists": [{"id": f"artist{(n + i) % 200}", "name": f"Artist {(n + i) % 200}"} for i in range(20)]})
+
+    def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        return self._respond({"items": [{"id": f"{artist_id}-album{n}"} for n in range(limit)]})
+
+    def albums(self, albums):
+        return self._respond({"albums": [fake_album(album_id) for album_id in albums]})
+
+    def tracks(self, tracks, market=None):
+        return self._respond({"tracks": [fake_track(track_id) for track_id in tracks]})
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        types = type if isinstance(type, list) else type.split(",")
+        result = {}
+        if "track" in types:
+            result["tracks"] = {"items": [fake_track(f"{q}-{n}") for n in range(limit)]}
+        if "artist" in types:
+            result["artists"] = {"items": [{"id": f"artist{n}", "name": f"Artist {n}", "genres": [q], "images": []} for n in range(limit)]}
+        if "album" in types:
+            result["albums"] = {"items": [fake_album(f"{q}-album{n}") for n in range(limit)]}
+        return self._respond(result)
+
+    def new_releases(self, country=None, limit=20, offset=0):
+        return self._respond({"albums": {"items": [fake_album(f"new{offset + n}") for n in range(limit)], "total": 100}})
+
+    def categories(self, country=None, locale=None, limit=20, offset=0):
+        return self._respond({"categories": {"items": [
+            {"id": f"category{offset + n}", "name": f"Category {offset + n}", "icons": [{"url": f"https://i.example/category{offset + n}.jpg"}]}
+            for n in range(limit)
+        ], "total": 50, "limit": limit, "offset": offset}})
+
+    def current_user_saved_tracks(self, limit=20, offset=0, market=None):
+        # Newest first, like Spotify, one track saved per minute
+        return self._respond({"items": [
+            {"added_at": f"2024-01-01T{23 - n // 60:02d}:{59 - n % 60:02d}:00Z", "track": fake_track(f"saved{n}")}
+            for n in range(offset, min(offset + limit, FAKE_LIBRARY_SIZE))
+        ], "total": FAKE_LIBRARY_SIZE})
+
+    def current_user_saved_tracks_add(self, tracks=None):
+        return self._respond(None)
+
+    def current_user_playlists(self, limit=50, offset=0):
+        return self._respond({"items": [{
+            "id": f"playlist{offset + n}",
+            "name": f"Playlist {offset + n}",
+            "external_urls": {"spotify": f"https://open.spotify.com/playlist/playlist{offset + n}"},
+            "images": [{"url": f"https://i.scdn.co/image/playlist{offset + n}"}],
+            "tracks": {"total": 10 + n},
+        } for n in range(min(limit, 12))], "total": 12})
+
+    def current_user_top_tracks(self, limit=20, offset=0, time_range="medium_term"):
+        return self._respond({"items": [fake_track(f"top{offset + n}") for n in range(limit)]})
+
+    def current_user(self):
+        return self._respond({"id": "load-test-user", "display_name": "Load Test", "email": None})
+
+
+def async_transport(latency: float = SPOTIFY_LATENCY) -> httpx.ASGITransport:
+    """The fake Spotify server (fake_spotify_server.py) in process, as an httpx transport for
+    AsyncSpotify: no socket, and calls wait without blocking the loop."""
+    from benchmarks.fake_spotify_server import create_app
+
+    return httpx.ASGITransport(app=create_app(mode="synthetic", faults={"*": {"latency_ms": latency * 1000}}))
@@ -0,0 +1,222 @@
+# A local fake of the Spotify Web API and accounts service, over HTTP, so load tests, CI
+# benchmarks and manual runs need neither a network nor credentials.
+#   uvicorn benchmarks.fake_spotify_server:app --port 9090
+# then run the backend against it with
+#   SPOTIFY_API_URL=http://127.0.0.1:9090/v1/ SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:9090/
+#
+# FAKE_SPOTIFY_MODE      synthetic (default): deterministic data, the same fake_spotify.py makes
+#                        record: forward every call to Spotify and save its answers as fixtures
+#                        replay: answer from the recorded fixtures only, 404 for calls never recorded
+# FAKE_SPOTIFY_FIXTURES  fixture directory (default benchmarks/fixtures/spotify)
+# FAKE_SPOTIFY_FAULTS    latency and failures per endpoint, as JSON keyed by spotipy method name,
+#                        "*" for every endpoint: {"*": {"latency_ms": 20}, "search": {"latency_ms": 80,
+#                        "error_rate": 0.05, "throttle_rate": 0.01, "retry_after": 2}}
+# FAKE_SPOTIFY_SEED      seed of the injected failures, so a run can be repeated exactly
+#
+# Tokens are never recorded: in replay and synthetic modes the accounts service hands out
+# fake ones, and the API only checks that a bearer token is sent.
+# Scripts pointing spotipy at the fake should give their auth managers a MemoryCacheHandler
+# or NoCacheHandler, as app.py does, or spotipy writes the token to a .cache file.
+
+import os
+import json
+import random
+import asyncio
+import hashlib
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, RedirectResponse, Response
+from starlette.routing import Route
+
+from benchmarks.fake_spotify import FakeSpotify, fake_album, fake_artist, fake_track
+from metrics import spotify_endpoint
+
+FAKE_SPOTIFY_MODE = os.getenv("FAKE_SPOTIFY_MODE", "synthetic")
+FAKE_SPOTIFY_FIXTURES = os.getenv("FAKE_SPOTIFY_FIXTURES", os.path.join(os.path.dirname(__file__), "fixtures", "spotify"))
+FAKE_SPOTIFY_FAULTS = json.loads(os.getenv("FAKE_SPOTIFY_FAULTS", "{}"))
+FAKE_SPOTIFY_SEED = int(os.getenv("FAKE_SPOTIFY_SEED", 0))
+# Where record mode forwards to
+UPSTREAM_API_URL = os.getenv("FAKE_SPOTIFY_UPSTREAM_API_URL", "https://api.spotify.com/v1/")
+UPSTREAM_ACCOUNTS_URL = os.getenv("FAKE_SPOTIFY_UPSTREAM_ACCOUNTS_URL", "https://accounts.spotify.com/")
+
+MODES = ("synthetic", "record", "replay")
+
+_fake = FakeSpotify(latency=0)
+
+
+def _ids(params) -> list:
+    return params["ids"].split(",") if params.get("ids") else []
+
+
+def _int(params, name, default) -> int:
+    return int(params.get(name, default))
+
+
+# Synthetic answers by spotipy method: (ids in the path, query parameters) -> body
+SYNTHETIC = {
+    "artist_top_tracks": lambda ids, q: _fake.artist_top_tracks(ids[0], country=q.get("country", "US")),
+    "artist_related_artists": lambda ids, q: _fake.artist_related_artists(ids[0]),
+    "artist_albums": lambda ids, q: _fake.artist_albums(ids[0], limit=_int(q, "limit", 20), offset=_int(q, "offset", 0)),
+    "artist": lambda ids, q: fake_artist(ids[0]),
+    "artists": lambda ids, q: {"artists": [fake_artist(artist_id) for artist_id in _ids(q)]},
+    "album": lambda ids, q: fake_album(ids[0]),
+    "album_tracks": lambda ids, q: {"items": fake_album(ids[0])["tracks"]["items"], "total": 8},
+    "albums": lambda ids, q: _fake.albums(_ids(q)),
+    "track": lambda ids, q: fake_track(ids[0]),
+    "tracks": lambda ids, q: _fake.tracks(_ids(q)),
+    "search": lambda ids, q: _fake.search(q["q"], limit=_int(q, "limit", 10), offset=_int(q, "offset", 0), type=q.get("type", "track")),
+    "new_releases": lambda ids, q: _fake.new_releases(limit=_int(q, "limit", 20), offset=_int(q, "offset", 0)),
+    "categories": lambda ids, q: _fake.categories(limit=_int(q, "limit", 20), offset=_int(q, "offset", 0)),
+    "current_user": lambda ids, q: _fake.current_user(),
+    "current_user_saved_tracks": lambda ids, q: _fake.current_user_saved_tracks(limit=_int(q, "limit", 20), offset=_int(q, "offset", 0)),
+    "current_user_saved_tracks_add": lambda ids, q: None,
+    "current_user_saved_tracks_delete": lambda ids, q: None,
+    "current_user_playlists": lambda ids, q: _fake.current_user_playlists(limit=_int(q, "limit", 50), offset=_int(q, "offset", 0)),
+    "current_user_top_tracks": lambda ids, q: _fake.current_user_top_tracks(limit=_int(q, "limit", 20), offset=_int(q, "offset", 0)),
+}
+
+
+def spotify_error(status: int, message: str, headers=None) -> JSONResponse:
+    # The shape Spotify's errors have, so clients parse them as they would the real ones
+    return JSONResponse({"error": {"status": status, "message": message}}, status_code=status, headers=headers)
+
+
+class Faults:
+    """Latency and injected failures per endpoint, drawn from one seeded generator"""
+
+    def __init__(self, spec: dict, seed: int = 0):
+        self.spec = spec
+        self._random = random.Random(seed)
+
+    def for_endpoint(self, name: str) -> dict:
+        return {**self.spec.get("*", {}), **self.spec.get(name, {})}
+
+    def draw(self, name: str) -> tuple:
+        """(seconds to wait, error response or None) for a call to this endpoint"""
+        fault = self.for_endpoint(name)
+        latency = fault.get("latency_ms", 0) / 1000
+        roll = self._random.random()
+        throttle_rate = fault.get("throttle_rate", 0)
+        if roll < throttle_rate:
+            return latency, spotify_error(429, "API rate limit exceeded", {"Retry-After": str(fault.get("retry_after", 1))})
+        if roll < throttle_rate + fault.get("error_rate", 0):
+            return latency, spotify_error(fault.get("error_status", 503), "Service unavailable")
+        return latency, None
+
+
+class Fixtures:
+    """Recorded responses, one JSON file per distinct call, grouped by endpoint"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, name: str, method: str, path: str, params) -> str:
+        query = urlencode(sorted(params.multi_items()))
+        key = hashlib.sha1(f"{method} {path}?{query}".encode()).hexdigest()[:16]
+        return os.path.join(self.root, name.replace(" ", "_").replace("/", "_").replace("{", "").replace("}", ""), f"{key}.json")
+
+    def load(self, name, method, path, params) -> dict | None:
+        try:
+            with open(self.path(name, method, path, params)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, name, method, path, params, status: int, body):
+        fixture_path = self.path(name, method, path, params)
+        os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+        with open(fixture_path, "w") as f:
+            json.dump({"request": {"method": method, "path": path, "query": dict(params.multi_items())},
+                       "status": status, "body": body}, f, indent=1, sort_keys=True)
+
+
+def create_app(mode: str = FAKE_SPOTIFY_MODE, fixtures: str = FAKE_SPOTIFY_FIXTURES, faults: dict = None,
+               seed: int = FAKE_SPOTIFY_SEED, upstream_transport=None,
+               upstream_api_url: str = UPSTREAM_API_URL, upstream_accounts_url: str = UPSTREAM_ACCOUNTS_URL) -> Starlette:
+    """The fake as an ASGI app. upstream_transport replaces the HTTP transport to Spotify in record mode (for tests)."""
+    if mode not in MODES:
+        raise ValueError(f"FAKE_SPOTIFY_MODE must be one of {', '.join(MODES)}, not {mode!r}")
+    injected = Faults(FAKE_SPOTIFY_FAULTS if faults is None else faults, seed)
+    recorded = Fixtures(fixtures)
+    upstream = {}
+
+    def upstream_client() -> httpx.AsyncClient:
+        # Made on first use, in the event loop that serves the requests
+        if "client" not in upstream:
+            upstream["client"] = httpx.AsyncClient(transport=upstream_transport, timeout=10)
+        return upstream["client"]
+
+    async def api(request):
+        path = request.path_params["path"]
+        name, ids = spotify_endpoint(request.method, path)
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return spotify_error(401, "No token provided")
+        latency, failure = injected.draw(name)
+        if latency:
+            await asyncio.sleep(latency)
+        if failure is not None:
+            return failure
+
+        if mode == "record":
+            answer = await upstream_client().request(
+                request.method, upstream_api_url + path, params=request.query_params.multi_items(),
+                content=await request.body(), headers={"Authorization": request.headers["Authorization"]}
+            )
+            body = answer.json() if answer.content else None
+            recorded.save(name, request.method, path, request.query_params, answer.status_code, body)
+            return JSONResponse(body, status_code=answer.status_code, headers={
+                header: answer.headers[header] for header in ("Retry-After",) if header in answer.headers
+            })
+
+        if mode == "replay":
+            fixture = recorded.load(name, request.method, path, request.query_params)
+            if fixture is None:
+                return spotify_error(404, f"No fixture recorded for {request.method} {request.url.path}?{request.url.query}")
+            return JSONResponse(fixture["body"], status_code=fixture["status"])
+
+        respond = SYNTHETIC.get(name)
+        if respond is None:
+            return spotify_error(404, f"The fake has no {name}")
+        body = respond(ids, request.query_params)
+        return Response(status_code=200) if body is None else JSONResponse(body)
+
+    async def token(request):
+        if mode == "record":
+            answer = await upstream_client().post(
+                upstream_accounts_url + "api/token", content=await request.body(),
+                headers={header: request.headers[header] for header in ("Authorization", "Content-Type") if header in request.headers}
+            )
+            return Response(answer.content, status_code=answer.status_code, media_type="application/json")
+        # Parsed by hand, Starlette's form parsing needs python-multipart
+        form = dict(parse_qsl((await request.body()).decode()))
+        grant = form.get("grant_type")
+        seed_value = form.get("code") or form.get("refresh_token") or request.headers.get("Authorization", "")
+        body = {
+            "access_token": "fake-" + hashlib.sha1(f"{grant}:{seed_value}".encode()).hexdigest()[:24],
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "scope": form.get("scope", ""),
+        }
+        if grant in ("authorization_code", "refresh_token"):
+            body["refresh_token"] = form.get("refresh_token") or "fake-refresh-" + hashlib.sha1(str(seed_value).encode()).hexdigest()[:16]
+        return JSONResponse(body)
+
+    async def authorize(request):
+        if mode == "record":
+            return RedirectResponse(f"{upstream_accounts_url}authorize?{request.url.query}")
+        # Logs in straight away, like a user who has already granted access
+        query = {"code": "fake-code"}
+        if request.query_params.get("state"):
+            query["state"] = request.query_params["state"]
+        return RedirectResponse(f"{request.query_params['redirect_uri']}?{urlencode(query)}")
+
+    return Starlette(routes=[
+        Route("/v1/{path:path}", api, methods=["GET", "POST", "PUT", "DELETE"]),
+        Route("/api/token", token, methods=["POST"]),
+        Route("/authorize", authorize),
+    ])
+
+
+app = create_app()
@@ -0,0 +1,164 @@
+# Connection reuse and latency of Spotify calls under concurrent load, against a local HTTPS stand-in.
+# Compares a fresh requests session per page request (what a new Spotify(auth=...) client did)
+# with the shared pooled session every client now uses.
+# Run from backend/: python -m benchmarks.http_pool [--pages 200] [--calls 4] [--concurrency 16]
+
+import argparse
+import datetime
+import ipaddress
+import multiprocessing
+import os
+import ssl
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from http_pool import build_session
+
+
+def write_self_signed_cert(directory):
+    """A throwaway certificate for 127.0.0.1, returns (cert path, key path)."""
+    # cryptography comes with authlib, this import is only needed by the benchmark
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Keep-alive HTTPS endpoint that answers like a small Spotify response after a fixed delay."""
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+    latency = 0.005
+    connections = None  # multiprocessing.Value shared with the benchmark process
+    body = b'{"tracks": [' + b",".join(b'{"id": "%022d"}' % i for i in range(10)) + b"]}"
+
+    def setup(self):
+        super().setup()
+        with self.connections.get_lock():
+            self.connections.value += 1
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_stand_in(cert_path, key_path, latency, connections, port):
+    StandIn.latency = latency
+    StandIn.connections = connections
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    # Handshakes happen in the handler threads, not serialized in the accept loop
+    server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    port.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stand_in(cert_path, key_path, latency, connections):
+    """Run the stand-in in its own process, so it doesn't compete with the clients for the GIL."""
+    port = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_stand_in, args=(cert_path, key_path, latency, connections, port), daemon=True
+    )
+    process.start()
+    return process, port.get(timeout=10)
+
+
+def run_mode(url, verify, connections, session_for_page, pages, calls, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def page(_):
+        session = session_for_page()
+        for _ in range(calls):
+            start = time.perf_counter()
+            session.get(url, verify=verify, timeout=10).raise_for_status()
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    connections.value = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(page, range(pages)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        "calls": total,
+        "connections": connections.value,
+        "reuse_rate": 1 - connections.value / total,
+        "p50_ms": latencies[total // 2],
+        "p95_ms": latencies[int(total * 0.95)],
+        "calls_per_s": total / elapsed,
+    }
+
+
+def run(pages=200, calls=4, concurrency=16, latency_ms=5.0):
+    connections = multiprocessing.Value("i", 0)
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = write_self_signed_cert(directory)
+        process, port = start_stand_in(cert_path, key_path, latency_ms / 1000, connections)
+        url = f"https://127.0.0.1:{port}/v1/artists/x/top-tracks"
+        try:
+            # Before: every page request built its own client, and with it a new session
+            fresh = run_mode(url, cert_path, connections, requests.Session, pages, calls, concurrency)
+            pooled_session = build_session(pool_maxsize=concurrency)
+            pooled = run_mode(url, cert_path, connections, lambda: pooled_session, pages, calls, concurrency)
+        finally:
+            process.terminate()
+            process.join()
+    return {"pages": pages, "calls_per_page": calls, "concurrency": concurrency, "fresh": fresh, "pooled": pooled}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=4, help="Spotify calls per page request")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="server-side time per call")
+    args = parser.parse_args()
+
+    result = run(args.pages, args.calls, args.concurrency, args.latency_ms)
+    print(f"{result['pages']} pages x {result['calls_per_page']} calls, {result['concurrency']} concurrent, HTTPS")
+    for mode in ("fresh", "pooled"):
+        r = result[mode]
+        print(f"  {mode:<7} {r['connections']:>5} connections for {r['calls']} calls (reuse {r['reuse_rate']:.0%})"
+              f"   p50 {r['p50_ms']:.1f} ms   p95 {r['p95_ms']:.1f} ms   {r['calls_per_s']:.0f} calls/s")
@@ -0,0 +1,36 @@
+# The app with Spotify replaced by an in-process fake, for load tests.
+# Callers identify themselves with an X-User-Token header, no Spotify login is involved.
+# gunicorn -c gunicorn.conf.py benchmarks.load_app:app
+#
+# LOAD_TEST_SPOTIFY=server      call a running fake Spotify server (benchmarks/fake_spotify_server.py)
+#                               over HTTP, at SPOTIFY_API_URL and SPOTIFY_ACCOUNTS_URL, instead of
+#                               the in-process fake: the real clients, pools and retries are exercised
+# LOAD_TEST_SPOTIFY_LATENCY_MS  simulated time per Spotify call of the in-process fake (default 20)
+# LOAD_TEST_MONGOMOCK=1         keep Mongo in memory (per worker) instead of using MONGO_URI
+
+import os
+
+import app as app_module
+from app import app
+from benchmarks.fake_spotify import FakeSpotify
+
+if os.getenv("LOAD_TEST_SPOTIFY", "inprocess") == "inprocess":
+    app_module.RateLimitedSpotify = FakeSpotify
+    app_module.browse_client = FakeSpotify()
+app_module.validate_user_token = lambda: None
+app_module.get_session_token = lambda: {"access_token": "load-test"}
+
+if os.getenv("LOAD_TEST_MONGOMOCK") == "1":
+    import mongomock
+
+    mock_db = mongomock.MongoClient().get_database("load_test")
+    app_module.db = mock_db
+    app_module.catalog.db = mock_db
+    app_module.feedback_writer.collection = mock_db.user_feedback
+    app_module.deck_queues.collection = mock_db.deck_queues
+    app_module.browse_cache.collection = mock_db.response_cache
+    app_module.library.tracks = mock_db.library_tracks
+    app_module.library.state = mock_db.library_sync
+    # /readyz pings the client and checks the schema version `flask migrate` leaves
+    app_module.mongo = mock_db.client
+    app_module.migrate(mock_db)
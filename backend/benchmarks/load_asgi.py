@@ -0,0 +1,35 @@
+# The ASGI app (asgi.py) with Spotify replaced by the fake of benchmarks/fake_spotify.py, for load tests.
+# Callers identify themselves with an X-User-Token header, no Spotify login is involved.
+# uvicorn benchmarks.load_asgi:app
+#
+# LOAD_TEST_SPOTIFY_LATENCY_MS  simulated time per Spotify call (default 20)
+# LOAD_TEST_MONGOMOCK=1         keep Mongo in memory (per worker) instead of using MONGO_URI
+
+import os
+
+# The routes mounted from the Flask app get the same treatment as in load_app
+import benchmarks.load_app  # noqa: F401
+import asgi
+import async_spotify
+from benchmarks.fake_spotify import async_transport
+from rate_limit import RateBudget
+
+
+async def authorize(request):
+    request.state.session = {"token_info": {"access_token": "load-test"}}
+    request.state.session_changed = False
+    return None
+
+
+asgi.authorize = authorize
+# load_app's fake replaces the whole rate-limited client, don't budget the async one either
+async_spotify.spotify_budget = RateBudget(app_rate=1e9, app_burst=10 ** 9, user_rate=1e9, user_burst=10 ** 9)
+
+connect_db = None
+if os.getenv("LOAD_TEST_MONGOMOCK") == "1":
+    from benchmarks.async_mongomock import AsyncDatabase
+
+    def connect_db():
+        return AsyncDatabase(), lambda: None
+
+app = asgi.create_app(connect_db=connect_db, transport=async_transport())
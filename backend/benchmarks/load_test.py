@@ -0,0 +1,178 @@
+# Load test of the served app against a mocked Spotify (benchmarks/load_app.py, load_asgi.py).
+# Starts the app under gunicorn, as the async ASGI app under uvicorn, or under Flask's development
+# server, drives it with concurrent simulated users and reports requests per second and p50/p99
+# latency per endpoint. Several servers are run one after the other for a side-by-side comparison.
+# Run from backend/: python -m benchmarks.load_test [--server gunicorn asgi dev] [--users 32] [--duration 20]
+# Mongo-backed endpoints (discover, personalized, feedback) need a reachable MONGO_URI, or --mongomock.
+
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from identity import IdentityResolver
+
+ARTISTS = [f"artist{n}" for n in range(200)]
+GENRES = ["rock", "pop", "jazz", "hip-hop", "indie", "metal", "folk", "house"]
+
+# name -> (weight, method, path or fn(rng) -> path, body fn or None)
+ENDPOINTS = {
+    "similar-artists": (3, "GET", lambda rng: f"/api/spotify/similar-artists/{rng.choice(ARTISTS)}", None),
+    "artist-tracks": (3, "GET", lambda rng: f"/api/spotify/artist-tracks/{rng.choice(ARTISTS)}", None),
+    "genre-tracks": (2, "GET", lambda rng: f"/api/spotify/genre-tracks/{rng.choice(GENRES)}", None),
+    "search": (2, "GET", lambda rng: f"/api/spotify/search?q=song{rng.randrange(1000)}", None),
+    "new-releases": (1, "GET", lambda rng: "/api/new-releases", None),
+    "home": (1, "GET", lambda rng: "/api/home", None),
+    "healthz": (1, "GET", lambda rng: "/healthz", None),
+}
+MONGO_ENDPOINTS = {
+    "discover": (3, "GET", lambda rng: "/api/spotify/discover-tracks", None),
+    "personalized": (3, "GET", lambda rng: "/api/spotify/personalized-tracks", None),
+    "feedback-batch": (2, "POST", lambda rng: "/api/feedback/batch", lambda rng: {"ratings": [
+        {"track_id": f"{rng.choice(ARTISTS)}-top{rng.randrange(10)}", "rating": rng.choice(("like", "dislike"))}
+        for _ in range(5)
+    ]}),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, port, workers, threads, env):
+    env = dict(env, PORT=str(port), GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_ACCESS_LOG="", MIGRATE_ON_START="false", FLASK_ENV="production",
+               # the flask CLI would otherwise load the repo's .env, with another FLASK_SECRET_KEY
+               FLASK_SKIP_DOTENV="1")
+    if kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "benchmarks.load_app:app"]
+    elif kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "benchmarks.load_asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "benchmarks.load_app", "run", "--port", str(port), "--with-threads"]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=open(os.getenv("LOAD_TEST_LOG", os.devnull), "w"))
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/healthz", timeout=1).ok:
+                return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not come up on port {port}")
+
+
+def drive(base_url, endpoints, users, duration, secret_key, seed=1):
+    """Run `users` concurrent clients for `duration` seconds, returns {endpoint: [(latency ms, status)]}."""
+    identity = IdentityResolver(secret_key)
+    names = list(endpoints)
+    weights = [endpoints[name][0] for name in names]
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def user(n):
+        rng = random.Random(seed + n)
+        http = requests.Session()
+        http.headers["X-User-Token"] = identity.issue_token(f"load-user-{n}")
+        local = defaultdict(list)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            _, method, path, body = endpoints[name]
+            start = time.perf_counter()
+            try:
+                status = http.request(method, base_url + path(rng), json=body(rng) if body else None, timeout=30).status_code
+            except requests.RequestException:
+                status = 0
+            local[name].append(((time.perf_counter() - start) * 1000, status))
+        with lock:
+            for name, values in local.items():
+                samples[name].extend(values)
+
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(samples, duration) -> dict:
+    report = {}
+    for name, values in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in values)
+        report[name] = {
+            "requests": len(values),
+            "errors": sum(1 for _, status in values if not 200 <= status < 300),
+            "rps": len(values) / duration,
+            "p50_ms": percentile(latencies, 0.50),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+    return report
+
+
+def run(server="gunicorn", users=32, duration=20, workers=None, threads=8, spotify_latency_ms=20, mongo=False, mongomock=False):
+    workers = workers or (os.cpu_count() or 1) * 2 + 1
+    env = dict(os.environ, LOAD_TEST_SPOTIFY_LATENCY_MS=str(spotify_latency_ms))
+    if mongomock:
+        env["LOAD_TEST_MONGOMOCK"] = "1"
+    endpoints = dict(ENDPOINTS, **(MONGO_ENDPOINTS if mongo or mongomock else {}))
+
+    port = free_port()
+    process = start_server(server, port, workers, threads, env)
+    try:
+        samples = drive(f"http://127.0.0.1:{port}", endpoints, users, duration, env.get("FLASK_SECRET_KEY", "secret-dev-key"))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=45)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {"server": server, "workers": workers, "threads": threads, "users": users, "endpoints": summarize(samples, duration)}
+
+
+def print_result(result, spotify_latency_ms):
+    serving = {
+        "gunicorn": f"{result['workers']} workers x {result['threads']} threads",
+        "asgi": f"{result['workers']} uvicorn workers",
+    }.get(result["server"], "one threaded process")
+    print(f"{result['server']}: {serving}, {result['users']} users, Spotify mocked at {spotify_latency_ms:.0f} ms per call")
+    total = 0
+    for name, r in result["endpoints"].items():
+        total += r["rps"]
+        print(f"  {name:<16} {r['rps']:>7.1f} req/s   p50 {r['p50_ms']:>7.1f} ms   p99 {r['p99_ms']:>7.1f} ms"
+              f"   {r['errors']} errors / {r['requests']}")
+    print(f"  {'total':<16} {total:>7.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--server", nargs="+", choices=("gunicorn", "asgi", "dev"), default=["gunicorn"])
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--workers", type=int, help="gunicorn or uvicorn workers, defaults to 2 x cores + 1")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--spotify-latency-ms", type=float, default=20)
+    parser.add_argument("--mongo", action="store_true", help="also hit Mongo-backed endpoints, using MONGO_URI")
+    parser.add_argument("--mongomock", action="store_true", help="also hit Mongo-backed endpoints, with Mongo in memory")
+    args = parser.parse_args()
+
+    for server in args.server:
+        result = run(server, args.users, args.duration, args.workers, args.threads,
+                     args.spotify_latency_ms, args.mongo, args.mongomock)
+        print_result(result, args.spotify_latency_ms)
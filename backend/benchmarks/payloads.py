@@ -0,0 +1,89 @@
+# Serialized size and serialization time of a deck page, raw Spotify tracks vs the compact projection.
+# Run from backend/: python -m benchmarks.payloads [--tracks 20] [--markets 185]
+
+import argparse
+import json
+
+from projection import project_tracks
+from benchmarks.recommender import timed
+
+
+def synthetic_tracks(n_tracks, n_markets):
+    """Track objects shaped like Spotify's full track object, markets on the track and the album."""
+    markets = [f"{chr(65 + i // 26 % 26)}{chr(65 + i % 26)}" for i in range(n_markets)]
+    artist = lambda a: {
+        "id": f"artist{a:016d}",
+        "name": f"Artist {a}",
+        "type": "artist",
+        "uri": f"spotify:artist:artist{a:016d}",
+        "href": f"https://api.spotify.com/v1/artists/artist{a:016d}",
+        "external_urls": {"spotify": f"https://open.spotify.com/artist/artist{a:016d}"},
+    }
+    image = lambda size: {"url": f"https://i.scdn.co/image/ab67616d0000b273{size:024d}", "height": size, "width": size}
+    return [{
+        "id": f"{i:022d}",
+        "name": f"Track {i}",
+        "type": "track",
+        "uri": f"spotify:track:{i:022d}",
+        "href": f"https://api.spotify.com/v1/tracks/{i:022d}",
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{i:022d}"},
+        "external_ids": {"isrc": f"USRC1{i:07d}"},
+        "artists": [artist(i % 7)],
+        "album": {
+            "id": f"album{i % 5:017d}",
+            "name": f"Album {i % 5}",
+            "album_type": "album",
+            "artists": [artist(i % 7)],
+            "release_date": "2024-01-01",
+            "release_date_precision": "day",
+            "total_tracks": 12,
+            "images": [image(640), image(300), image(64)],
+            "available_markets": markets,
+            "href": f"https://api.spotify.com/v1/albums/album{i % 5:017d}",
+            "external_urls": {"spotify": f"https://open.spotify.com/album/album{i % 5:017d}"},
+        },
+        "available_markets": markets,
+        "disc_number": 1,
+        "track_number": i % 12 + 1,
+        "duration_ms": 180000 + i,
+        "explicit": False,
+        "is_local": False,
+        "popularity": i % 100,
+        "preview_url": None,
+    } for i in range(n_tracks)]
+
+
+def serialize(tracks):
+    # Same separators Flask's jsonify uses outside debug mode
+    return json.dumps({"tracks": tracks}, separators=(",", ":")).encode()
+
+
+def run(n_tracks=20, n_markets=185, repeat=200):
+    tracks = synthetic_tracks(n_tracks, n_markets)
+    raw_bytes = len(serialize(tracks))
+    compact_bytes = len(serialize(project_tracks(tracks)))
+    raw = timed(lambda: serialize(tracks), repeat)
+    compact = timed(lambda: serialize(project_tracks(tracks)), repeat)
+    return {
+        "tracks": n_tracks,
+        "markets": n_markets,
+        "raw_bytes": raw_bytes,
+        "compact_bytes": compact_bytes,
+        "ratio": raw_bytes / compact_bytes,
+        "raw_ms": {"best": raw[0], "median": raw[1]},
+        "compact_ms": {"best": compact[0], "median": compact[1]},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--markets", type=int, default=185)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    result = run(args.tracks, args.markets, args.repeat)
+    print(f"{result['tracks']} tracks, {result['markets']} markets per track and album")
+    print(f"  raw      {result['raw_bytes']:>8} bytes   best {result['raw_ms']['best']:.3f} ms   median {result['raw_ms']['median']:.3f} ms")
+    print(f"  compact  {result['compact_bytes']:>8} bytes   best {result['compact_ms']['best']:.3f} ms   median {result['compact_ms']['median']:.3f} ms   (projection included)")
+    print(f"  {result['ratio']:.1f}x smaller")
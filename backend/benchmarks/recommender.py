@@ -0,0 +1,70 @@
+# Micro-benchmark for the recommender's candidate scoring.
+# Run from backend/: python -m benchmarks.recommender [--ratings 5000] [--candidates 300]
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from recommender import ArtistAffinity
+
+
+def synthetic_feedback(n_ratings, n_artists, rng):
+    now = datetime.now(timezone.utc)
+    return [{
+        "track_id": f"rated{i}",
+        "rating": "like" if rng.random() < 0.7 else "dislike",
+        "timestamp": now - timedelta(days=rng.uniform(0, 365)),
+        "artists": [{"id": f"artist{rng.randrange(n_artists)}", "name": ""} for _ in range(rng.choice((1, 1, 2)))],
+    } for i in range(n_ratings)]
+
+
+def synthetic_candidates(n_candidates, n_artists, rng):
+    # Some duplicates and already-rated tracks, like a real candidate pool
+    return [{
+        "id": f"rated{i}" if i % 10 == 0 else f"track{rng.randrange(n_candidates)}",
+        "popularity": rng.randrange(100),
+        "artists": [{"id": f"artist{rng.randrange(n_artists)}", "name": ""}],
+    } for i in range(n_candidates)]
+
+
+def timed(fn, repeat):
+    """Best and median wall time of fn() in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[0], samples[len(samples) // 2]
+
+
+def run(n_ratings=5000, n_candidates=300, n_artists=800, repeat=50, seed=1):
+    rng = random.Random(seed)
+    feedback = synthetic_feedback(n_ratings, n_artists, rng)
+    candidates = synthetic_candidates(n_candidates, n_artists, rng)
+    affinity = ArtistAffinity.from_feedback(feedback)
+
+    build = timed(lambda: ArtistAffinity.from_feedback(feedback), repeat)
+    rank = timed(lambda: affinity.rank(candidates), repeat)
+    total = timed(lambda: ArtistAffinity.from_feedback(feedback).rank(candidates), repeat)
+    return {
+        "ratings": n_ratings,
+        "candidates": n_candidates,
+        "affinity_ms": {"best": build[0], "median": build[1]},
+        "rank_ms": {"best": rank[0], "median": rank[1]},
+        "total_ms": {"best": total[0], "median": total[1]},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ratings", type=int, default=5000)
+    parser.add_argument("--candidates", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    result = run(args.ratings, args.candidates, repeat=args.repeat)
+    print(f"{result['ratings']} ratings, {result['candidates']} candidates")
+    for step in ("affinity_ms", "rank_ms", "total_ms"):
+        print(f"  {step[:-3]:<9} best {result[step]['best']:.2f} ms   median {result[step]['median']:.2f} ms")
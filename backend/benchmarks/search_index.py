@@ -0,0 +1,71 @@
+# Micro-benchmark for the typeahead index: query latency on a full index.
+# Run from backend/: python -m benchmarks.search_index [--entries 50000] [--queries 2000]
+
+import argparse
+import random
+import time
+
+from search_index import PrefixIndex
+
+SYLLABLES = ["la", "mo", "ri", "ta", "ne", "so", "ka", "vi", "lu", "de", "po", "shi", "an", "el", "or", "un"]
+
+
+def synthetic_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+
+
+def synthetic_tracks(n_entries, n_artists, rng):
+    artists = [" ".join(synthetic_word(rng) for _ in range(rng.randint(1, 2))).title() for _ in range(n_artists)]
+    return [{
+        "id": f"track{i}",
+        "name": " ".join(synthetic_word(rng) for _ in range(rng.randint(1, 4))).title(),
+        "popularity": rng.randrange(100),
+        "artists": [{"id": f"artist{a}", "name": artists[a]} for a in [rng.randrange(n_artists)]],
+    } for i in range(n_entries)]
+
+
+def typeahead_queries(tracks, n_queries, rng):
+    """What a user has typed so far: whole words of a real name, then a prefix of the next word"""
+    queries = []
+    for _ in range(n_queries):
+        words = (rng.choice(tracks)["name"] + " " + rng.choice(tracks)["artists"][0]["name"]).lower().split()
+        typed = words[:rng.randint(0, len(words) - 1)]
+        last = words[len(typed)]
+        queries.append(" ".join(typed + [last[:rng.randint(2, max(2, len(last)))]]))
+    return queries
+
+
+def run(n_entries=50000, n_queries=2000, n_artists=5000, seed=1):
+    rng = random.Random(seed)
+    tracks = synthetic_tracks(n_entries, n_artists, rng)
+    index = PrefixIndex(maxsize=n_entries)
+
+    start = time.perf_counter()
+    index.add_spotify(tracks=tracks)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    samples = []
+    for query in typeahead_queries(tracks, n_queries, rng):
+        start = time.perf_counter()
+        index.search(query)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "entries": len(index),
+        "words": index.stats()["words"],
+        "build_ms": build_ms,
+        "query_ms": {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in (50, 90, 99)},
+        "answered": index.stats()["answered"] / n_queries,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    result = run(args.entries, args.queries)
+    print(f"{result['entries']} entries, {result['words']} distinct words, built in {result['build_ms']:.0f} ms")
+    print("  query " + "   ".join(f"p{p} {ms:.2f} ms" for p, ms in result["query_ms"].items()))
+    print(f"  answered locally: {result['answered']:.0%}")
@@ -0,0 +1,30 @@
+from app import app
+from benchmarks.endpoints import ROUTES, compare, unbenchmarked_rules
+
+
+def endpoint(**overrides):
+    return dict({"status": 200, "errors": 0, "p50_ms": 10.0, "p95_ms": 20.0, "rps": 100.0,
+                 "spotify_calls": 1.0, "response_bytes": 1000, "peak_kib": 100.0}, **overrides)
+
+
+# Test that every route of the app is in the endpoint benchmark, so new routes get measured
+def test_every_route_is_benchmarked():
+    assert unbenchmarked_rules(app) == set()
+    assert all(method in ("GET", "POST", "PUT") for _, method, _, _ in ROUTES.values())
+
+
+# Test that the comparison flags changes past both tolerances and only those
+def test_compare_flags_regressions():
+    baseline = {"endpoints": {"search": endpoint(), "healthz": endpoint(p50_ms=0.3)}}
+    result = {"endpoints": {
+        "search": endpoint(p50_ms=14.0, rps=60.0, spotify_calls=2.0, response_bytes=1020, status=500),
+        # Tripled, but by less than a millisecond
+        "healthz": endpoint(p50_ms=0.9),
+        "new": endpoint(),
+    }}
+
+    regressions = {(name, metric) for name, metric, _, _ in compare(baseline, result)}
+
+    assert regressions == {("search", "p50_ms"), ("search", "rps"), ("search", "spotify_calls"), ("search", "status")}
+    # Looser tolerances let the latency change through
+    assert ("search", "p50_ms") not in {(name, metric) for name, metric, _, _ in compare(baseline, result, scale=2)}
@@ -0,0 +1,239 @@
+# Persistent catalog of Spotify tracks and artists kept in MongoDB.
+# It fills itself from the Spotify payloads the backend already handles, so lookups by
+# id only go to Spotify for ids that are missing or older than CATALOG_MAX_AGE.
+# Because it lives in Mongo it survives restarts and is shared by every worker.
+# AsyncCatalog is the same catalog for the asyncio app, over Motor.
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", 7 * 24 * 3600))  # seconds
+# Spotify's several-tracks and several-artists endpoints accept at most 50 ids per call
+CATALOG_BATCH_SIZE = 50
+
+logger = logging.getLogger(__name__)
+
+
+def track_doc(track: dict) -> dict:
+    """The fields of a Spotify track object worth keeping in the catalog."""
+    doc = {
+        "name": track.get("name"),
+        "artists": [{"id": artist.get("id"), "name": artist.get("name")} for artist in track.get("artists", [])],
+        "duration_ms": track.get("duration_ms"),
+        "preview_url": track.get("preview_url"),
+        "external_urls": track.get("external_urls", {}),
+        "uri": track.get("uri"),
+    }
+    # Simplified track objects (e.g. album tracks) have no popularity or album,
+    # don't overwrite what a full track object stored before
+    if track.get("album"):
+        album = track["album"]
+        doc["album"] = {"id": album.get("id"), "name": album.get("name"), "images": album.get("images", [])}
+    if "popularity" in track:
+        doc["popularity"] = track["popularity"]
+    return doc
+
+
+def artist_doc(artist: dict) -> dict:
+    """The fields of a Spotify artist object worth keeping in the catalog."""
+    doc = {
+        "name": artist.get("name"),
+        "external_urls": artist.get("external_urls", {}),
+        "uri": artist.get("uri"),
+    }
+    # Simplified artist objects (inside tracks) only carry id and name
+    for field in ("genres", "images", "popularity"):
+        if field in artist:
+            doc[field] = artist[field]
+    return doc
+
+
+class Catalog:
+    """Read-through catalog over the `tracks` and `artists` collections."""
+
+    def __init__(self, db, max_age: int = CATALOG_MAX_AGE, on_record=None):
+        """on_record, if given, is called with the tracks and artists of every recorded payload (e.g. to index them)."""
+        self.db = db
+        self.max_age = max_age
+        self.on_record = on_record
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-writer")
+
+    def close(self):
+        """Finish the write in progress and drop queued ones, they are only a cache."""
+        self._writer.shutdown(wait=True, cancel_futures=True)
+
+    def flush(self):
+        """Wait for the writes queued so far (the writer runs them in order)."""
+        try:
+            self._writer.submit(lambda: None).result()
+        except RuntimeError:
+            pass  # Closed, nothing is left to wait for
+
+    def remember_tracks(self, tracks):
+        self._upsert(self.db.tracks, tracks, track_doc)
+        # Artists inside track objects are simplified, still worth having their names
+        self._upsert(self.db.artists, [artist for track in tracks if track for artist in track.get("artists", [])], artist_doc)
+
+    def remember_artists(self, artists):
+        self._upsert(self.db.artists, artists, artist_doc)
+
+    def record(self, tracks=(), artists=()):
+        """Store payloads in the background so the request never waits on the write."""
+        tracks, artists = list(tracks), list(artists)
+        if self.on_record:
+            self.on_record(tracks, artists)
+        if tracks or artists:
+            try:
+                self._writer.submit(self._record, tracks, artists)
+            except RuntimeError:
+                pass  # Closed, the process is shutting down
+
+    def _record(self, tracks, artists):
+        try:
+            if tracks:
+                self.remember_tracks(tracks)
+            if artists:
+                self.remember_artists(artists)
+        except Exception as e:
+            logger.error(f"CATALOG: Failed to store Spotify payload: {str(e)}")
+
+    def _upsert(self, collection, items, to_doc):
+        operations = upsert_operations(items, to_doc)
+        if operations:
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                raise_unless_duplicates(e)
+
+    def get_tracks(self, track_ids, sp_client=None) -> dict:
+        """Return {track_id: track doc}, fetching missing or stale ids from Spotify if a client is given."""
+        fetch = sp_client and (lambda batch: sp_client.tracks(batch)["tracks"])
+        return self._get(self.db.tracks, track_ids, fetch, self.remember_tracks, track_doc)
+
+    def get_track(self, track_id, sp_client=None) -> dict | None:
+        return self.get_tracks([track_id], sp_client).get(track_id)
+
+    def get_artists(self, artist_ids, sp_client=None) -> dict:
+        """Return {artist_id: artist doc}, fetching missing or stale ids from Spotify if a client is given."""
+        fetch = sp_client and (lambda batch: sp_client.artists(batch)["artists"])
+        return self._get(self.db.artists, artist_ids, fetch, self.remember_artists, artist_doc)
+
+    def _get(self, collection, ids, fetch, remember, to_doc) -> dict:
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for doc in collection.find(*fresh_query(ids, self.max_age)):
+            doc["id"] = doc.pop("_id")
+            found[doc["id"]] = doc
+
+        missing = [item_id for item_id in ids if item_id not in found]
+        if missing and fetch:
+            for start in range(0, len(missing), CATALOG_BATCH_SIZE):
+                fetched = [item for item in fetch(missing[start:start + CATALOG_BATCH_SIZE]) if item]
+                remember(fetched)
+                for item in fetched:
+                    found[item["id"]] = dict(to_doc(item), id=item["id"])
+        return found
+
+
+class AsyncCatalog:
+    """Catalog over Motor collections, for the asyncio app."""
+
+    def __init__(self, db, max_age: int = CATALOG_MAX_AGE, on_record=None):
+        self.db = db
+        self.max_age = max_age
+        self.on_record = on_record
+        self._writes = set()
+        # One write at a time, like the synchronous catalog's single writer thread, so
+        # catalog writes can't crowd out the queries requests are waiting on
+        self._write_lock = asyncio.Lock()
+
+    async def close(self):
+        """Drop the writes still waiting, they are only a cache."""
+        for task in list(self._writes):
+            task.cancel()
+        await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def remember_tracks(self, tracks):
+        await self._upsert(self.db.tracks, tracks, track_doc)
+        await self._upsert(self.db.artists, [artist for track in tracks if track for artist in track.get("artists", [])], artist_doc)
+
+    async def remember_artists(self, artists):
+        await self._upsert(self.db.artists, artists, artist_doc)
+
+    def record(self, tracks=(), artists=()):
+        """Store payloads in a background task so the request never waits on the write."""
+        tracks, artists = list(tracks), list(artists)
+        if self.on_record:
+            self.on_record(tracks, artists)
+        if tracks or artists:
+            task = asyncio.ensure_future(self._record(tracks, artists))
+            # Keep a reference until it is done, the loop only holds weak ones
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _record(self, tracks, artists):
+        try:
+            async with self._write_lock:
+                if tracks:
+                    await self.remember_tracks(tracks)
+                if artists:
+                    await self.remember_artists(artists)
+        except Exception as e:
+            logger.error(f"CATALOG: Failed to store Spotify payload: {str(e)}")
+
+    async def _upsert(self, collection, items, to_doc):
+        operations = upsert_operations(items, to_doc)
+        if operations:
+            try:
+                await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                raise_unless_duplicates(e)
+
+    async def get_tracks(self, track_ids, sp_client=None) -> dict:
+        """Return {track_id: track doc}, fetching missing or stale ids from Spotify if a client is given."""
+        ids = list(dict.fromkeys(track_ids))
+        found = {}
+        async for doc in self.db.tracks.find(*fresh_query(ids, self.max_age)):
+            doc["id"] = doc.pop("_id")
+            found[doc["id"]] = doc
+
+        missing = [track_id for track_id in ids if track_id not in found]
+        if missing and sp_client:
+            for start in range(0, len(missing), CATALOG_BATCH_SIZE):
+                fetched = [track for track in (await sp_client.tracks(missing[start:start + CATALOG_BATCH_SIZE]))["tracks"] if track]
+                await self.remember_tracks(fetched)
+                for track in fetched:
+                    found[track["id"]] = dict(track_doc(track), id=track["id"])
+        return found
+
+
+def upsert_operations(items, to_doc) -> list:
+    """One upsert per distinct id, stamped with the time it was stored."""
+    now = datetime.now(timezone.utc)
+    operations = {}
+    for item in items:
+        if item and item.get("id"):
+            operations[item["id"]] = UpdateOne(
+                {"_id": item["id"]},
+                {"$set": dict(to_doc(item), updated_at=now)},
+                upsert=True
+            )
+    return list(operations.values())
+
+
+def raise_unless_duplicates(e: BulkWriteError):
+    # Two requests upserting the same new id at once: one insert wins, and the
+    # other's data is just as fresh, so duplicate keys alone are not a failure
+    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+        raise e
+
+
+def fresh_query(ids, max_age) -> tuple:
+    """find() arguments for the catalog entries of these ids that are recent enough."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    return {"_id": {"$in": ids}, "updated_at": {"$gte": cutoff}}, {"updated_at": 0}
@@ -0,0 +1,53 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from catalog import Catalog
+
+mongomock = pytest.importorskip("mongomock")
+
+@pytest.fixture
+def catalog():
+    return Catalog(mongomock.MongoClient().db)
+
+def spotify_track(track_id):
+    return {
+        "id": track_id,
+        "name": f"Song {track_id}",
+        "artists": [{"id": "artist1", "name": "Artist"}],
+        "album": {"id": "album1", "name": "Album", "images": [], "available_markets": ["US", "CA"]},
+        "available_markets": ["US", "CA"],
+        "popularity": 50,
+    }
+
+# Test that tracks already in the catalog are served without asking Spotify
+def test_catalog_serves_known_tracks(catalog):
+    catalog.remember_tracks([spotify_track("t1")])
+    sp_client = MagicMock()
+    track = catalog.get_track("t1", sp_client)
+    assert track["name"] == "Song t1"
+    assert track["artists"] == [{"id": "artist1", "name": "Artist"}]
+    assert "available_markets" not in track
+    sp_client.tracks.assert_not_called()
+
+# Test that only missing ids are fetched from Spotify, in one batched call, and then stored
+def test_catalog_fetches_only_missing_tracks(catalog):
+    catalog.remember_tracks([spotify_track("t1")])
+    sp_client = MagicMock()
+    sp_client.tracks.return_value = {"tracks": [spotify_track("t2"), spotify_track("t3")]}
+
+    tracks = catalog.get_tracks(["t1", "t2", "t3"], sp_client)
+
+    assert set(tracks) == {"t1", "t2", "t3"}
+    sp_client.tracks.assert_called_once_with(["t2", "t3"])
+    assert catalog.db.tracks.count_documents({}) == 3
+    assert catalog.db.artists.find_one({"_id": "artist1"})["name"] == "Artist"
+
+# Test that stale entries are refreshed from Spotify
+def test_catalog_refreshes_stale_tracks(catalog):
+    catalog.remember_tracks([spotify_track("t1")])
+    catalog.db.tracks.update_one({"_id": "t1"}, {"$set": {"updated_at": datetime.now(timezone.utc) - timedelta(days=30)}})
+    sp_client = MagicMock()
+    sp_client.tracks.return_value = {"tracks": [spotify_track("t1")]}
+
+    assert catalog.get_track("t1", sp_client)["name"] == "Song t1"
+    sp_client.tracks.assert_called_once_with(["t1"])
@@ -0,0 +1,345 @@
+# Precomputed per-user recommendation queues ("decks") stored in MongoDB.
+# Deck endpoints pop the next tracks from the user's queue, which is a single atomic
+# Mongo update, so concurrent requests of the same user never get the same tracks. A local thread pool refills the queue in the background when it
+# drops below the low watermark, and rebuilds it when new feedback arrives.
+# Only a user's very first deck load builds the deck while they wait.
+# AsyncDeckQueues is the same queue for the asyncio app, refilled by tasks.
+# Decks that are generated per request instead (an artist's, a genre's) are kept as
+# snapshots in Mongo too, so every page of one walk through a deck comes from the same
+# snapshot whichever worker serves it.
+
+import os
+import uuid
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+DECK_QUEUE_TARGET = int(os.getenv("DECK_QUEUE_TARGET", 60))  # tracks kept ready per user and deck
+DECK_LOW_WATERMARK = int(os.getenv("DECK_LOW_WATERMARK", 15))
+DECK_SERVED_HISTORY = int(os.getenv("DECK_SERVED_HISTORY", 500))  # served ids remembered to avoid repeats
+DECK_REFILL_WORKERS = int(os.getenv("DECK_REFILL_WORKERS", 2))
+DECK_SNAPSHOT_TTL = int(os.getenv("DECK_SNAPSHOT_TTL", 900))  # seconds a generated deck can be paged through
+
+logger = logging.getLogger(__name__)
+
+
+def skipped_ids(existing: dict, reset: bool) -> set:
+    """Ids a fill must leave out: already served, and unless the queue is reset, already queued."""
+    skip = set(existing.get("served", []))
+    if not reset:
+        skip.update(item["id"] for item in existing.get("items", []))
+    return skip
+
+
+def fresh_tracks(built, existing: dict, reset: bool) -> list:
+    """The built tracks a fill may queue: those not served or queued yet. Once every one of them
+    has been served (builders give back much the same deck each time), they come round again,
+    least recently served first, rather than the deck running dry."""
+    tracks = [track for track in built if track.get("id") not in skipped_ids(existing, reset)]
+    if tracks:
+        return tracks
+    queued = set() if reset else {item["id"] for item in existing.get("items", [])}
+    last_served = {track_id: position for position, track_id in enumerate(existing.get("served", []))}
+    return sorted((track for track in built if track.get("id") not in queued),
+                  key=lambda track: last_served.get(track.get("id"), -1))
+
+
+def pop_update(n, served_history) -> list:
+    """Pipeline update dropping the first n items, their ids going to the served history"""
+    items = {"$ifNull": ["$items", []]}
+    return [{"$set": {
+        # Largest count $slice takes: everything after the first n
+        "items": {"$slice": [items, n, 2 ** 31 - 1]},
+        "served": {"$slice": [
+            {"$concatArrays": [{"$ifNull": ["$served", []]}, {"$slice": [{"$ifNull": ["$items.id", []]}, n]}]},
+            -served_history
+        ]},
+    }}]
+
+
+def pop_projection(n, low_watermark) -> dict:
+    # The popped tracks and enough after them to tell whether the queue is below the watermark
+    return {"items": {"$slice": n + low_watermark}, "generation": 1}
+
+
+def popped(before, n) -> tuple:
+    """(tracks, how many are left counted up to the watermark, generation) of the queue before a pop"""
+    if not before:
+        return [], 0, 0
+    window = before.get("items", [])
+    return window[:n], len(window[n:]), before.get("generation", 0)
+
+
+def fill_update(served, queued, reset, served_history) -> dict:
+    update = {"$set": {"updated_at": datetime.now(timezone.utc)}}
+    if reset:
+        # A rebuild that found nothing to queue leaves the queue, and the cursors on it, as they are
+        if queued:
+            update["$set"]["items"] = queued
+            update["$inc"] = {"generation": 1}
+    else:
+        update["$push"] = {"items": {"$each": queued}}
+    if served:
+        update.setdefault("$push", {})["served"] = {
+            "$each": [track["id"] for track in served], "$slice": -served_history
+        }
+    return update
+
+
+class DeckQueues:
+    def __init__(self, collection, builders: dict, before_refill=None,
+                 target: int = DECK_QUEUE_TARGET, low_watermark: int = DECK_LOW_WATERMARK,
+                 served_history: int = DECK_SERVED_HISTORY, workers: int = DECK_REFILL_WORKERS):
+        """builders maps a deck name to fn(sp_client, user_id) returning a ranked list of tracks.
+        before_refill, if given, is called before every background refill (e.g. to flush pending feedback)."""
+        self.collection = collection
+        self.builders = builders
+        self.before_refill = before_refill
+        self.target = target
+        self.low_watermark = low_watermark
+        self.served_history = served_history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deck-refill")
+        self._refilling = set()
+        self._rebuild_after = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id, deck):
+        return f"{user_id}:{deck}"
+
+    def next(self, user_id, deck, n, sp_client) -> tuple:
+        """Pop the next n tracks of the user's deck, building it first if the user has none yet.
+        Returns (tracks, generation of the queue they came from)."""
+        tracks, remaining, generation = self.pop(user_id, deck, n)
+        if not tracks:
+            # Cold start: build now, serve the head and queue the rest
+            tracks, generation = self.fill(user_id, deck, sp_client, reset=True, serve=n)
+        elif remaining < self.low_watermark:
+            self.request_refill(user_id, deck, sp_client)
+        return tracks, generation
+
+    def pop(self, user_id, deck, n) -> tuple:
+        """Remove up to n tracks from the head of the queue, returns (tracks, how many are left, generation).
+        How many are left is only counted up to the low watermark."""
+        # One update reads and removes the head: two requests never pop the same tracks
+        before = self.collection.find_one_and_update(
+            {"_id": self._key(user_id, deck)}, pop_update(n, self.served_history),
+            projection=pop_projection(n, self.low_watermark), return_document=ReturnDocument.BEFORE
+        )
+        return popped(before, n)
+
+    def fill(self, user_id, deck, sp_client, reset=False, serve=0) -> tuple:
+        """Build the deck and store it, skipping tracks already served or queued (see fresh_tracks).
+        With reset the queue is replaced instead of extended. The first `serve`
+        tracks are returned to the caller instead of being queued, together with
+        the queue's generation."""
+        key = self._key(user_id, deck)
+        existing = self.collection.find_one({"_id": key}, {"items.id": 1, "served": 1}) or {}
+        tracks = fresh_tracks(self.builders[deck](sp_client, user_id), existing, reset)
+        served, queued = tracks[:serve], tracks[serve:serve + self.target]
+        after = self.collection.find_one_and_update(
+            {"_id": key}, fill_update(served, queued, reset, self.served_history),
+            projection={"generation": 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return served, after.get("generation", 0)
+
+    def request_refill(self, user_id, deck, sp_client, reset=False):
+        """Refill (or with reset, rebuild) the queue on the background pool, at most once at a time per deck."""
+        key = self._key(user_id, deck)
+        with self._lock:
+            if key in self._refilling:
+                # A rebuild asked for mid-refill runs again once the current one is done
+                if reset:
+                    self._rebuild_after.add(key)
+                return
+            self._refilling.add(key)
+        try:
+            self._executor.submit(self._refill, key, user_id, deck, sp_client, reset)
+        except RuntimeError:
+            # Closed, the process is shutting down
+            with self._lock:
+                self._refilling.discard(key)
+
+    def _refill(self, key, user_id, deck, sp_client, reset):
+        try:
+            if self.before_refill:
+                self.before_refill()
+            self.fill(user_id, deck, sp_client, reset=reset)
+        except Exception as e:
+            logger.error(f"DECK: Failed to refill {deck} deck for user {user_id}: {str(e)}")
+        finally:
+            with self._lock:
+                rebuild = key in self._rebuild_after
+                self._rebuild_after.discard(key)
+                if not rebuild:
+                    self._refilling.discard(key)
+            if rebuild:
+                self._executor.submit(self._refill, key, user_id, deck, sp_client, True)
+
+    def close(self):
+        """Finish the refills in progress and drop queued ones, the next request asks again."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def generation(self, user_id, deck) -> int:
+        doc = self.collection.find_one({"_id": self._key(user_id, deck)}, {"generation": 1})
+        return doc.get("generation", 0) if doc else 0
+
+
+class AsyncDeckQueues:
+    """DeckQueues over a Motor collection, for the asyncio app. Builders and before_refill
+    are coroutine functions, and refills run as tasks on the event loop."""
+
+    def __init__(self, collection, builders: dict, before_refill=None,
+                 target: int = DECK_QUEUE_TARGET, low_watermark: int = DECK_LOW_WATERMARK,
+                 served_history: int = DECK_SERVED_HISTORY):
+        self.collection = collection
+        self.builders = builders
+        self.before_refill = before_refill
+        self.target = target
+        self.low_watermark = low_watermark
+        self.served_history = served_history
+        self._refilling = set()
+        self._rebuild_after = set()
+        self._tasks = set()
+
+    async def next(self, user_id, deck, n, sp_client) -> tuple:
+        tracks, remaining, generation = await self.pop(user_id, deck, n)
+        if not tracks:
+            tracks, generation = await self.fill(user_id, deck, sp_client, reset=True, serve=n)
+        elif remaining < self.low_watermark:
+            self.request_refill(user_id, deck, sp_client)
+        return tracks, generation
+
+    async def pop(self, user_id, deck, n) -> tuple:
+        before = await self.collection.find_one_and_update(
+            {"_id": DeckQueues._key(user_id, deck)}, pop_update(n, self.served_history),
+            projection=pop_projection(n, self.low_watermark), return_document=ReturnDocument.BEFORE
+        )
+        return popped(before, n)
+
+    async def fill(self, user_id, deck, sp_client, reset=False, serve=0) -> tuple:
+        key = DeckQueues._key(user_id, deck)
+        existing = await self.collection.find_one({"_id": key}, {"items.id": 1, "served": 1}) or {}
+        tracks = fresh_tracks(await self.builders[deck](sp_client, user_id), existing, reset)
+        served, queued = tracks[:serve], tracks[serve:serve + self.target]
+        after = await self.collection.find_one_and_update(
+            {"_id": key}, fill_update(served, queued, reset, self.served_history),
+            projection={"generation": 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return served, after.get("generation", 0)
+
+    def request_refill(self, user_id, deck, sp_client, reset=False):
+        """Refill (or with reset, rebuild) the queue in a task, at most once at a time per deck."""
+        key = DeckQueues._key(user_id, deck)
+        if key in self._refilling:
+            if reset:
+                self._rebuild_after.add(key)
+            return
+        self._refilling.add(key)
+        task = asyncio.ensure_future(self._refill(key, user_id, deck, sp_client, reset))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self, key, user_id, deck, sp_client, reset):
+        try:
+            while True:
+                try:
+                    if self.before_refill:
+                        await self.before_refill()
+                    await self.fill(user_id, deck, sp_client, reset=reset)
+                except Exception as e:
+                    logger.error(f"DECK: Failed to refill {deck} deck for user {user_id}: {str(e)}")
+                # A rebuild asked for mid-refill runs again once the current one is done
+                if key not in self._rebuild_after:
+                    return
+                self._rebuild_after.discard(key)
+                reset = True
+        finally:
+            self._refilling.discard(key)
+
+    async def close(self):
+        """Drop the refills in progress, the next request asks again."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class SnapshotExpired(LookupError):
+    """The snapshot is gone (expired, or never stored), a walk through the deck has to restart."""
+
+
+def snapshot_doc(snapshot_id, tracks, ttl) -> dict:
+    # Mongo drops the snapshot once it expires, see the schema's TTL index
+    return {"_id": snapshot_id, "tracks": tracks, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}
+
+
+def live_snapshot(snapshot_id) -> dict:
+    # The TTL monitor only runs once a minute, don't serve what it hasn't removed yet
+    return {"_id": snapshot_id, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+
+
+class DeckSnapshots:
+    """Generated decks in the `deck_snapshots` collection, shared by every worker, with
+    `cache` (a TTLCache) in front so the worker that built a deck doesn't read it back."""
+
+    def __init__(self, collection, cache, ttl: int = DECK_SNAPSHOT_TTL):
+        self.collection = collection
+        self.cache = cache
+        self.ttl = ttl
+
+    def create(self, tracks) -> str:
+        """Store a deck and return the id of its snapshot"""
+        snapshot_id = uuid.uuid4().hex
+        try:
+            self.collection.insert_one(snapshot_doc(snapshot_id, tracks, self.ttl))
+        except PyMongoError as e:
+            # Still pageable in this worker
+            logger.warning(f"DECK: Storing snapshot {snapshot_id} failed: {str(e)}")
+        self.cache.get_or_load("deck", snapshot_id, lambda: tracks)
+        return snapshot_id
+
+    def get(self, snapshot_id) -> list | None:
+        """The tracks of a snapshot, None once it is gone"""
+        try:
+            return self.cache.get_or_load("deck", snapshot_id, lambda: self._read(snapshot_id))
+        except SnapshotExpired:
+            return None
+
+    def _read(self, snapshot_id) -> list:
+        doc = self.collection.find_one(live_snapshot(snapshot_id), {"tracks": 1})
+        if not doc:
+            raise SnapshotExpired(snapshot_id)
+        return doc["tracks"]
+
+
+class AsyncDeckSnapshots(DeckSnapshots):
+    """DeckSnapshots over a Motor collection, for the asyncio app."""
+
+    async def create(self, tracks) -> str:
+        snapshot_id = uuid.uuid4().hex
+        try:
+            await self.collection.insert_one(snapshot_doc(snapshot_id, tracks, self.ttl))
+        except PyMongoError as e:
+            logger.warning(f"DECK: Storing snapshot {snapshot_id} failed: {str(e)}")
+
+        async def stored():
+            return tracks
+
+        await self.cache.get_or_load_async("deck", snapshot_id, stored)
+        return snapshot_id
+
+    async def get(self, snapshot_id) -> list | None:
+        try:
+            return await self.cache.get_or_load_async("deck", snapshot_id, lambda: self._read(snapshot_id))
+        except SnapshotExpired:
+            return None
+
+    async def _read(self, snapshot_id) -> list:
+        doc = await self.collection.find_one(live_snapshot(snapshot_id), {"tracks": 1})
+        if not doc:
+            raise SnapshotExpired(snapshot_id)
+        return doc["tracks"]
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from unittest.mock import MagicMock
+from deck_queue import DeckQueues
+
+mongomock = pytest.importorskip("mongomock")
+
+def make_tracks(prefix, n):
+    return [{"id": f"{prefix}{i}"} for i in range(n)]
+
+@pytest.fixture
+def builder():
+    return MagicMock(side_effect=lambda sp_client, user_id: make_tracks("t", 40))
+
+@pytest.fixture
+def queues(builder):
+    return DeckQueues(mongomock.MongoClient().db.deck_queues, {"discover": builder}, target=30, low_watermark=10)
+
+# Test that the first load builds the deck once and later loads are served from the queue
+def test_cold_start_then_pop(queues, builder):
+    first, generation = queues.next("u", "discover", 5, MagicMock())
+    second, _ = queues.next("u", "discover", 5, MagicMock())
+    assert [t["id"] for t in first] == ["t0", "t1", "t2", "t3", "t4"]
+    assert [t["id"] for t in second] == ["t5", "t6", "t7", "t8", "t9"]
+    assert builder.call_count == 1
+    assert generation == 1
+
+# Test that dropping below the watermark refills in the background without repeating served tracks
+def test_refill_below_watermark(queues, builder):
+    builder.side_effect = [make_tracks("t", 25), make_tracks("t", 25) + make_tracks("new", 20)]
+    queues.next("u", "discover", 5, MagicMock())      # 20 left queued
+    queues.next("u", "discover", 15, MagicMock())     # 5 left, below the watermark
+    deadline = time.monotonic() + 2
+    while builder.call_count < 2 or queues._refilling:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    served, _ = queues.next("u", "discover", 30, MagicMock())
+    assert [t["id"] for t in served] == [f"t{i}" for i in range(20, 25)] + [f"new{i}" for i in range(20)]
+
+# Test that a rebuild replaces the queue but still skips tracks the user has seen
+def test_reset_skips_served(queues, builder):
+    queues.next("u", "discover", 5, MagicMock())
+    queues.fill("u", "discover", MagicMock(), reset=True)
+    assert queues.generation("u", "discover") == 2
+    tracks, generation = queues.next("u", "discover", 1, MagicMock())
+    assert tracks[0]["id"] == "t5"
+    assert generation == 2
+
+# Test that concurrent pops of the same deck (two tabs, a double click) never serve a track twice
+def test_concurrent_pops_serve_each_track_once(queues):
+    queues.fill("u", "discover", MagicMock(), reset=True)
+    with ThreadPoolExecutor(8) as pool:
+        pages = list(pool.map(lambda _: queues.pop("u", "discover", 3)[0], range(8)))
+
+    ids = [track["id"] for page in pages for track in page]
+    assert len(ids) == len(set(ids)) == 24
+    assert queues.collection.find_one({"_id": "u:discover"})["served"] == [f"t{i}" for i in range(24)]
+
+# Test that a deck paged past everything its builder has starts over on the least recently
+# served tracks instead of running dry, without rebuilding the queue under the client's cursor
+def test_pages_past_one_full_deck(builder):
+    builder.side_effect = lambda sp_client, user_id: make_tracks("t", 20)
+    queues = DeckQueues(mongomock.MongoClient().db.deck_queues, {"discover": builder}, target=30, low_watermark=10,
+                        workers=1)
+    pages = []
+    for _ in range(10):
+        tracks, generation = queues.next("u", "discover", 5, MagicMock())
+        pages.append(([track["id"] for track in tracks], generation))
+        queues._executor.submit(lambda: None).result()  # Let a background refill land
+
+    assert [ids for ids, _ in pages[:4]] == [[f"t{i}" for i in range(n, n + 5)] for n in range(0, 20, 5)]
+    assert all(len(ids) == 5 for ids, _ in pages)
+    assert [ids for ids, _ in pages[4:8]] == [ids for ids, _ in pages[:4]]
+    assert {generation for _, generation in pages} == {1}
+
+# Test that a rebuild finding nothing to queue keeps the queue and its generation
+def test_empty_rebuild_keeps_generation(queues, builder):
+    queues.next("u", "discover", 5, MagicMock())
+    builder.side_effect = lambda sp_client, user_id: []
+    queues.fill("u", "discover", MagicMock(), reset=True)
+    assert queues.generation("u", "discover") == 1
+    assert queues.pop("u", "discover", 1)[0] == [{"id": "t5"}]
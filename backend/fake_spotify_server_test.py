@@ -0,0 +1,91 @@
+import os
+
+import httpx
+from starlette.testclient import TestClient
+
+from benchmarks.fake_spotify import fake_track
+from benchmarks.fake_spotify_server import create_app
+from http_pool import use_accounts_url
+
+AUTH = {"Authorization": "Bearer test-token"}
+
+
+# Test that the synthetic mode answers the Web API calls the apps make, with the fake's data
+def test_synthetic_endpoints():
+    client = TestClient(create_app(mode="synthetic", faults={}))
+
+    top = client.get("/v1/artists/artist7/top-tracks", params={"country": "US"}, headers=AUTH)
+    assert top.status_code == 200
+    assert top.json()["tracks"][0] == fake_track("artist7-top0")
+
+    tracks = client.get("/v1/tracks", params={"ids": "a,b"}, headers=AUTH).json()["tracks"]
+    assert [track["id"] for track in tracks] == ["a", "b"]
+    assert client.get("/v1/artists/artist3", headers=AUTH).json()["id"] == "artist3"
+    saved = client.get("/v1/me/tracks", params={"limit": 50, "offset": 180}, headers=AUTH).json()
+    assert len(saved["items"]) == 20 and saved["total"] == 200
+    assert client.put("/v1/me/tracks", params={"ids": "a"}, headers=AUTH).status_code == 200
+
+    assert client.get("/v1/me/top/artists", headers=AUTH).status_code == 404
+    unauthorized = client.get("/v1/me")
+    assert unauthorized.status_code == 401
+    assert unauthorized.json()["error"]["status"] == 401
+
+
+# Test that injected throttling answers 429 with Spotify's error body and a Retry-After,
+# only on the endpoints it was configured for
+def test_fault_injection():
+    client = TestClient(create_app(mode="synthetic", faults={"search": {"throttle_rate": 1, "retry_after": 4}}))
+
+    throttled = client.get("/v1/search", params={"q": "x", "type": "track"}, headers=AUTH)
+    assert throttled.status_code == 429
+    assert throttled.headers["Retry-After"] == "4"
+    assert throttled.json()["error"]["status"] == 429
+    assert client.get("/v1/me", headers=AUTH).status_code == 200
+
+    failing = TestClient(create_app(mode="synthetic", faults={"*": {"error_rate": 1}}))
+    assert failing.get("/v1/me", headers=AUTH).status_code == 503
+
+
+# Test that the same seed injects the same failures, so a run can be repeated
+def test_fault_injection_is_seeded():
+    def statuses(seed):
+        client = TestClient(create_app(mode="synthetic", faults={"*": {"error_rate": 0.5}}, seed=seed))
+        return [client.get("/v1/me", headers=AUTH).status_code for _ in range(20)]
+
+    assert statuses(3) == statuses(3)
+    assert set(statuses(3)) == {200, 503}
+
+
+# Test that record mode stores upstream answers and replay mode serves them back without
+# the upstream, and answers 404 for calls that were never recorded
+def test_record_then_replay(tmp_path):
+    upstream = httpx.ASGITransport(app=create_app(mode="synthetic", faults={}))
+    recorder = TestClient(create_app(mode="record", fixtures=str(tmp_path), faults={}, upstream_transport=upstream,
+                                     upstream_api_url="http://upstream/v1/"))
+    recorded = recorder.get("/v1/albums", params={"ids": "x,y"}, headers=AUTH)
+    assert recorded.status_code == 200
+    assert os.listdir(tmp_path) == ["albums"]
+
+    replayer = TestClient(create_app(mode="replay", fixtures=str(tmp_path), faults={}))
+    assert replayer.get("/v1/albums", params={"ids": "x,y"}, headers=AUTH).json() == recorded.json()
+    missing = replayer.get("/v1/albums", params={"ids": "z"}, headers=AUTH)
+    assert missing.status_code == 404
+
+
+# Test that the accounts service hands out tokens for the grants spotipy uses, and that
+# spotipy's auth managers can be pointed at it
+def test_fake_token_and_authorize():
+    client = TestClient(create_app(mode="synthetic", faults={}))
+
+    token = client.post("/api/token", data={"grant_type": "authorization_code", "code": "fake-code"}).json()
+    assert token["token_type"] == "Bearer" and token["access_token"] and token["refresh_token"]
+    assert "refresh_token" not in client.post("/api/token", data={"grant_type": "client_credentials"}).json()
+
+    login = client.get("/authorize", params={"redirect_uri": "http://app/callback", "state": "s"}, follow_redirects=False)
+    assert login.headers["location"] == "http://app/callback?code=fake-code&state=s"
+
+    class AuthManager:
+        pass
+
+    manager = use_accounts_url(AuthManager(), "http://127.0.0.1:9090/")
+    assert manager.OAUTH_TOKEN_URL == "http://127.0.0.1:9090/api/token"
@@ -0,0 +1,105 @@
+# Bounded concurrent fan-out for the per-artist Spotify calls made by the discovery routes.
+# All requests share one thread pool, and every call to fan_out() gets its own
+# concurrency cap and deadline so one slow deck load can't hog the whole pool.
+# fan_out_async() does the same for coroutines, on the event loop instead of the pool.
+
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+FANOUT_POOL_SIZE = int(os.getenv("SPOTIFY_FANOUT_POOL_SIZE", 32))
+FANOUT_MAX_CONCURRENCY = int(os.getenv("SPOTIFY_FANOUT_MAX_CONCURRENCY", 8))
+FANOUT_DEADLINE = float(os.getenv("SPOTIFY_FANOUT_DEADLINE", 5.0))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_POOL_SIZE, thread_name_prefix="spotify-fanout")
+_MISSING = object()
+
+
+def fan_out(fn, items, max_concurrency=None, deadline=None, on_error=None):
+    """Call fn(item) for every item in parallel and return the results in input order.
+
+    At most max_concurrency calls are in flight at once. Items whose call raises, or
+    that have not finished when the deadline (in seconds) runs out, are left out of
+    the result and reported through on_error(item, exception).
+    """
+    items = list(items)
+    results = dict(fan_out_as_completed(fn, items, max_concurrency, deadline, on_error))
+    return [results[index] for index in sorted(results)]
+
+
+def fan_out_as_completed(fn, items, max_concurrency=None, deadline=None, on_error=None):
+    """fan_out() that yields (index, result) pairs as soon as each call finishes.
+
+    on_error is called as failures happen, from the consuming thread. Calls still
+    running when the consumer stops iterating are cancelled where possible.
+    """
+    items = list(items)
+    limit = max(1, max_concurrency or FANOUT_MAX_CONCURRENCY)
+    deadline_at = time.monotonic() + (FANOUT_DEADLINE if deadline is None else deadline)
+
+    pending = {}
+    next_index = 0
+    try:
+        while next_index < len(items) or pending:
+            # Keep the window full without going over the per-request cap
+            while next_index < len(items) and len(pending) < limit:
+                # In the caller's context, so calls are counted as part of its request
+                pending[_executor.submit(contextvars.copy_context().run, fn, items[next_index])] = next_index
+                next_index += 1
+
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if on_error:
+                        on_error(items[index], e)
+                else:
+                    yield index, result
+
+        # Whatever is still running or never got started has missed the deadline
+        if on_error:
+            for index in sorted(pending.values()) + list(range(next_index, len(items))):
+                on_error(items[index], TimeoutError("deadline exceeded"))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def fan_out_async(fn, items, max_concurrency=None, deadline=None, on_error=None):
+    """fan_out() for coroutine functions: await fn(item) for every item concurrently.
+
+    Same cap, deadline and on_error semantics, results are returned in input order.
+    """
+    items = list(items)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or FANOUT_MAX_CONCURRENCY))
+
+    async def call(item):
+        async with semaphore:
+            return await fn(item)
+
+    tasks = [asyncio.ensure_future(call(item)) for item in items]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=FANOUT_DEADLINE if deadline is None else deadline)
+    for task in pending:
+        task.cancel()
+
+    results = []
+    for item, task in zip(items, tasks):
+        if task in pending:
+            if on_error:
+                on_error(item, TimeoutError("deadline exceeded"))
+        elif task.exception():
+            if on_error:
+                on_error(item, task.exception())
+        else:
+            results.append(task.result())
+    return results
@@ -0,0 +1,66 @@
+import time
+import asyncio
+from fanout import fan_out, fan_out_async
+
+# Test that results come back in input order even when calls finish out of order
+def test_fan_out_keeps_order():
+    def slow_echo(item):
+        time.sleep(0.05 * (3 - item))
+        return item
+    assert fan_out(slow_echo, [0, 1, 2]) == [0, 1, 2]
+
+# Test that a failing item is reported and left out of the partial results
+def test_fan_out_partial_results_on_error():
+    errors = []
+    def fetch(item):
+        if item == "bad":
+            raise ValueError("boom")
+        return item
+    results = fan_out(fetch, ["a", "bad", "b"], on_error=lambda item, e: errors.append(item))
+    assert results == ["a", "b"]
+    assert errors == ["bad"]
+
+# Test that items that miss the deadline are dropped instead of blocking the request
+def test_fan_out_deadline():
+    errors = []
+    def fetch(item):
+        if item == "slow":
+            time.sleep(0.5)
+        return item
+    start = time.monotonic()
+    results = fan_out(fetch, ["fast", "slow"], deadline=0.1, on_error=lambda item, e: errors.append((item, type(e))))
+    assert time.monotonic() - start < 0.4
+    assert results == ["fast"]
+    assert errors == [("slow", TimeoutError)]
+
+# Test that no more than max_concurrency calls run at the same time
+def test_fan_out_concurrency_cap():
+    running = []
+    peak = []
+    def fetch(item):
+        running.append(item)
+        peak.append(len(running))
+        time.sleep(0.02)
+        running.remove(item)
+        return item
+    assert len(fan_out(fetch, range(10), max_concurrency=2)) == 10
+    assert max(peak) <= 2
+
+# Test that the async fan-out keeps input order, caps concurrency and drops failures and late items
+def test_fan_out_async():
+    running, peak, errors = set(), [], []
+    async def fetch(item):
+        running.add(item)
+        peak.append(len(running))
+        await asyncio.sleep(1 if item == "slow" else 0.02 * (5 - len(item)))
+        running.discard(item)
+        if item == "bad":
+            raise ValueError("boom")
+        return item
+    results = asyncio.run(fan_out_async(
+        fetch, ["a", "bb", "bad", "ccc", "slow"], max_concurrency=2, deadline=0.5,
+        on_error=lambda item, e: errors.append((item, type(e)))
+    ))
+    assert results == ["a", "bb", "ccc"]
+    assert errors == [("bad", ValueError), ("slow", TimeoutError)]
+    assert max(peak) <= 2
@@ -0,0 +1,235 @@
+# Write-behind queue for user feedback (likes/dislikes).
+# Routes hand ratings to FeedbackWriter.submit() and answer right away; a background
+# thread coalesces them by (user_id, track_id), keeping only the latest rating, and
+# flushes them to Mongo as one unordered bulk_write of upserts.
+# The buffer is bounded: when Mongo falls behind and it fills up, submit() waits a
+# little and then raises FeedbackBackpressure so the route can ask the client to retry.
+# AsyncFeedbackWriter does the same in the asyncio app, with a task instead of a thread.
+
+import os
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pymongo import UpdateOne
+
+FEEDBACK_MAX_PENDING = int(os.getenv("FEEDBACK_MAX_PENDING", 10000))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", 1.0))  # seconds
+FEEDBACK_FLUSH_BATCH = int(os.getenv("FEEDBACK_FLUSH_BATCH", 500))
+FEEDBACK_SUBMIT_TIMEOUT = float(os.getenv("FEEDBACK_SUBMIT_TIMEOUT", 0.5))  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackBackpressure(Exception):
+    """The feedback buffer is full, the caller should retry later."""
+
+
+def feedback_operations(batch) -> list:
+    return [
+        UpdateOne({"user_id": doc["user_id"], "track_id": doc["track_id"]}, {"$set": doc}, upsert=True)
+        for doc in batch
+    ]
+
+
+def requeue(pending, batch):
+    """Put a batch that failed to write back at the front of the pending ratings."""
+    for doc in reversed(batch):
+        key = (doc["user_id"], doc["track_id"])
+        # A newer rating for the same track may have arrived meanwhile
+        if key not in pending:
+            pending[key] = doc
+            pending.move_to_end(key, last=False)
+
+
+class FeedbackWriter:
+    def __init__(self, collection, max_pending: int = FEEDBACK_MAX_PENDING,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL, flush_batch: int = FEEDBACK_FLUSH_BATCH,
+                 submit_timeout: float = FEEDBACK_SUBMIT_TIMEOUT):
+        self.collection = collection
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.submit_timeout = submit_timeout
+        self._pending = OrderedDict()  # (user_id, track_id) -> feedback document
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def submit(self, feedback_docs):
+        """Queue feedback documents (each with user_id and track_id) for the next flush."""
+        feedback_docs = list(feedback_docs)
+        with self._cond:
+            new_keys = {(doc["user_id"], doc["track_id"]) for doc in feedback_docs} - self._pending.keys()
+            has_room = self._cond.wait_for(
+                lambda: len(self._pending) + len(new_keys) <= self.max_pending,
+                timeout=self.submit_timeout
+            )
+            if not has_room:
+                raise FeedbackBackpressure(f"{len(self._pending)} ratings are waiting to be written")
+
+            for doc in feedback_docs:
+                key = (doc["user_id"], doc["track_id"])
+                self._pending.pop(key, None)  # Latest rating wins and moves to the back
+                self._pending[key] = doc
+            if len(self._pending) >= self.flush_batch:
+                self._cond.notify_all()
+        self._ensure_thread()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Write everything queued so far and return how many ratings were written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._pending:
+                        return written
+                    batch = [self._pending.popitem(last=False)[1] for _ in range(min(self.flush_batch, len(self._pending)))]
+                try:
+                    self.collection.bulk_write(feedback_operations(batch), ordered=False)
+                except Exception as e:
+                    self.failed_flushes += 1
+                    logger.error(f"FEEDBACK: Failed to write {len(batch)} ratings, will retry: {str(e)}")
+                    self._requeue(batch)
+                    return written
+                written += len(batch)
+                self.flushed += len(batch)
+                with self._cond:
+                    self._cond.notify_all()  # Wake up submitters waiting for room
+
+    def _requeue(self, batch):
+        with self._cond:
+            requeue(self._pending, batch)
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so each worker process starts its own
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.flush_batch,
+                    timeout=self.flush_interval
+                )
+                stopping = self._stopping
+            if self.flush() == 0 and self.pending():
+                time.sleep(self.flush_interval)  # Mongo is failing, back off before retrying
+            if stopping:
+                return
+
+    def close(self):
+        """Flush what's left, used on shutdown."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def register_shutdown(self):
+        atexit.register(self.close)
+        return self
+
+
+class AsyncFeedbackWriter:
+    """FeedbackWriter for the asyncio app, writing through a Motor collection."""
+
+    def __init__(self, collection, max_pending: int = FEEDBACK_MAX_PENDING,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL, flush_batch: int = FEEDBACK_FLUSH_BATCH,
+                 submit_timeout: float = FEEDBACK_SUBMIT_TIMEOUT):
+        self.collection = collection
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.submit_timeout = submit_timeout
+        self._pending = OrderedDict()  # (user_id, track_id) -> feedback document
+        self._cond = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    async def submit(self, feedback_docs):
+        """Queue feedback documents (each with user_id and track_id) for the next flush."""
+        feedback_docs = list(feedback_docs)
+        async with self._cond:
+            new_keys = {(doc["user_id"], doc["track_id"]) for doc in feedback_docs} - self._pending.keys()
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: len(self._pending) + len(new_keys) <= self.max_pending),
+                    self.submit_timeout
+                )
+            except asyncio.TimeoutError:
+                raise FeedbackBackpressure(f"{len(self._pending)} ratings are waiting to be written")
+
+            for doc in feedback_docs:
+                key = (doc["user_id"], doc["track_id"])
+                self._pending.pop(key, None)  # Latest rating wins and moves to the back
+                self._pending[key] = doc
+            if len(self._pending) >= self.flush_batch:
+                self._cond.notify_all()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Write everything queued so far and return how many ratings were written."""
+        written = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = [self._pending.popitem(last=False)[1] for _ in range(min(self.flush_batch, len(self._pending)))]
+                try:
+                    await self.collection.bulk_write(feedback_operations(batch), ordered=False)
+                except Exception as e:
+                    self.failed_flushes += 1
+                    logger.error(f"FEEDBACK: Failed to write {len(batch)} ratings, will retry: {str(e)}")
+                    requeue(self._pending, batch)
+                    return written
+                written += len(batch)
+                self.flushed += len(batch)
+                async with self._cond:
+                    self._cond.notify_all()  # Wake up submitters waiting for room
+        return written
+
+    async def _run(self):
+        while not self._stopping:
+            async with self._cond:
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._stopping or len(self._pending) >= self.flush_batch),
+                        self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            if await self.flush() == 0 and self._pending:
+                await asyncio.sleep(self.flush_interval)  # Mongo is failing, back off before retrying
+
+    async def close(self):
+        """Flush what's left, used on shutdown."""
+        self._stopping = True
+        async with self._cond:
+            self._cond.notify_all()
+        if self._task:
+            await self._task
+        await self.flush()
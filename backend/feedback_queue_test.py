@@ -0,0 +1,50 @@
+import time
+import pytest
+from unittest.mock import MagicMock
+from feedback_queue import FeedbackWriter, FeedbackBackpressure
+
+def rating(user_id, track_id, value="like"):
+    return {"user_id": user_id, "track_id": track_id, "rating": value}
+
+# Test that repeated ratings for one track are coalesced and flushed as a single unordered bulk write
+def test_flush_coalesces_into_one_bulk_write():
+    collection = MagicMock()
+    writer = FeedbackWriter(collection, flush_interval=60)
+    writer.submit([rating("u", "t1"), rating("u", "t2")])
+    writer.submit([rating("u", "t1", "dislike")])
+
+    assert writer.flush() == 2
+    collection.bulk_write.assert_called_once()
+    operations = collection.bulk_write.call_args[0][0]
+    assert collection.bulk_write.call_args[1] == {"ordered": False}
+    assert [op._doc["$set"]["rating"] for op in operations] == ["like", "dislike"]
+
+# Test that the background thread flushes on its interval
+def test_background_flush():
+    collection = MagicMock()
+    writer = FeedbackWriter(collection, flush_interval=0.05)
+    writer.submit([rating("u", "t1")])
+    deadline = time.monotonic() + 2
+    while writer.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.pending() == 0
+    assert collection.bulk_write.called
+    writer.close()
+
+# Test that a full buffer pushes back instead of growing without bound
+def test_backpressure_when_buffer_is_full():
+    writer = FeedbackWriter(MagicMock(), max_pending=2, flush_interval=60, submit_timeout=0.01)
+    writer.submit([rating("u", "t1"), rating("u", "t2")])
+    writer.submit([rating("u", "t1", "dislike")])  # Replacing a queued rating needs no room
+    with pytest.raises(FeedbackBackpressure):
+        writer.submit([rating("u", "t3")])
+
+# Test that ratings survive a failed write and go out with the next flush
+def test_failed_flush_is_retried():
+    collection = MagicMock()
+    collection.bulk_write.side_effect = [Exception("mongo down"), None]
+    writer = FeedbackWriter(collection, flush_interval=60)
+    writer.submit([rating("u", "t1")])
+    assert writer.flush() == 0
+    assert writer.pending() == 1
+    assert writer.flush() == 1
@@ -0,0 +1,68 @@
+# Production serving: gunicorn -c gunicorn.conf.py app:app
+# Every setting can be overridden from the environment (GUNICORN_*), the defaults
+# suit the single-container deployment in Dockerfile.prod.
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+
+# Requests mostly wait on Spotify and Mongo, so each worker runs several threads
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# The workers split the Spotify app budget between them (rate_limit.py), so they need the count
+os.environ["GUNICORN_WORKERS"] = str(workers)
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# Import the app once in the master and fork it, so workers start fast and share memory.
+# The app's MongoClient is built with connect=False and background threads start on first
+# use, so neither exists before the fork; post_fork gives each worker its own Spotify HTTP
+# pool in place of the one the import-time clients were built with.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# A worker stuck on a request for longer than this is killed and replaced
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+# Time given to in-flight requests on restart (SIGHUP) or shutdown (SIGTERM)
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers now and then so slow leaks can't build up, jittered so they don't all restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None  # empty disables it
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    """Apply pending schema migrations once, in the master, before any worker serves."""
+    if os.getenv("MIGRATE_ON_START", "true").lower() != "true":
+        return
+    from pymongo import MongoClient
+    from schema import migrate
+
+    # A client of its own, so no Mongo connection is opened in the master and inherited by workers
+    client = MongoClient(os.getenv("MONGO_URI"))
+    try:
+        applied = migrate(client.get_default_database())
+        server.log.info(f"SCHEMA: Applied migrations {applied}" if applied else "SCHEMA: Up to date")
+    finally:
+        client.close()
+
+
+def post_fork(server, worker):
+    """Move the Spotify clients built at import onto this worker's own HTTP session."""
+    from app import sp_oauth, browse_client
+    from http_pool import rebind_session
+    rebind_session(sp_oauth, browse_client, browse_client.auth_manager)
+
+
+def worker_exit(server, worker):
+    """Write out feedback still waiting in this worker's queue before it goes away, and drop
+    queued background work that would otherwise hold the exit up until the graceful timeout."""
+    from app import feedback_writer, deck_queues, catalog, library
+    library.close()
+    deck_queues.close()
+    feedback_writer.close()
+    catalog.close()
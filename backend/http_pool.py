@@ -0,0 +1,100 @@
+# The process-wide HTTP transport for Spotify (api.spotify.com and accounts.spotify.com).
+# Every Spotify client shares this one requests.Session, so the TCP and TLS connections
+# behind it are kept alive and reused across requests and users instead of being set up
+# again for each request. requests' connection pools are thread-safe; the session holds
+# no per-user state, since auth headers are passed on every call.
+
+import os
+import socket
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+SPOTIFY_POOL_CONNECTIONS = int(os.getenv("SPOTIFY_POOL_CONNECTIONS", 4))  # hosts to keep pools for
+SPOTIFY_POOL_MAXSIZE = int(os.getenv("SPOTIFY_POOL_MAXSIZE", 32))  # idle connections kept per host
+SPOTIFY_POOL_BLOCK = os.getenv("SPOTIFY_POOL_BLOCK", "false").lower() == "true"  # wait for a free connection instead of opening one more
+SPOTIFY_KEEPALIVE_IDLE = int(os.getenv("SPOTIFY_KEEPALIVE_IDLE", 60))  # seconds before TCP keep-alive probes, 0 disables them
+SPOTIFY_CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", 3.05))
+SPOTIFY_READ_TIMEOUT = float(os.getenv("SPOTIFY_READ_TIMEOUT", 10))
+
+# (connect, read), as accepted by requests' timeout argument
+SPOTIFY_TIMEOUT = (SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT)
+# Where the Web API and the accounts service are, overridden to run against a local fake
+# (benchmarks/fake_spotify_server.py) in load tests and CI
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1/")
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com/")
+
+
+def keepalive_socket_options(idle: int) -> list:
+    """Socket options that make the OS probe idle pooled connections, so dead ones are noticed."""
+    options = list(HTTPConnection.default_socket_options)
+    if idle <= 0:
+        return options
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # Not every platform lets us tune the probes
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 4)))
+    return options
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    def __init__(self, keepalive_idle: int = SPOTIFY_KEEPALIVE_IDLE, **kwargs):
+        self.keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = keepalive_socket_options(self.keepalive_idle)
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_session(pool_connections: int = SPOTIFY_POOL_CONNECTIONS, pool_maxsize: int = SPOTIFY_POOL_MAXSIZE,
+                  pool_block: bool = SPOTIFY_POOL_BLOCK, keepalive_idle: int = SPOTIFY_KEEPALIVE_IDLE) -> requests.Session:
+    # No urllib3 retries: RateLimitedSpotify decides what to retry, and when
+    adapter = KeepAliveAdapter(
+        keepalive_idle=keepalive_idle,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=0,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def use_accounts_url(auth_manager, accounts_url: str = SPOTIFY_ACCOUNTS_URL):
+    """Point a spotipy auth manager (SpotifyOAuth, SpotifyClientCredentials) at SPOTIFY_ACCOUNTS_URL"""
+    auth_manager.OAUTH_AUTHORIZE_URL = accounts_url + "authorize"
+    auth_manager.OAUTH_TOKEN_URL = accounts_url + "api/token"
+    return auth_manager
+
+
+# Shared by every Spotify client and the OAuth manager in this process.
+# Rebuilt in a forked child, since pooled sockets must not be shared across processes.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def spotify_session() -> requests.Session:
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = build_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def rebind_session(*clients) -> requests.Session:
+    """Hand this process's session to spotipy clients and auth managers built before a fork.
+
+    spotipy keeps the session it was given, so clients made at import in gunicorn's master
+    would otherwise go on using the master's pool in every worker."""
+    session = spotify_session()
+    for client in clients:
+        client._session = session
+    return session
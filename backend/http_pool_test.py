@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from unittest.mock import patch
+from http_pool import build_session, spotify_session, rebind_session
+
+
+class CountingServer(BaseHTTPRequestHandler):
+    """Keep-alive HTTP/1.1 server that counts the connections it accepts."""
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            type(self).connections += 1
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    CountingServer.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1/ping"
+    server.shutdown()
+    server.server_close()
+
+
+# Test that sequential calls reuse one kept-alive connection
+def test_sequential_calls_reuse_connection(server_url):
+    session = build_session()
+    for _ in range(20):
+        assert session.get(server_url, timeout=5).json() == {"ok": True}
+    assert CountingServer.connections == 1
+
+# Test that concurrent callers never open more connections than the pool keeps
+def test_concurrent_calls_bounded_by_pool(server_url):
+    session = build_session(pool_maxsize=4, pool_block=True)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda _: session.get(server_url, timeout=5).status_code, range(80)))
+    assert statuses == [200] * 80
+    assert CountingServer.connections <= 4
+
+# Test that every client in the process gets the same session
+def test_shared_session():
+    assert spotify_session() is spotify_session()
+
+# Test that clients built before a fork are moved onto the forked process's own session
+def test_rebind_session_after_fork():
+    import http_pool
+
+    class Client:
+        _session = spotify_session()
+
+    client = Client()
+    with patch.object(http_pool, "_session_pid", -1):
+        session = rebind_session(client)
+    assert client._session is session is spotify_session()
+    assert session is not Client._session
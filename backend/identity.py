@@ -0,0 +1,70 @@
+# Resolves the caller's Spotify user id without a Spotify round-trip whenever possible.
+# The id is looked up, in order, from the session (stored by /api/spotify/token), from a
+# signed identity token sent in the X-User-Token header, and from a short-lived
+# profile cache keyed by access token. Only on a complete miss do we call current_user().
+# An identity token is bound to the Spotify login it was issued for (a digest of its
+# refresh token, which outlives the access tokens), so it can't be replayed from
+# another user's session.
+
+import os
+import hashlib
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from spotify_cache import TTLCache
+
+IDENTITY_TOKEN_MAX_AGE = int(os.getenv("IDENTITY_TOKEN_MAX_AGE", 7 * 24 * 3600))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", 300))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+
+
+class IdentityResolver:
+    def __init__(self, secret_key: str, token_max_age: int = IDENTITY_TOKEN_MAX_AGE,
+                 profile_ttl: int = PROFILE_CACHE_TTL, profile_cache_size: int = PROFILE_CACHE_SIZE):
+        self._serializer = URLSafeTimedSerializer(secret_key, salt="spotify-user-identity")
+        self.token_max_age = token_max_age
+        self.profiles = TTLCache(profile_cache_size, {"profile": profile_ttl})
+
+    def issue_token(self, user_id: str, refresh_token: str = None) -> str:
+        """Signed, expiring token the frontend can send back as X-User-Token, valid with
+        the session holding this refresh token only."""
+        return self._serializer.dumps({"id": user_id, "login": login_digest(refresh_token)})
+
+    def user_id_from_token(self, token: str, refresh_token: str = None) -> str | None:
+        try:
+            claims = self._serializer.loads(token, max_age=self.token_max_age)
+            if claims.get("login") != login_digest(refresh_token):
+                return None
+            return claims.get("id")
+        except (BadSignature, AttributeError):
+            return None
+
+    def resolve_user_id(self, session_user_id=None, identity_token=None, access_token=None, fetch_profile=None,
+                        refresh_token=None) -> str | None:
+        if session_user_id:
+            return session_user_id
+        if identity_token:
+            user_id = self.user_id_from_token(identity_token, refresh_token)
+            if user_id:
+                return user_id
+        if access_token and fetch_profile:
+            # Never keep raw access tokens around as cache keys
+            key = hashlib.sha256(access_token.encode()).hexdigest()
+            profile = self.profiles.get_or_load("profile", key, fetch_profile)
+            return profile.get("id") if profile else None
+        return None
+
+    async def resolve_user_id_async(self, session_user_id=None, identity_token=None, access_token=None, fetch_profile=None,
+                                    refresh_token=None) -> str | None:
+        """resolve_user_id() where fetch_profile is a coroutine function."""
+        user_id = self.resolve_user_id(session_user_id, identity_token, refresh_token=refresh_token)
+        if user_id or not (access_token and fetch_profile):
+            return user_id
+        key = hashlib.sha256(access_token.encode()).hexdigest()
+        profile = await self.profiles.get_or_load_async("profile", key, fetch_profile)
+        return profile.get("id") if profile else None
+
+
+def login_digest(refresh_token: str | None) -> str | None:
+    # A digest, so the token doesn't carry the refresh token itself. Every real session has a
+    # refresh token, so a token issued without one (load tests) never matches a real session
+    return hashlib.sha256(refresh_token.encode()).hexdigest()[:32] if refresh_token else None
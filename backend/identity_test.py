@@ -0,0 +1,30 @@
+from unittest.mock import MagicMock
+from identity import IdentityResolver
+
+# Test that a signed identity token resolves to its user and a tampered one doesn't
+def test_identity_token_round_trip():
+    resolver = IdentityResolver("secret")
+    token = resolver.issue_token("user1")
+    assert resolver.resolve_user_id(identity_token=token) == "user1"
+    assert resolver.resolve_user_id(identity_token=token + "x") is None
+    assert IdentityResolver("other-secret").user_id_from_token(token) is None
+
+# Test that an identity token only resolves in the session of the login it was issued for,
+# so someone else's token can't be used with one's own Spotify login
+def test_identity_token_bound_to_login():
+    resolver = IdentityResolver("secret")
+    fetch_profile = MagicMock(return_value={"id": "attacker"})
+    token = resolver.issue_token("victim", refresh_token="victim-refresh")
+
+    assert resolver.resolve_user_id(identity_token=token, refresh_token="victim-refresh") == "victim"
+    assert resolver.user_id_from_token(token) is None
+    assert resolver.resolve_user_id(identity_token=token, access_token="attacker-access", fetch_profile=fetch_profile,
+                                    refresh_token="attacker-refresh") == "attacker"
+
+# Test that the profile fallback is only fetched once per access token
+def test_profile_fallback_is_cached():
+    resolver = IdentityResolver("secret")
+    fetch_profile = MagicMock(return_value={"id": "user1"})
+    for _ in range(3):
+        assert resolver.resolve_user_id(access_token="token", fetch_profile=fetch_profile) == "user1"
+    assert fetch_profile.call_count == 1
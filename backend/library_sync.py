@@ -0,0 +1,236 @@
+# Local copy of each user's saved tracks and top tracks, kept in MongoDB.
+# A background job pulls the whole saved-tracks library the first time, fetching its pages
+# concurrently. After that it only fetches what was saved since the last sync: Spotify lists
+# saved tracks newest first, so paging stops at the first added_at older than the newest one
+# already stored. If the counts no longer add up (tracks were removed), or the last full pass
+# is too old, the library is pulled in full again.
+# Library reads (the user's tracks, the discover deck's seed artists) then come from the
+# local copy: one indexed query or document read, however big the library is.
+
+import os
+import math
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from catalog import track_doc
+from fanout import fan_out
+
+# Spotify's saved-tracks endpoint returns at most 50 tracks per page
+LIBRARY_PAGE_SIZE = 50
+LIBRARY_SYNC_INTERVAL = int(os.getenv("LIBRARY_SYNC_INTERVAL", 15 * 60))  # seconds before a library is synced again
+LIBRARY_FULL_SYNC_INTERVAL = int(os.getenv("LIBRARY_FULL_SYNC_INTERVAL", 24 * 3600))  # seconds between full passes
+LIBRARY_SYNC_CONCURRENCY = int(os.getenv("LIBRARY_SYNC_CONCURRENCY", 4))  # pages fetched at once
+LIBRARY_SYNC_DEADLINE = float(os.getenv("LIBRARY_SYNC_DEADLINE", 120))
+LIBRARY_SYNC_LEASE = int(os.getenv("LIBRARY_SYNC_LEASE", 300))  # seconds one worker holds a user's sync
+LIBRARY_SYNC_WORKERS = int(os.getenv("LIBRARY_SYNC_WORKERS", 2))
+LIBRARY_TOP_ARTISTS = 50  # most saved artists remembered per user
+# The discover deck seeds from this many of the user's most saved artists, picked among the top ones
+DISCOVER_SEED_ARTISTS = 10
+DISCOVER_SEED_POOL = 30
+
+logger = logging.getLogger(__name__)
+
+
+def as_utc(value: datetime) -> datetime:
+    # Mongo hands datetimes back naive, in UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def library_track_doc(track: dict) -> dict:
+    return dict(track_doc(track), id=track["id"])
+
+
+def saved_items(page: dict) -> list:
+    """The saved tracks of a page that can be stored, local files and unavailable tracks have no id"""
+    return [item for item in page.get("items", []) if (item.get("track") or {}).get("id")]
+
+
+def discover_artist_ids(state: dict | None) -> list:
+    """Seed artists for the discover deck, drawn from the user's most saved artists"""
+    pool = ((state or {}).get("top_artists") or [])[:DISCOVER_SEED_POOL]
+    return random.sample(pool, min(DISCOVER_SEED_ARTISTS, len(pool)))
+
+
+class LibrarySync:
+    """Syncs users' libraries into `library_tracks`, with one `library_sync` state document per user."""
+
+    def __init__(self, db, interval: int = LIBRARY_SYNC_INTERVAL, full_interval: int = LIBRARY_FULL_SYNC_INTERVAL,
+                 concurrency: int = LIBRARY_SYNC_CONCURRENCY, deadline: float = LIBRARY_SYNC_DEADLINE,
+                 lease: int = LIBRARY_SYNC_LEASE, workers: int = LIBRARY_SYNC_WORKERS):
+        self.tracks = db.library_tracks
+        self.state = db.library_sync
+        self.interval = interval
+        self.full_interval = full_interval
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.lease = lease
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library-sync")
+        self._syncing = set()
+        self._lock = threading.Lock()
+
+    def state_of(self, user_id) -> dict | None:
+        """The user's sync state, None if their library was never synced"""
+        state = self.state.find_one({"_id": user_id}, {"lease_until": 0})
+        return state if state and state.get("synced_at") else None
+
+    def is_stale(self, state: dict | None) -> bool:
+        if not state:
+            return True
+        return as_utc(state["synced_at"]) < datetime.now(timezone.utc) - timedelta(seconds=self.interval)
+
+    def request_sync(self, user_id, sp_client):
+        """Sync the user's library on the background pool, at most once at a time per user in this process."""
+        with self._lock:
+            if user_id in self._syncing:
+                return
+            self._syncing.add(user_id)
+        try:
+            self._executor.submit(self._sync_in_background, user_id, sp_client)
+        except RuntimeError:
+            # Closed, the process is shutting down
+            with self._lock:
+                self._syncing.discard(user_id)
+
+    def _sync_in_background(self, user_id, sp_client):
+        try:
+            self.sync(user_id, sp_client)
+        except Exception as e:
+            logger.error(f"LIBRARY: Syncing the library of {user_id} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._syncing.discard(user_id)
+
+    def sync(self, user_id, sp_client) -> dict | None:
+        """Bring the user's local library up to date. Returns what was done, or None if
+        another worker is syncing this user right now."""
+        state = self._claim(user_id)
+        if state is None:
+            return None
+        try:
+            first = sp_client.current_user_saved_tracks(limit=LIBRARY_PAGE_SIZE)
+            total = first.get("total", len(first.get("items", [])))
+            latest = state.get("latest_added_at")
+            full_due = not state.get("full_synced_at") or \
+                as_utc(state["full_synced_at"]) < datetime.now(timezone.utc) - timedelta(seconds=self.full_interval)
+
+            stored = None
+            if latest and not full_due:
+                stored = self._sync_delta(user_id, sp_client, first, total, latest, state.get("saved_total") or 0)
+            full = stored is None or stored != total
+            if full:
+                stored = self._sync_full(user_id, sp_client, first, total)
+
+            top_tracks = sp_client.current_user_top_tracks(limit=LIBRARY_PAGE_SIZE, time_range="short_term")
+            newest = self.tracks.find_one({"user_id": user_id}, {"added_at": 1}, sort=[("added_at", DESCENDING)])
+            now = datetime.now(timezone.utc)
+            update = {
+                "saved_total": stored,
+                "latest_added_at": newest["added_at"] if newest else None,
+                "top_tracks": [library_track_doc(track) for track in top_tracks.get("items", []) if track.get("id")],
+                "top_artists": self._top_artists(user_id),
+                "synced_at": now,
+            }
+            if full:
+                update["full_synced_at"] = now
+            self.state.update_one({"_id": user_id}, {"$set": update})
+            logger.info(f"LIBRARY: Synced {stored} saved tracks of {user_id} ({'full' if full else 'delta'})")
+            return {"saved_total": stored, "full": full}
+        finally:
+            self.state.update_one({"_id": user_id}, {"$unset": {"lease_until": ""}})
+
+    def _claim(self, user_id) -> dict | None:
+        """Take the user's sync lease, so workers don't sync the same library at once"""
+        now = datetime.now(timezone.utc)
+        try:
+            return self.state.find_one_and_update(
+                {"_id": user_id, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"lease_until": now + timedelta(seconds=self.lease)}},
+                upsert=True
+            ) or {}
+        except DuplicateKeyError:
+            return None  # The state exists and its lease is held
+
+    def _fetch_pages(self, sp_client, offsets) -> list:
+        """The saved-tracks pages at these offsets, fetched concurrently"""
+        failures = []
+        pages = fan_out(
+            lambda offset: sp_client.current_user_saved_tracks(limit=LIBRARY_PAGE_SIZE, offset=offset),
+            offsets, max_concurrency=self.concurrency, deadline=self.deadline,
+            on_error=lambda offset, e: failures.append(e)
+        )
+        # A partial library would look like removed tracks, better to try again later
+        if failures:
+            raise failures[0]
+        return pages
+
+    def _sync_delta(self, user_id, sp_client, first, total, latest, known) -> int | None:
+        """Store what was saved since the last sync. Returns how many tracks are stored now,
+        or None if the last stored track wasn't found where it should be."""
+        items = saved_items(first)
+        reached = any(item["added_at"] < latest for item in first.get("items", []))
+        if not reached and len(first.get("items", [])) < total:
+            # Assuming nothing was removed, the new tracks and the newest stored one (where paging stops)
+            missing = max(total - known, 0)
+            last = min(LIBRARY_PAGE_SIZE * math.ceil((missing + 1) / LIBRARY_PAGE_SIZE), total)
+            for page in self._fetch_pages(sp_client, range(LIBRARY_PAGE_SIZE, last, LIBRARY_PAGE_SIZE)):
+                items.extend(saved_items(page))
+                reached = reached or any(item["added_at"] < latest for item in page.get("items", []))
+        if not reached and len(items) < total:
+            return None
+
+        # Ties on added_at are stored again, upserts make that harmless
+        self._store(user_id, [item for item in items if item["added_at"] >= latest])
+        return self.tracks.count_documents({"user_id": user_id})
+
+    def _sync_full(self, user_id, sp_client, first, total) -> int:
+        """Store the whole library and drop the tracks that are no longer in it"""
+        items = saved_items(first)
+        for page in self._fetch_pages(sp_client, range(LIBRARY_PAGE_SIZE, total, LIBRARY_PAGE_SIZE)):
+            items.extend(saved_items(page))
+        synced_at = datetime.now(timezone.utc)
+        self._store(user_id, items, synced_at)
+        self.tracks.delete_many({"user_id": user_id, "synced_at": {"$lt": synced_at}})
+        return self.tracks.count_documents({"user_id": user_id})
+
+    def _store(self, user_id, items, synced_at=None):
+        synced_at = synced_at or datetime.now(timezone.utc)
+        operations = [
+            UpdateOne({"_id": f"{user_id}:{item['track']['id']}"}, {"$set": {
+                "user_id": user_id,
+                "track_id": item["track"]["id"],
+                "added_at": item["added_at"],
+                "track": library_track_doc(item["track"]),
+                "synced_at": synced_at,
+            }}, upsert=True)
+            for item in items
+        ]
+        if operations:
+            self.tracks.bulk_write(operations, ordered=False)
+
+    def _top_artists(self, user_id) -> list:
+        """The user's most saved artists, most saved first"""
+        return [group["_id"] for group in self.tracks.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$unwind": "$track.artists"},
+            {"$group": {"_id": "$track.artists.id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": LIBRARY_TOP_ARTISTS},
+        ]) if group["_id"]]
+
+    def saved_page(self, user_id, limit: int, offset: int = 0) -> list:
+        """(track, added_at) pairs of the user's saved tracks, newest first, from the local copy"""
+        cursor = self.tracks.find({"user_id": user_id}, {"track": 1, "added_at": 1}) \
+            .sort([("added_at", DESCENDING), ("track_id", DESCENDING)]).skip(offset).limit(limit)
+        return [(doc["track"], doc["added_at"]) for doc in cursor]
+
+    def track_ids(self, user_id) -> frozenset:
+        """Ids of every saved track of the user, read from the index alone"""
+        return frozenset(doc["track_id"] for doc in self.tracks.find({"user_id": user_id}, {"track_id": 1, "_id": 0}))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,88 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from library_sync import LibrarySync, discover_artist_ids
+
+mongomock = pytest.importorskip("mongomock")
+
+class FakeLibrary:
+    """A user's saved tracks as Spotify pages them, newest first"""
+
+    def __init__(self, size):
+        self.saved = 0
+        self.items = []
+        self.offsets = []
+        for _ in range(size):
+            self.save()
+
+    def save(self):
+        added_at = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=self.saved)
+        artist = "fav" if self.saved % 2 else f"artist{self.saved}"
+        track = {"id": f"t{self.saved}", "name": f"Song {self.saved}", "artists": [{"id": artist, "name": artist}],
+                 "album": {"id": "a", "name": "Album", "images": []}, "popularity": 1}
+        self.items.insert(0, {"added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"), "track": track})
+        self.saved += 1
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        self.offsets.append(offset)
+        return {"items": self.items[offset:offset + limit], "total": len(self.items)}
+
+    def current_user_top_tracks(self, limit=20, time_range="medium_term"):
+        return {"items": [self.items[-1]["track"]]}
+
+@pytest.fixture
+def library():
+    return LibrarySync(mongomock.MongoClient().db)
+
+# Test that the first sync pulls every page of the library and library reads are then local
+def test_library_full_sync(library):
+    spotify = FakeLibrary(120)
+    assert library.sync("u", spotify) == {"saved_total": 120, "full": True}
+
+    state = library.state_of("u")
+    assert sorted(spotify.offsets) == [0, 50, 100]
+    assert state["saved_total"] == 120
+    assert state["latest_added_at"] == spotify.items[0]["added_at"]
+    assert state["top_artists"][0] == "fav"
+    assert state["top_tracks"][0]["id"] == "t0"
+    page = library.saved_page("u", 2, 1)
+    assert [track["id"] for track, _ in page] == ["t118", "t117"]
+    assert not library.is_stale(state)
+
+# Test that later syncs fetch only the tracks saved since, and removals trigger a full pass
+def test_library_delta_sync(library):
+    spotify = FakeLibrary(120)
+    library.sync("u", spotify)
+
+    for _ in range(3):
+        spotify.save()
+    spotify.offsets.clear()
+    assert library.sync("u", spotify) == {"saved_total": 123, "full": False}
+    assert spotify.offsets == [0]
+    assert library.saved_page("u", 1)[0][0]["id"] == "t122"
+
+    # 60 new tracks: the pages between the newest and the stored ones are fetched at once
+    for _ in range(60):
+        spotify.save()
+    spotify.offsets.clear()
+    assert library.sync("u", spotify) == {"saved_total": 183, "full": False}
+    assert sorted(spotify.offsets) == [0, 50]
+
+    removed = spotify.items.pop(10)["track"]["id"]
+    assert library.sync("u", spotify) == {"saved_total": 182, "full": True}
+    assert library.tracks.find_one({"track_id": removed}) is None
+
+# Test that a library is synced by one worker at a time
+def test_library_sync_lease(library):
+    other_worker = LibrarySync(library.tracks.database)
+    library._claim("u")
+    assert other_worker.sync("u", FakeLibrary(5)) is None
+    library.state.update_one({"_id": "u"}, {"$set": {"lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert other_worker.sync("u", FakeLibrary(5))["saved_total"] == 5
+
+# Test that the discover deck seeds from the most saved artists
+def test_discover_artist_ids():
+    state = {"top_artists": [f"artist{n}" for n in range(50)]}
+    picked = discover_artist_ids(state)
+    assert len(picked) == 10
+    assert set(picked) <= {f"artist{n}" for n in range(30)}
+    assert discover_artist_ids(None) == []
@@ -0,0 +1,398 @@
+# Request instrumentation, served in the Prometheus text format on /metrics.
+# Every request records its wall time and response size by route, and how many Spotify calls
+# and Mongo commands it made. Each Spotify call is timed by the spotipy method it stands for
+# (artist_top_tracks, search, track, ...), in the clients themselves, and each Mongo command
+# by a pymongo CommandListener. Cache, index and budget counters are read from the stats() of
+# their owners when /metrics is scraped, so they cost nothing per request.
+# Metrics live in the process that records them: every worker serves its own, scrape each.
+#
+# Debug logs are sampled per request (DEBUG_LOG_SAMPLE) and written with %-style arguments,
+# so while DEBUG is off they are neither formatted nor filtered.
+
+import os
+import time
+import bisect
+import random
+import logging
+import threading
+import contextvars
+from urllib.parse import urlsplit
+
+from pymongo import monitoring
+
+DEBUG_LOG_SAMPLE = float(os.getenv("DEBUG_LOG_SAMPLE", 0.01))  # share of requests whose debug logs are kept
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+CALL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Spotify endpoints by the spotipy method that calls them, with ids left out as {id}
+SPOTIFY_METHODS = {
+    ("GET", "artists/{id}/top-tracks"): "artist_top_tracks",
+    ("GET", "artists/{id}/related-artists"): "artist_related_artists",
+    ("GET", "artists/{id}/albums"): "artist_albums",
+    ("GET", "artists/{id}"): "artist",
+    ("GET", "artists"): "artists",
+    ("GET", "albums/{id}"): "album",
+    ("GET", "albums/{id}/tracks"): "album_tracks",
+    ("GET", "albums"): "albums",
+    ("GET", "tracks/{id}"): "track",
+    ("GET", "tracks"): "tracks",
+    ("GET", "search"): "search",
+    ("GET", "recommendations"): "recommendations",
+    ("GET", "browse/new-releases"): "new_releases",
+    ("GET", "browse/categories"): "categories",
+    ("GET", "me"): "current_user",
+    ("GET", "me/tracks"): "current_user_saved_tracks",
+    ("PUT", "me/tracks"): "current_user_saved_tracks_add",
+    ("DELETE", "me/tracks"): "current_user_saved_tracks_delete",
+    ("GET", "me/top/tracks"): "current_user_top_tracks",
+    ("GET", "me/top/artists"): "current_user_top_artists",
+    ("GET", "me/playlists"): "current_user_playlists",
+}
+# Path segments followed by an id
+ID_COLLECTIONS = {"artists", "albums", "tracks", "playlists", "users", "categories", "shows", "episodes"}
+
+logger = logging.getLogger(__name__)
+
+
+def label_string(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+def number(value) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"] + [
+            f"{self.name}{label_string(self.labelnames, labels)} {number(value)}" for labels, value in values
+        ]
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def snapshot(self, *labels) -> dict:
+        """count, sum and per-bucket counts of one series, for tests and benchmarks"""
+        with self._lock:
+            series = list(self._series.get(labels) or [0] * (len(self.buckets) + 1) + [0.0])
+        return {"count": sum(series[:-1]), "sum": series[-1], "buckets": dict(zip(self.buckets, series))}
+
+    def render(self) -> list:
+        with self._lock:
+            all_series = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        labelnames = self.labelnames + ("le",)
+        for labels, series in all_series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{label_string(labelnames, labels + (number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_count{label_string(self.labelnames, labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{label_string(self.labelnames, labels)} {number(series[-1])}")
+        return lines
+
+
+class Registry:
+    """The metrics of this process, and collectors that read counters kept elsewhere when scraped."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """collect() returns [(name, type, documentation, {label values tuple: value}, labelnames)]"""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                logger.error(f"METRICS: A collector failed: {str(e)}")
+                continue
+            for name, kind, documentation, values, labelnames in families:
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{label_string(labelnames, labels)} {number(value)}" for labels, value in values.items()]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "Wall time of requests", ("route", "method", "status"))
+response_size = registry.histogram(
+    "http_response_size_bytes", "Size of response bodies, streamed ones left out", ("route",), SIZE_BUCKETS)
+request_spotify_calls = registry.histogram(
+    "http_request_spotify_calls", "Spotify calls made by a request", ("route",), CALL_COUNT_BUCKETS)
+request_spotify_seconds = registry.histogram(
+    "http_request_spotify_seconds", "Time a request spent in Spotify calls", ("route",))
+request_mongo_commands = registry.histogram(
+    "http_request_mongo_commands", "Mongo commands run by a request", ("route",), CALL_COUNT_BUCKETS)
+request_mongo_seconds = registry.histogram(
+    "http_request_mongo_seconds", "Time a request spent in Mongo commands", ("route",))
+spotify_duration = registry.histogram(
+    "spotify_request_duration_seconds", "Spotify Web API calls, retries included, by spotipy method", ("method", "status"))
+mongo_duration = registry.histogram(
+    "mongo_command_duration_seconds", "Mongo commands by name", ("command", "status"))
+
+
+class RequestStats:
+    """What one request spent upstream, added to from its fan-out threads too"""
+    __slots__ = ("spotify_calls", "spotify_seconds", "mongo_commands", "mongo_seconds", "_lock")
+
+    def __init__(self):
+        self.spotify_calls = 0
+        self.spotify_seconds = 0.0
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_spotify(self, seconds: float):
+        with self._lock:
+            self.spotify_calls += 1
+            self.spotify_seconds += seconds
+
+    def add_mongo(self, seconds: float):
+        with self._lock:
+            self.mongo_commands += 1
+            self.mongo_seconds += seconds
+
+
+# The stats of the request being served, in its thread (Flask) or task (asyncio)
+current_request = contextvars.ContextVar("current_request", default=None)
+# Whether the request being served keeps its debug logs
+debug_sampled = contextvars.ContextVar("debug_sampled", default=False)
+
+
+def spotify_endpoint(http_method: str, url: str) -> tuple:
+    """(spotipy method, ids in the path) of a Spotify Web API call,
+    e.g. GET artists/0OdUWJ0sBjDrqHygGUXeCF is ("artist", ["0OdUWJ0sBjDrqHygGUXeCF"])"""
+    segments = [segment for segment in urlsplit(url).path.split("/") if segment]
+    if segments[:1] == ["v1"]:
+        segments = segments[1:]
+    template, ids = [], []
+    for i, segment in enumerate(segments):
+        if i and segments[i - 1] in ID_COLLECTIONS and segments[:1] != ["me"]:
+            template.append("{id}")
+            ids.append(segment)
+        else:
+            template.append(segment)
+    template = "/".join(template)
+    return SPOTIFY_METHODS.get((http_method, template), f"{http_method} {template}"), ids
+
+
+def spotify_method(http_method: str, url: str) -> str:
+    """The spotipy method behind a Spotify Web API call, e.g. GET artists/0OdUWJ0sBjDrqHygGUXeCF is artist"""
+    return spotify_endpoint(http_method, url)[0]
+
+
+def observe_spotify(http_method: str, url: str, status, seconds: float):
+    spotify_duration.observe(seconds, spotify_method(http_method, url), str(status))
+    stats = current_request.get()
+    if stats is not None:
+        stats.add_spotify(seconds)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command of the MongoClient it is given to (event_listeners=[...])"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+    @staticmethod
+    def _observe(event, status):
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, event.command_name, status)
+        # Commands Motor runs on its threads are not seen as part of a request
+        stats = current_request.get()
+        if stats is not None:
+            stats.add_mongo(seconds)
+
+
+mongo_listener = MongoCommandMetrics()
+
+
+def start_request(debug_logger: logging.Logger = None):
+    """Start counting the calls of the request served in this context. Returns the token
+    finish_request() needs."""
+    sampled = bool(debug_logger and debug_logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_LOG_SAMPLE)
+    return time.perf_counter(), current_request.set(RequestStats()), debug_sampled.set(sampled)
+
+
+def finish_request(token, route: str | None, method: str, status, size: int | None):
+    """Record the request started with token, under its route. Requests with no route
+    (recorded by another layer) are only closed."""
+    started, stats_token, sampled_token = token
+    seconds = time.perf_counter() - started
+    stats = current_request.get()
+    current_request.reset(stats_token)
+    debug_sampled.reset(sampled_token)
+    if route is None:
+        return
+
+    request_duration.observe(seconds, route, method, str(status))
+    if size is not None:
+        response_size.observe(size, route)
+    if stats is not None:
+        request_spotify_calls.observe(stats.spotify_calls, route)
+        request_spotify_seconds.observe(stats.spotify_seconds, route)
+        request_mongo_commands.observe(stats.mongo_commands, route)
+        request_mongo_seconds.observe(stats.mongo_seconds, route)
+
+
+class DebugSampler(logging.Filter):
+    """Keeps the debug records of sampled requests only, and a sample of those made outside requests"""
+
+    def __init__(self, sample: float = DEBUG_LOG_SAMPLE):
+        super().__init__()
+        self.sample = sample
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if current_request.get() is not None:
+            return debug_sampled.get()
+        return random.random() < self.sample
+
+
+def instrument_flask(app, route_prefix: str = ""):
+    """Record every request of a Flask app, and sample its debug logs."""
+    from flask import g, request
+
+    app.logger.addFilter(DebugSampler())
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_token = start_request(app.logger)
+
+    @app.teardown_request
+    def finish_metrics(error=None):
+        token = g.pop("metrics_token", None)
+        if token is None:
+            return
+        response = g.pop("metrics_response", None)
+        # Rule templates, not paths, so every artist id doesn't become a label
+        route = route_prefix + (request.url_rule.rule if request.url_rule else "unmatched")
+        status = response.status_code if response is not None else 500
+        size = response.content_length if response is not None and not response.is_streamed else None
+        finish_request(token, route, request.method, status, size)
+
+    @app.after_request
+    def keep_response(response):
+        g.metrics_response = response
+        return response
+
+    return app
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the requests of a Starlette app's own routes. Apps mounted
+    under it (the Flask app in asgi.py) record their requests themselves."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = start_request()
+        response = {"status": 500, "size": 0}
+
+        async def measured_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            # The router leaves the matched route in the scope, Mounts have routes of their own
+            route = scope.get("route")
+            path = None if route is None or hasattr(route, "routes") else route.path
+            finish_request(token, path, scope["method"], response["status"], response["size"])
+
+
+def cache_collector(caches: dict, budget=None, index=None):
+    """A collector for the hit and miss counters of caches ({name: object with stats()}),
+    the Spotify budget and the typeahead index"""
+    def collect():
+        families = []
+        stats = {name: cache.stats() for name, cache in caches.items()}
+        for key, kind, documentation in (
+            ("hits", "counter", "Cache lookups answered from this process"),
+            ("shared_hits", "counter", "Cache lookups answered from the shared Mongo tier"),
+            ("misses", "counter", "Cache lookups that went upstream"),
+            ("coalesced", "counter", "Cache lookups that waited on another caller's load"),
+            ("stale", "counter", "Stale cache entries served"),
+            ("size", "gauge", "Entries held in this process"),
+        ):
+            values = {(name,): cache_stats[key] for name, cache_stats in stats.items() if key in cache_stats}
+            metric = f"cache_{key}_total" if kind == "counter" else f"cache_{key}"
+            families.append((metric, kind, documentation, values, ("cache",)))
+        if budget is not None:
+            budget_stats = budget.stats()
+            families.append(("spotify_budget_events_total", "counter", "Spotify budget requests, throttles, retries and shed calls",
+                             {(name,): budget_stats[name] for name in ("requests", "throttled", "retried", "shed")}, ("event",)))
+        if index is not None:
+            index_stats = index.stats()
+            families.append(("typeahead_queries_total", "counter", "Typeahead queries, and those answered from the index",
+                             {("all",): index_stats["queries"], ("answered",): index_stats["answered"]}, ("result",)))
+            families.append(("typeahead_index_entries", "gauge", "Entries in the typeahead index", {(): index_stats["size"]}, ()))
+        return families
+    return collect
@@ -0,0 +1,56 @@
+import logging
+from metrics import (
+    Histogram, Registry, DebugSampler, spotify_method, observe_spotify, start_request, finish_request,
+    request_spotify_calls, debug_sampled
+)
+
+# Test that Spotify calls are named after the spotipy method behind them, whatever the ids
+def test_spotify_method():
+    assert spotify_method("GET", "artists/0OdUWJ0sBjDrqHygGUXeCF/top-tracks") == "artist_top_tracks"
+    assert spotify_method("GET", "https://api.spotify.com/v1/tracks/abc") == "track"
+    assert spotify_method("GET", "https://api.spotify.com/v1/albums?ids=a,b") == "albums"
+    assert spotify_method("PUT", "me/tracks") == "current_user_saved_tracks_add"
+    assert spotify_method("GET", "me/tracks/contains") == "GET me/tracks/contains"
+
+# Test that histograms render cumulative buckets, counts and sums in the Prometheus format
+def test_histogram_render():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, "/a")
+    registry.collector(lambda: [("cache_hits_total", "counter", "Hits", {("artist",): 3}, ("cache",))])
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+    assert 'latency_seconds_sum{route="/a"} 5.55' in lines
+    assert 'cache_hits_total{cache="artist"} 3' in lines
+    assert histogram.snapshot("/b")["count"] == 0
+
+# Test that calls are counted against the request in progress only
+def test_request_stats():
+    before = request_spotify_calls.snapshot("/test")["count"]
+    observe_spotify("GET", "search", 200, 0.01)
+    token = start_request()
+    observe_spotify("GET", "search", 200, 0.01)
+    observe_spotify("GET", "tracks/x", 429, 0.01)
+    finish_request(token, "/test", "GET", 200, 10)
+
+    snapshot = request_spotify_calls.snapshot("/test")
+    assert snapshot["count"] == before + 1
+    assert snapshot["buckets"][2] >= 1
+
+# Test that debug records are kept for sampled requests only
+def test_debug_sampler():
+    sampler = DebugSampler(sample=0)
+    record = lambda level: logging.LogRecord("app", level, __file__, 1, "msg %s", ("arg",), None)
+    assert sampler.filter(record(logging.INFO))
+    assert not sampler.filter(record(logging.DEBUG))
+
+    token = start_request()
+    assert not sampler.filter(record(logging.DEBUG))
+    debug_sampled.set(True)
+    assert sampler.filter(record(logging.DEBUG))
+    finish_request(token, None, "GET", 200, None)
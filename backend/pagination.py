@@ -0,0 +1,32 @@
+# Opaque cursors for the paginated deck endpoints.
+# A cursor is a signed, URL-safe blob holding whatever state the deck needs to produce
+# its next page (deck name, key, snapshot or queue generation, offset). Clients just
+# echo back the next_cursor they were given; tampered or foreign cursors are rejected.
+# A cursor whose snapshot expired, or whose queue was rebuilt since, gets the first page
+# of the deck as it is now, with "restarted": true in the response.
+
+from itsdangerous import URLSafeSerializer, BadSignature
+
+
+class InvalidCursor(ValueError):
+    """The cursor was not issued by us or does not belong to this deck."""
+
+
+class CursorCodec:
+    def __init__(self, secret_key: str):
+        self._serializer = URLSafeSerializer(secret_key, salt="deck-cursor")
+
+    def encode(self, state: dict) -> str:
+        return self._serializer.dumps(state)
+
+    def decode(self, cursor: str | None, deck: str, key=None) -> dict | None:
+        """Return the state in the cursor, or None when no cursor was given."""
+        if not cursor:
+            return None
+        try:
+            state = self._serializer.loads(cursor)
+        except BadSignature:
+            raise InvalidCursor("Malformed cursor")
+        if not isinstance(state, dict) or state.get("d") != deck or state.get("k") != key:
+            raise InvalidCursor("Cursor belongs to a different deck")
+        return state
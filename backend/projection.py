@@ -0,0 +1,88 @@
+# Compact projections of Spotify track and album objects for API responses.
+# Raw Spotify objects carry things the frontend never uses, above all the
+# available_markets lists (180+ country codes per track and again per album).
+# Routes send these compact shapes instead, optionally narrowed with ?fields=.
+
+TRACK_FIELDS = ("id", "name", "artists", "album", "duration_ms", "popularity", "explicit", "preview_url", "url")
+ALBUM_FIELDS = ("id", "name", "artists", "album_type", "release_date", "total_tracks", "url", "image", "images", "available_markets")
+# images and available_markets are only sent when asked for by name
+DEFAULT_ALBUM_FIELDS = ALBUM_FIELDS[:8]
+
+
+class InvalidFields(ValueError):
+    """?fields= named a field the projection doesn't have."""
+
+
+def first_image_url(images):
+    """URL of the first (largest) image, if any"""
+    return images[0].get('url') if images else None
+
+
+def spotify_url(item: dict):
+    # Already projected objects keep the URL under "url"
+    return item.get('url') or (item.get('external_urls') or {}).get('spotify')
+
+
+def artist_refs(artists) -> list:
+    return [{"id": artist.get('id'), "name": artist.get('name')} for artist in artists or []]
+
+
+def compact_track(track: dict) -> dict:
+    """The fields of a track object the frontend needs, safe to apply twice"""
+    album = track.get('album') or {}
+    return {
+        "id": track.get('id'),
+        "name": track.get('name'),
+        "artists": artist_refs(track.get('artists')),
+        "album": {
+            "id": album.get('id'),
+            "name": album.get('name'),
+            "image": album.get('image') or first_image_url(album.get('images')),
+        } if album else None,
+        "duration_ms": track.get('duration_ms'),
+        "popularity": track.get('popularity'),
+        "explicit": track.get('explicit'),
+        "preview_url": track.get('preview_url'),
+        "url": spotify_url(track),
+    }
+
+
+def compact_album(album: dict) -> dict:
+    images = album.get('images', [])
+    return {
+        "id": album.get('id'),
+        "name": album.get('name'),
+        "artists": ", ".join(artist.get('name', '') for artist in album.get('artists', [])),
+        "album_type": album.get('album_type'),
+        "release_date": album.get('release_date'),
+        "total_tracks": album.get('total_tracks'),
+        "images": images,
+        "image": first_image_url(images),
+        "url": spotify_url(album),
+        "available_markets": album.get('available_markets', []),
+    }
+
+
+def parse_fields(value: str | None, allowed, default=None):
+    """Turn ?fields=a,b into a tuple of field names, or the default when not given."""
+    if not value:
+        return default
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(allowed)}")
+    return fields
+
+
+def select_fields(item: dict, fields) -> dict:
+    if fields is None:
+        return item
+    return {field: item.get(field) for field in fields}
+
+
+def project_tracks(tracks, fields=None) -> list:
+    return [select_fields(compact_track(track), fields) for track in tracks]
+
+
+def project_albums(albums, fields=DEFAULT_ALBUM_FIELDS) -> list:
+    return [select_fields(compact_album(album), fields) for album in albums]
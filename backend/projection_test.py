@@ -0,0 +1,44 @@
+import pytest
+from projection import (
+    TRACK_FIELDS, ALBUM_FIELDS, DEFAULT_ALBUM_FIELDS, InvalidFields,
+    compact_track, parse_fields, project_tracks, project_albums
+)
+
+MARKETS = ["US", "GB", "DE", "FR", "SE"] * 40
+
+def raw_track(track_id):
+    return {
+        "id": track_id,
+        "name": "Song",
+        "artists": [{"id": "artist1", "name": "Artist", "href": "https://api.spotify.com/v1/artists/artist1", "type": "artist"}],
+        "album": {"id": "album1", "name": "Album", "images": [{"url": "https://i.scdn.co/image/1"}], "available_markets": MARKETS},
+        "available_markets": MARKETS,
+        "duration_ms": 200000,
+        "popularity": 50,
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+# Test that the compact track drops market lists and keeps what the frontend reads
+def test_compact_track():
+    track = compact_track(raw_track("track1"))
+    assert tuple(track) == TRACK_FIELDS
+    assert track["artists"] == [{"id": "artist1", "name": "Artist"}]
+    assert track["album"] == {"id": "album1", "name": "Album", "image": "https://i.scdn.co/image/1"}
+    assert track["url"] == "https://open.spotify.com/track/track1"
+    assert "available_markets" not in str(track)
+    # Projecting an already compact track changes nothing
+    assert compact_track(track) == track
+
+# Test that ?fields= narrows tracks and only opts albums into available_markets when asked
+def test_fields_selector():
+    fields = parse_fields("id, name,id", TRACK_FIELDS)
+    assert fields == ("id", "name")
+    assert project_tracks([raw_track("track1")], fields) == [{"id": "track1", "name": "Song"}]
+    assert parse_fields(None, TRACK_FIELDS) is None
+    with pytest.raises(InvalidFields):
+        parse_fields("id,available_markets", TRACK_FIELDS)
+
+    album = raw_track("album1")["album"]
+    assert "available_markets" not in project_albums([album])[0]
+    with_markets = project_albums([album], parse_fields("id,available_markets", ALBUM_FIELDS, DEFAULT_ALBUM_FIELDS))
+    assert with_markets == [{"id": "album1", "available_markets": MARKETS}]
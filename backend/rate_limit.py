@@ -0,0 +1,232 @@
+# Client-side budget for Spotify Web API calls.
+# Every call takes a token from the app bucket and from the bucket of the user's
+# access token, waiting briefly if they are empty and being shed (SpotifyThrottled)
+# if they stay empty. A 429 from Spotify blocks the process until its Retry-After
+# has passed. Idempotent GETs are retried with jittered backoff; other calls are not.
+#
+# The buckets live in each worker process. SPOTIFY_APP_RATE is for the whole deployment and
+# every gunicorn worker gets an equal share of it (gunicorn.conf.py exports GUNICORN_WORKERS);
+# SPOTIFY_APP_BURST and the per-user buckets are per worker.
+
+import os
+import math
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+from spotipy import Spotify
+from spotipy.exceptions import SpotifyException
+
+from http_pool import spotify_session, SPOTIFY_TIMEOUT, SPOTIFY_API_URL
+from metrics import observe_spotify
+
+SPOTIFY_WORKERS = max(1, int(os.getenv("GUNICORN_WORKERS", 1)))  # processes sharing the app budget
+SPOTIFY_TOTAL_RATE = float(os.getenv("SPOTIFY_APP_RATE", 10))  # requests per second for the whole deployment
+SPOTIFY_TOTAL_BURST = int(os.getenv("SPOTIFY_APP_BURST", 30))
+SPOTIFY_USER_RATE = float(os.getenv("SPOTIFY_USER_RATE", 4))  # requests per second per user token
+SPOTIFY_USER_BURST = int(os.getenv("SPOTIFY_USER_BURST", 15))
+SPOTIFY_BUDGET_WAIT = float(os.getenv("SPOTIFY_BUDGET_WAIT", 2.0))  # longest a call waits for budget before it is shed
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", 2))
+SPOTIFY_RETRY_BACKOFF = float(os.getenv("SPOTIFY_RETRY_BACKOFF", 0.25))
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_RETRY_AFTER = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def worker_share(workers: int, total_rate: float = SPOTIFY_TOTAL_RATE, total_burst: int = SPOTIFY_TOTAL_BURST) -> tuple:
+    """(rate, burst) of the app bucket of one of `workers` processes. The sustained rate is
+    split between them; the burst is not, so any one worker can still make a whole deck's
+    fan-out (a related-artists call and ten top-tracks calls) at once."""
+    return total_rate / workers, total_burst
+
+
+SPOTIFY_APP_RATE, SPOTIFY_APP_BURST = worker_share(SPOTIFY_WORKERS)
+
+
+class SpotifyThrottled(SpotifyException):
+    """A call was shed because our Spotify budget is used up, or Spotify told us to back off."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            429, -1, "Spotify request budget exhausted",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers) -> float:
+    """Seconds from a Retry-After header, DEFAULT_RETRY_AFTER if it is missing or not a number."""
+    try:
+        return max(0.0, float((headers or {}).get("Retry-After")))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def token_key(access_token: str | None) -> str | None:
+    # Buckets are keyed by a digest so access tokens aren't kept around in memory
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16] if access_token else None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float | None:
+        """Take a token, returning how long to wait before using it, or None if that is over max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            # Tokens may go negative: later callers queue up behind this one
+            self._tokens -= 1
+            return wait
+
+    def refund(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class RateBudget:
+    """The request budget shared by every Spotify client in this process (one worker's share of the app's)."""
+
+    def __init__(self, app_rate: float = SPOTIFY_APP_RATE, app_burst: int = SPOTIFY_APP_BURST,
+                 user_rate: float = SPOTIFY_USER_RATE, user_burst: int = SPOTIFY_USER_BURST,
+                 max_users: int = 10000, sleep=time.sleep):
+        self.app_bucket = TokenBucket(app_rate, app_burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self.sleep = sleep
+        self._user_buckets = OrderedDict()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "throttled": 0, "retried": 0, "shed": 0}
+
+    def _user_bucket(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            bucket = self._user_buckets.get(key)
+            if bucket is None:
+                bucket = self._user_buckets[key] = TokenBucket(self.user_rate, self.user_burst)
+                while len(self._user_buckets) > self.max_users:
+                    self._user_buckets.popitem(last=False)
+            self._user_buckets.move_to_end(key)
+            return bucket
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def acquire(self, key=None, max_wait: float = SPOTIFY_BUDGET_WAIT):
+        """Wait until a call for this user token may be made, or raise SpotifyThrottled."""
+        delay = self.reserve(key, max_wait)
+        if delay > 0:
+            self.sleep(delay)
+
+    def reserve(self, key=None, max_wait: float = SPOTIFY_BUDGET_WAIT) -> float:
+        """Book a call for this user token and return how long to wait before making it,
+        or raise SpotifyThrottled. For callers that can't block, e.g. in an event loop."""
+        blocked = self._blocked_until - time.monotonic()
+        if blocked > max_wait:
+            self.count("shed")
+            raise SpotifyThrottled(blocked)
+
+        waits = [max(0.0, blocked)]
+        reserved = []
+        for bucket in (self._user_bucket(key), self.app_bucket):
+            if bucket is None:
+                continue
+            wait = bucket.reserve(max_wait)
+            if wait is None:
+                for taken in reserved:
+                    taken.refund()
+                self.count("shed")
+                raise SpotifyThrottled(1 / bucket.rate)
+            reserved.append(bucket)
+            waits.append(wait)
+
+        self.count("requests")
+        return max(waits)
+
+    def throttled(self, retry_after: float):
+        """Spotify answered 429: hold every call back until Retry-After has passed."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self.counters["throttled"] += 1
+        logger.warning(f"SPOTIPY: Throttled by Spotify, backing off for {retry_after:.1f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                self.counters,
+                users=len(self._user_buckets),
+                blocked_for=max(0.0, self._blocked_until - time.monotonic()),
+            )
+
+
+# Shared by every Spotify client in this process
+spotify_budget = RateBudget()
+
+
+class RateLimitedSpotify(Spotify):
+    """Spotify client whose calls go through a RateBudget, with our own retries."""
+
+    def __init__(self, *args, budget: RateBudget = None, max_wait: float = SPOTIFY_BUDGET_WAIT,
+                 max_retries: int = SPOTIFY_MAX_RETRIES, backoff: float = SPOTIFY_RETRY_BACKOFF, **kwargs):
+        # The shared pooled session has no urllib3 retries, so 429s and their Retry-After
+        # reach us instead of being slept through inside the request
+        kwargs.setdefault("requests_session", spotify_session())
+        kwargs.setdefault("requests_timeout", SPOTIFY_TIMEOUT)
+        super().__init__(*args, **kwargs)
+        self.prefix = SPOTIFY_API_URL
+        self.budget = budget or spotify_budget
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._budget_key = token_key(self._auth)
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Full jitter, so clients that failed together don't retry together
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def _internal_call(self, method, url, payload, params):
+        attempt = 0
+        while True:
+            self.budget.acquire(self._budget_key, self.max_wait)
+            retryable = method == "GET" and attempt < self.max_retries
+            started = time.perf_counter()
+            try:
+                result = super()._internal_call(method, url, payload, dict(params))
+            except SpotifyException as e:
+                observe_spotify(method, url, e.http_status, time.perf_counter() - started)
+                if e.http_status == 429:
+                    # The next acquire() waits out Retry-After, or sheds the call if it is too long
+                    self.budget.throttled(retry_after_seconds(e.headers))
+                if not retryable or e.http_status not in RETRYABLE_STATUSES:
+                    raise
+                if e.http_status != 429:
+                    self.budget.sleep(self._retry_delay(attempt))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                observe_spotify(method, url, "error", time.perf_counter() - started)
+                if not retryable:
+                    raise
+                self.budget.sleep(self._retry_delay(attempt))
+            else:
+                observe_spotify(method, url, 200, time.perf_counter() - started)
+                return result
+            attempt += 1
+            self.budget.count("retried")
@@ -0,0 +1,117 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from spotipy.exceptions import SpotifyException
+from rate_limit import RateBudget, RateLimitedSpotify, SpotifyThrottled, TokenBucket, worker_share
+
+
+class FakeSpotify(BaseHTTPRequestHandler):
+    """Answers each path with the next scripted (status, headers) and then 200s."""
+    scripts = {}
+    hits = []
+
+    def _respond(self):
+        self.hits.append((self.command, self.path))
+        script = self.scripts.get(self.path.split("?")[0], [])
+        status, headers = script.pop(0) if script else (200, {})
+        body = json.dumps({"tracks": [{"id": "t1"}]} if status == 200 else {"error": {"status": status, "message": "fake"}}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_spotify():
+    FakeSpotify.scripts = {}
+    FakeSpotify.hits = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSpotify)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield FakeSpotify, f"http://127.0.0.1:{server.server_port}/v1/"
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(prefix, budget, **kwargs):
+    client = RateLimitedSpotify(auth="token", budget=budget, backoff=0.01, **kwargs)
+    client.prefix = prefix
+    return client
+
+
+# Test that a 429 is waited out according to Retry-After and the GET retried
+def test_retry_after_429(fake_spotify):
+    server, prefix = fake_spotify
+    server.scripts["/v1/artists/a1/top-tracks"] = [(429, {"Retry-After": "0"})]
+    budget = RateBudget()
+    result = make_client(prefix, budget).artist_top_tracks("a1")
+    assert result["tracks"] == [{"id": "t1"}]
+    assert len(server.hits) == 2
+    assert budget.stats()["throttled"] == 1
+    assert budget.stats()["retried"] == 1
+
+# Test that a long Retry-After sheds calls locally instead of hammering Spotify
+def test_long_retry_after_sheds_calls(fake_spotify):
+    server, prefix = fake_spotify
+    server.scripts["/v1/artists/a1/top-tracks"] = [(429, {"Retry-After": "30"})]
+    budget = RateBudget()
+    client = make_client(prefix, budget, max_wait=0.5)
+    with pytest.raises(SpotifyThrottled):
+        client.artist_top_tracks("a1")
+    with pytest.raises(SpotifyThrottled) as shed:
+        client.artist_related_artists("a2")
+    assert len(server.hits) == 1
+    assert shed.value.http_status == 429
+    assert budget.stats()["shed"] == 2
+
+# Test that server errors are retried for GETs but never for writes
+def test_retries_only_idempotent_calls(fake_spotify):
+    server, prefix = fake_spotify
+    server.scripts["/v1/artists/a1/top-tracks"] = [(503, {}), (502, {})]
+    server.scripts["/v1/me/tracks/"] = [(503, {})]
+    budget = RateBudget()
+    client = make_client(prefix, budget)
+    assert client.artist_top_tracks("a1")["tracks"] == [{"id": "t1"}]
+    with pytest.raises(SpotifyException) as error:
+        client.current_user_saved_tracks_add(["t1"])
+    assert error.value.http_status == 503
+    assert [method for method, _ in server.hits] == ["GET", "GET", "GET", "PUT"]
+    assert budget.stats()["retried"] == 2
+
+# Test that a user's bucket runs dry without touching the app-wide budget of other users
+def test_per_user_budget():
+    budget = RateBudget(app_rate=100, app_burst=100, user_rate=0.1, user_burst=2)
+    budget.acquire("user1", max_wait=0)
+    budget.acquire("user1", max_wait=0)
+    with pytest.raises(SpotifyThrottled):
+        budget.acquire("user1", max_wait=0)
+    budget.acquire("user2", max_wait=0)
+    assert budget.stats()["shed"] == 1
+    assert budget.stats()["requests"] == 3
+
+# Test that with the default budget split across gunicorn's default worker count on an 8 core
+# host, one worker can still build a cold deck: a related-artists call and ten top-tracks calls
+def test_worker_share_fits_a_cold_deck():
+    rate, burst = worker_share(17)
+    budget = RateBudget(app_rate=rate, app_burst=burst, sleep=lambda seconds: None)
+    for _ in range(11):
+        budget.acquire("user1")
+    assert budget.stats()["shed"] == 0
+    assert rate == 10 / 17
+
+# Test that an empty bucket makes callers wait for the next token instead of failing
+def test_token_bucket_wait():
+    bucket = TokenBucket(rate=10, capacity=1)
+    assert bucket.reserve(max_wait=0) == 0
+    assert bucket.reserve(max_wait=0) is None
+    assert 0 < bucket.reserve(max_wait=1) <= 0.1
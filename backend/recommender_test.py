@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from recommender import ArtistAffinity
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+def feedback(track_id, rating, artist_ids, days_ago=0):
+    return {
+        "track_id": track_id,
+        "rating": rating,
+        "timestamp": (NOW - timedelta(days=days_ago)).replace(tzinfo=None),  # pymongo returns naive UTC
+        "artists": [{"id": artist_id, "name": artist_id} for artist_id in artist_ids],
+    }
+
+def track(track_id, artist_id, popularity=50):
+    return {"id": track_id, "popularity": popularity, "artists": [{"id": artist_id}]}
+
+# Test that likes count positive, dislikes negative, and older ratings count less
+def test_affinity_weights():
+    affinity = ArtistAffinity.from_feedback([
+        feedback("t1", "like", ["fresh"]),
+        feedback("t2", "like", ["old"], days_ago=90),
+        feedback("t3", "dislike", ["hated"]),
+    ], now=NOW, half_life_days=30)
+    weights = dict(zip(affinity.artist_ids, affinity.weights))
+    assert weights["fresh"] > weights["old"] > 0 > weights["hated"]
+    assert abs(weights["old"] - 0.125) < 1e-9
+    assert affinity.top_artists(10) == ["fresh", "old"]
+
+# Test that ranking orders by affinity, drops rated and duplicate tracks, and drops disliked artists
+def test_rank_candidates():
+    affinity = ArtistAffinity.from_feedback([
+        feedback("rated", "like", ["loved"]),
+        feedback("t2", "like", ["liked"], days_ago=60),
+        feedback("t3", "dislike", ["hated"]),
+    ], now=NOW)
+    ranked = affinity.rank([
+        track("a", "liked"),
+        track("b", "unknown", popularity=90),
+        track("c", "loved"),
+        track("rated", "loved"),
+        track("c", "loved"),
+        track("d", "hated", popularity=100),
+    ])
+    assert [t["id"] for t in ranked] == ["c", "a", "b"]
+
+# Test that a user without ratings gets no seeds
+def test_empty_feedback():
+    affinity = ArtistAffinity.from_feedback([])
+    assert affinity.top_artists(10) == []
+    assert [t["id"] for t in affinity.rank([track("a", "x")])] == ["a"]
@@ -0,0 +1,197 @@
+# Two-tier cache for Spotify responses that are the same for every user in a market
+# (new releases, browse categories).
+# L1 is a small in-process LRU in front of L2, the `response_cache` Mongo collection that
+# every worker reads and fills, so a worker that just started is served what the others
+# already fetched. Entries are fresh for a TTL, then served stale for a grace period while
+# a single background refresh per key reloads them: only a miss in both tiers (or an
+# entry past its grace period) makes a request wait on Spotify, and concurrent misses
+# for the same key share one upstream call.
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pymongo import timeout as mongo_timeout
+from pymongo.errors import PyMongoError
+
+BROWSE_CACHE_SIZE = int(os.getenv("BROWSE_CACHE_SIZE", 256))
+BROWSE_CACHE_TTL = int(os.getenv("BROWSE_CACHE_TTL", 15 * 60))  # seconds an entry is fresh
+BROWSE_CACHE_STALE = int(os.getenv("BROWSE_CACHE_STALE", 24 * 3600))  # seconds it is served stale after that
+# Longest a request waits on the shared tier before treating it as a miss
+BROWSE_CACHE_L2_TIMEOUT = float(os.getenv("BROWSE_CACHE_L2_TIMEOUT", 0.5))
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    """A cached upstream response and when it was fetched."""
+
+    def __init__(self, value, fetched_at: float, ttl: int, stale_ttl: int):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.fresh_until = fetched_at + ttl
+        self.stale_until = self.fresh_until + stale_ttl
+
+    def is_fresh(self, now: float) -> bool:
+        return now < self.fresh_until
+
+    def max_age(self, now: float) -> int:
+        """Seconds a client may keep using it without asking again."""
+        return max(0, int(self.fresh_until - now))
+
+    def age(self, now: float) -> int:
+        return max(0, int(now - self.fetched_at))
+
+
+def cache_id(kind: str, key: tuple) -> str:
+    return ":".join([kind] + ["" if part is None else str(part) for part in key])
+
+
+class ResponseCache:
+    """Thread-safe L1/L2 response cache with stale-while-revalidate refreshes."""
+
+    def __init__(self, collection, maxsize: int = BROWSE_CACHE_SIZE, ttl: int = BROWSE_CACHE_TTL,
+                 stale_ttl: int = BROWSE_CACHE_STALE, l2_timeout: float = BROWSE_CACHE_L2_TIMEOUT, executor=None):
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.l2_timeout = l2_timeout
+        self._entries = OrderedDict()  # cache id -> CachedResponse
+        self._inflight = {}  # cache id -> Future of the load in progress
+        self._lock = threading.Lock()
+        # Refreshes run here, so the request that found a stale entry doesn't wait for them
+        self._executor = executor or ThreadPoolExecutor(max_workers=2, thread_name_prefix="response-cache")
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get_or_load(self, kind: str, key: tuple, loader) -> CachedResponse:
+        """The cached response for (kind, key), calling loader() only if there is none
+        worth serving. A stale response is returned as is and refreshed in the background."""
+        entry_id = cache_id(kind, key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry and entry.is_fresh(now):
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                return entry
+
+        # Another worker may have fetched or refreshed it already
+        shared = self._read_shared(entry_id)
+        if shared and (not entry or shared.fetched_at > entry.fetched_at):
+            entry = shared
+            self._store_local(entry_id, entry)
+            if entry.is_fresh(now):
+                with self._lock:
+                    self.shared_hits += 1
+                return entry
+
+        if entry and now < entry.stale_until:
+            with self._lock:
+                self.stale += 1
+            self._refresh(entry_id, loader)
+            return entry
+
+        with self._lock:
+            self.misses += 1
+        future = self._start_load(entry_id, loader, background=False)
+        try:
+            return future.result()
+        except Exception:
+            if not entry:
+                raise
+            # Better a response past its grace period than none while Spotify is failing
+            return entry
+
+    def _refresh(self, entry_id, loader):
+        def log_failure(future):
+            if future.exception():
+                logger.warning(f"RESPONSE CACHE: Refreshing {entry_id} failed, still serving the stale response: {future.exception()}")
+
+        self._start_load(entry_id, loader, background=True).add_done_callback(log_failure)
+
+    def _start_load(self, entry_id, loader, background: bool) -> Future:
+        with self._lock:
+            future = self._inflight.get(entry_id)
+            if future:
+                return future
+            future = self._inflight[entry_id] = Future()
+            if background:
+                self.refreshes += 1
+        if background:
+            self._executor.submit(self._load, entry_id, loader, future)
+        else:
+            self._load(entry_id, loader, future)
+        return future
+
+    def _load(self, entry_id, loader, future: Future):
+        try:
+            entry = CachedResponse(loader(), time.time(), self.ttl, self.stale_ttl)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            future.set_exception(e)
+        else:
+            self._store_local(entry_id, entry)
+            self._write_shared(entry_id, entry)
+            future.set_result(entry)
+        finally:
+            with self._lock:
+                self._inflight.pop(entry_id, None)
+
+    def _store_local(self, entry_id, entry: CachedResponse):
+        with self._lock:
+            self._entries[entry_id] = entry
+            self._entries.move_to_end(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _read_shared(self, entry_id) -> CachedResponse | None:
+        try:
+            with mongo_timeout(self.l2_timeout):
+                doc = self.collection.find_one({"_id": entry_id})
+        except PyMongoError as e:
+            logger.warning(f"RESPONSE CACHE: Reading {entry_id} from Mongo failed: {str(e)}")
+            return None
+        if not doc:
+            return None
+        entry = CachedResponse(doc["value"], doc["fetched_at"], self.ttl, self.stale_ttl)
+        return entry if time.time() < entry.stale_until else None
+
+    def _write_shared(self, entry_id, entry: CachedResponse):
+        try:
+            with mongo_timeout(self.l2_timeout):
+                self.collection.replace_one({"_id": entry_id}, {
+                    "value": entry.value,
+                    "fetched_at": entry.fetched_at,
+                    # Mongo drops the entry once it is too old to be served, see the schema's TTL index
+                    "expires_at": datetime.fromtimestamp(entry.stale_until, timezone.utc),
+                }, upsert=True)
+        except PyMongoError as e:
+            logger.warning(f"RESPONSE CACHE: Writing {entry_id} to Mongo failed: {str(e)}")
+
+    def clear(self):
+        """Forget the local tier, the shared one expires on its own."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+            }
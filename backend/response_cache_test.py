@@ -0,0 +1,93 @@
+import pytest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+from response_cache import ResponseCache
+
+mongomock = pytest.importorskip("mongomock")
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.response_cache
+
+def age_entries(cache, collection, seconds):
+    # Pretend every entry was fetched `seconds` earlier, in both tiers
+    for entry in cache._entries.values():
+        entry.fetched_at -= seconds
+        entry.fresh_until -= seconds
+        entry.stale_until -= seconds
+    for doc in collection.find():
+        collection.update_one({"_id": doc["_id"]}, {"$set": {"fetched_at": doc["fetched_at"] - seconds}})
+
+# Test that a fresh entry is served from this process, and that another worker is served it from Mongo
+def test_response_cache_tiers(collection):
+    loader = MagicMock(return_value={"albums": {"items": []}})
+    cache = ResponseCache(collection, ttl=60)
+    first = cache.get_or_load("new_releases", (20, 0, None), loader)
+    again = cache.get_or_load("new_releases", (20, 0, None), loader)
+
+    other_worker = ResponseCache(collection, ttl=60)
+    shared = other_worker.get_or_load("new_releases", (20, 0, None), loader)
+
+    assert loader.call_count == 1
+    assert again is first
+    assert shared.value == first.value
+    assert cache.stats()["hits"] == 1
+    assert other_worker.stats()["shared_hits"] == 1
+    assert collection.find_one({"_id": "new_releases:20:0:"})["expires_at"]
+
+# Test that an expired entry is served at once while a single background refresh replaces it
+def test_response_cache_stale_while_revalidate(collection):
+    cache = ResponseCache(collection, ttl=60, stale_ttl=600)
+    cache.get_or_load("categories", (20, 0), lambda: "old")
+    age_entries(cache, collection, 61)
+
+    release = threading.Event()
+    def slow_reload():
+        release.wait(5)
+        return "new"
+    loader = MagicMock(side_effect=slow_reload)
+
+    served = [cache.get_or_load("categories", (20, 0), loader).value for _ in range(3)]
+    release.set()
+    cache._executor.shutdown(wait=True)
+
+    assert served == ["old", "old", "old"]
+    assert loader.call_count == 1
+    assert cache.stats()["stale"] == 3
+    assert cache.get_or_load("categories", (20, 0), loader).value == "new"
+    assert collection.find_one({"_id": "categories:20:0"})["value"] == "new"
+
+# Test that a failed refresh keeps serving the stale entry and an entry past its grace period is reloaded
+def test_response_cache_refresh_failure_and_expiry(collection):
+    cache = ResponseCache(collection, ttl=60, stale_ttl=600, executor=ThreadPoolExecutor(1))
+    cache.get_or_load("categories", (20, 0), lambda: "old")
+    age_entries(cache, collection, 61)
+
+    failing = MagicMock(side_effect=RuntimeError("429"))
+    assert cache.get_or_load("categories", (20, 0), failing).value == "old"
+    cache._executor.shutdown(wait=True)
+    assert cache.stats()["errors"] == 1
+
+    age_entries(cache, collection, 600)
+    assert cache.get_or_load("categories", (20, 0), lambda: "reloaded").value == "reloaded"
+    assert cache.stats()["misses"] == 2
+
+# Test that concurrent misses for the same key share one upstream call
+def test_response_cache_single_flight(collection):
+    cache = ResponseCache(collection)
+    def slow_load():
+        time.sleep(0.1)
+        return "value"
+    loader = MagicMock(side_effect=slow_load)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", (1,), loader).value)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["value"] * 8
+    assert loader.call_count == 1
@@ -0,0 +1,120 @@
+# How API responses go on the wire: the JSON encoder behind jsonify, and compression.
+# With orjson installed, Flask's JSON provider encodes with it, several times faster than
+# the json module on deck-sized payloads, with the same output rules (sorted keys, compact,
+# dates as HTTP dates). JSON and text bodies over API_COMPRESS_MIN_SIZE are then compressed
+# with brotli or gzip, whichever the client prefers and we have. Streamed bodies and files
+# (static_files.py serves precompressed ones) are left alone.
+# Compare the options with: python -m benchmarks.api_encoding
+
+import os
+import gzip
+import logging
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional, the json module is used without it
+    orjson = None
+try:
+    import brotli
+except ImportError:  # Optional, responses are only gzipped without it
+    brotli = None
+
+API_JSON_ENCODER = os.getenv("API_JSON_ENCODER", "orjson")  # "json" keeps Flask's own provider
+API_COMPRESS_MIN_SIZE = int(os.getenv("API_COMPRESS_MIN_SIZE", 1024))  # bytes, smaller bodies gain too little
+API_GZIP_LEVEL = int(os.getenv("API_GZIP_LEVEL", 6))
+API_BROTLI_QUALITY = int(os.getenv("API_BROTLI_QUALITY", 5))  # 11 is for build-time compression, far too slow per request
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/plain", "text/html"}
+
+logger = logging.getLogger(__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask's default JSON provider, encoding with orjson"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Anything but compact output (indent, other separators, cls) is the json module's job
+        if kwargs and kwargs != {"separators": (",", ":")}:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode()
+
+    def _dumps_bytes(self, obj) -> bytes:
+        # Dates and everything orjson doesn't know go through Flask's default(), so the
+        # output matches the json module's (datetimes as HTTP dates, not ISO 8601)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or self.compact is None and self._app.debug:
+            return super().response(*args, **kwargs)
+        # Straight to bytes, no str in between
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+
+def use_fast_json(app, encoder: str = API_JSON_ENCODER):
+    """Make app.json (and jsonify) encode with orjson, if it is installed and wanted."""
+    if encoder != "orjson":
+        return app
+    if orjson is None:
+        logger.warning("JSON: orjson is not installed, API responses are encoded with the json module")
+        return app
+    provider = OrjsonProvider(app)
+    # orjson always writes UTF-8, have the json module fallback do the same
+    provider.ensure_ascii = False
+    app.json = provider
+    return app
+
+
+def negotiate_encoding(accept_encodings) -> str | None:
+    """br or gzip, the one the client rates higher (br on a tie), None if it takes neither"""
+    offered = [encoding for encoding in ("br", "gzip") if encoding != "br" or brotli]
+    quality = {encoding: accept_encodings[encoding] for encoding in offered}
+    best = max(offered, key=lambda encoding: quality[encoding], default=None)
+    return best if best and quality[best] > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=API_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=API_GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encodings, min_size: int = API_COMPRESS_MIN_SIZE):
+    """Compress a buffered JSON or text response in place, if it is worth it and the client accepts it"""
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    # Whether or not this one is compressed, the next response for the URL may be
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # Same content, other bytes: a strong ETag would now be wrong. If-None-Match is compared
+    # weakly, so revalidating still gets a 304 from make_conditional()
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compress_responses(app, min_size: int = API_COMPRESS_MIN_SIZE):
+    """Compress every eligible response of a Flask app. Register after instrument_flask(),
+    so /metrics sees the bytes that were sent."""
+    from flask import request
+
+    @app.after_request
+    def compress_api_response(response):
+        return compress_response(response, request.accept_encodings, min_size)
+
+    return app
@@ -0,0 +1,59 @@
+import gzip
+import pytest
+from datetime import datetime, timezone
+from flask import Flask, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+import response_encoding
+from response_encoding import use_fast_json, compress_responses, negotiate_encoding
+from werkzeug.http import parse_accept_header
+
+pytest.importorskip("orjson")
+
+def make_app():
+    app = Flask(__name__)
+    use_fast_json(app)
+    compress_responses(app, min_size=100)
+
+    @app.route("/tracks")
+    def tracks():
+        response = jsonify({"tracks": [{"id": f"t{n}", "name": "Song ✓"} for n in range(50)]})
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @app.route("/small")
+    def small():
+        return jsonify({"ok": True})
+    return app
+
+# Test that orjson output decodes to what the json module writes, dates included
+def test_fast_json_matches_default_provider():
+    app = make_app()
+    body = {"b": 1, "a": [1.5, None, "Beyoncé"], "when": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}
+    with app.app_context():
+        fast = app.json.dumps(body)
+        assert fast == DefaultJSONProvider(app).dumps(body, ensure_ascii=False, separators=(",", ":"))
+        assert '"when":"Tue, 02 Jan 2024 03:04:05 GMT"' in fast
+
+# Test that large bodies are compressed with the client's preferred encoding, small ones never
+def test_compressed_responses_revalidate():
+    client = make_app().test_client()
+    plain = client.get("/tracks")
+    zipped = client.get("/tracks", headers={"Accept-Encoding": "gzip"})
+    revalidated = client.get("/tracks", headers={"Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]})
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.headers["ETag"].startswith("W/")
+    assert "Accept-Encoding" in zipped.headers["Vary"]
+    assert revalidated.status_code == 304
+    assert "Content-Encoding" not in small.headers
+
+# Test that the encoding is the client's preference among those we can produce
+def test_negotiate_encoding():
+    assert negotiate_encoding(parse_accept_header("gzip, deflate")) == "gzip"
+    assert negotiate_encoding(parse_accept_header("identity")) is None
+    assert negotiate_encoding(parse_accept_header("gzip;q=0")) is None
+    assert negotiate_encoding(parse_accept_header("gzip, br")) == ("br" if response_encoding.brotli else "gzip")
+    assert negotiate_encoding(parse_accept_header("gzip, br;q=0.5")) == "gzip"
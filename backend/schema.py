@@ -0,0 +1,135 @@
+# Versioned schema migrations and index bootstrap for the app's MongoDB collections.
+# migrate() is idempotent: applied versions are recorded in `schema_migrations`, so it
+# can safely run on every startup and from every worker at once.
+# Run it by hand with `flask --app app migrate`.
+
+import logging
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# The user_feedback queries the routes issue, used to check that they are served by an index
+FEEDBACK_QUERIES = {
+    # A user's latest likes (or dislikes)
+    "recent_likes": ({"user_id": "", "rating": "like"}, [("timestamp", DESCENDING)]),
+    # store_feedback: upsert of one rating
+    "feedback_upsert": ({"user_id": "", "track_id": ""}, None),
+    # get_personalized_tracks: the user's whole rating history, newest first
+    "rating_history": ({"user_id": ""}, [("timestamp", DESCENDING)]),
+}
+
+
+def _dedupe_feedback(db):
+    """Keep only the newest rating per (user_id, track_id) so the unique index can be built."""
+    duplicates = db.user_feedback.aggregate([
+        {"$sort": {"timestamp": -1}},
+        {"$group": {"_id": {"user_id": "$user_id", "track_id": "$track_id"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for group in duplicates:
+        db.user_feedback.delete_many({"_id": {"$in": group["ids"][1:]}})
+
+
+def _feedback_indexes(db):
+    _dedupe_feedback(db)
+    db.user_feedback.create_index(
+        [("user_id", ASCENDING), ("track_id", ASCENDING)],
+        unique=True, name="user_track_unique"
+    )
+    db.user_feedback.create_index(
+        [("user_id", ASCENDING), ("rating", ASCENDING), ("timestamp", DESCENDING)],
+        name="user_rating_recent"
+    )
+
+
+def _feedback_history_index(db):
+    db.user_feedback.create_index(
+        [("user_id", ASCENDING), ("timestamp", DESCENDING)],
+        name="user_recent"
+    )
+
+
+def _response_cache_expiry_index(db):
+    # Mongo deletes cached responses once they are too old to be served
+    db.response_cache.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+
+
+def _library_indexes(db):
+    # A user's saved tracks, newest first
+    db.library_tracks.create_index(
+        [("user_id", ASCENDING), ("added_at", DESCENDING), ("track_id", DESCENDING)],
+        name="user_recently_added"
+    )
+
+
+def _deck_snapshot_expiry_index(db):
+    # Mongo deletes deck snapshots once they expire
+    db.deck_snapshots.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+
+
+# (version, description, function) - append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, "user_feedback unique (user_id, track_id) and (user_id, rating, timestamp desc) indexes", _feedback_indexes),
+    (2, "user_feedback (user_id, timestamp desc) index for the recommender", _feedback_history_index),
+    (3, "response_cache TTL index on expires_at", _response_cache_expiry_index),
+    (4, "library_tracks (user_id, added_at desc) index for the synced libraries", _library_indexes),
+    (5, "deck_snapshots TTL index on expires_at", _deck_snapshot_expiry_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(db) -> list:
+    """Apply every migration that hasn't been applied yet and return their versions."""
+    applied = {doc["_id"] for doc in db.schema_migrations.find({}, {"_id": 1})}
+    newly_applied = []
+    for version, description, apply in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"SCHEMA: Applying migration {version}: {description}")
+        apply(db)
+        try:
+            db.schema_migrations.insert_one({
+                "_id": version,
+                "description": description,
+                "applied_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            pass  # Another worker applied it at the same time, the steps are idempotent
+        newly_applied.append(version)
+    return newly_applied
+
+
+def schema_version(db) -> int:
+    latest = db.schema_migrations.find_one(sort=[("_id", DESCENDING)])
+    return latest["_id"] if latest else 0
+
+
+def plan_stages(plan: dict) -> list:
+    """Flatten an explain() winning plan into the list of its stage names."""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if "stage" in node:
+            stages.append(node["stage"])
+        # Newer servers nest the classic plan under queryPlan
+        for key in ("queryPlan", "inputStage"):
+            if key in node:
+                pending.append(node[key])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+
+def explain_stages(collection, query: dict, sort=None) -> list:
+    cursor = collection.find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    return plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+
+
+def is_index_backed(collection, query: dict, sort=None) -> bool:
+    """True if the query is answered from an index scan, without a collection scan or in-memory sort."""
+    stages = explain_stages(collection, query, sort)
+    return "IXSCAN" in stages and "COLLSCAN" not in stages and "SORT" not in stages
@@ -0,0 +1,49 @@
+import os
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from schema import migrate, schema_version, is_index_backed, plan_stages, FEEDBACK_QUERIES
+
+mongomock = pytest.importorskip("mongomock")
+
+# Test that migrations create the feedback indexes once and are a no-op when run again
+def test_migrate_is_idempotent():
+    db = mongomock.MongoClient().db
+    assert migrate(db) == [1, 2, 3, 4, 5]
+    assert migrate(db) == []
+    assert schema_version(db) == 5
+    index_names = db.user_feedback.index_information().keys()
+    assert "user_track_unique" in index_names
+    assert "user_rating_recent" in index_names
+    assert "user_recent" in index_names
+    assert "expires_at_ttl" in db.response_cache.index_information()
+    assert "user_recently_added" in db.library_tracks.index_information()
+    assert "expires_at_ttl" in db.deck_snapshots.index_information()
+
+# Test that duplicate ratings are cleaned up and further duplicates are rejected
+def test_migrate_enforces_one_rating_per_track():
+    db = mongomock.MongoClient().db
+    db.user_feedback.insert_many([
+        {"user_id": "u", "track_id": "t", "rating": "like", "timestamp": 1},
+        {"user_id": "u", "track_id": "t", "rating": "dislike", "timestamp": 2},
+    ])
+    migrate(db)
+    assert db.user_feedback.find_one({"user_id": "u", "track_id": "t"})["rating"] == "dislike"
+    with pytest.raises(DuplicateKeyError):
+        db.user_feedback.insert_one({"user_id": "u", "track_id": "t", "rating": "like"})
+
+# Test that the explain() plan walker finds stages nested in every plan shape
+def test_plan_stages():
+    plan = {"queryPlan": {"stage": "FETCH", "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "IXSCAN"}]}}}
+    assert sorted(plan_stages(plan)) == ["FETCH", "IXSCAN", "IXSCAN", "OR"]
+
+# Test against a real MongoDB that the feedback queries are answered from the indexes.
+# Set MONGO_TEST_URI (e.g. mongodb://localhost:27017/test_music) to run it.
+@pytest.mark.skipif(not os.getenv("MONGO_TEST_URI"), reason="MONGO_TEST_URI not set")
+def test_feedback_queries_are_index_backed():
+    db = MongoClient(os.getenv("MONGO_TEST_URI"), serverSelectionTimeoutMS=2000).get_default_database()
+    db.user_feedback.drop()
+    db.schema_migrations.drop()
+    migrate(db)
+    for query, sort in FEEDBACK_QUERIES.values():
+        assert is_index_backed(db.user_feedback, query, sort)
@@ -0,0 +1,259 @@
+# In-process prefix index for the Search page's typeahead.
+# It holds compact search results (tracks, artists, albums) under the words of their names
+# and of their artists' names, and answers a query from memory: every word of the query
+# must start a word of the result. It is fed by every Spotify payload the catalog records,
+# so searches, decks and synced libraries all land in it, and by the albums of remote
+# searches. A worker warms it from the catalog collections the first time it serves a
+# typeahead. It is bounded, the entries added longest ago are dropped first.
+
+import os
+import re
+import bisect
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pymongo import DESCENDING
+
+from projection import artist_refs, first_image_url, spotify_url
+
+SEARCH_INDEX_SIZE = int(os.getenv("SEARCH_INDEX_SIZE", 50000))
+SEARCH_INDEX_WARM = int(os.getenv("SEARCH_INDEX_WARM", 20000))  # catalog tracks and artists loaded when warming
+# Shorter queries match too much to be worth answering
+TYPEAHEAD_MIN_QUERY = 2
+# Prefixes up to this long span too many words to union their postings per query, their
+# ids are kept up to date as entries come and go instead
+SHORT_PREFIX = 3
+
+# Result kind -> the key search responses list them under
+SEARCH_KINDS = {"track": "tracks", "artist": "artists", "album": "albums"}
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    """Lower case words without accents or punctuation, "Beyoncé - Halo!" is "beyonce halo" """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def search_track(item) -> dict:
+    return {
+        "id": item.get('id'),
+        "name": item.get('name'),
+        "artists": artist_refs(item.get('artists')),
+        "album_name": (item.get('album') or {}).get('name'),
+        "image_url": first_image_url((item.get('album') or {}).get('images')),
+        "url": spotify_url(item)
+    }
+
+
+def search_artist(item) -> dict:
+    return {
+        "id": item.get('id'),
+        "name": item.get('name'),
+        "image_url": first_image_url(item.get('images')),
+        "genres": item.get('genres', []),
+        "url": spotify_url(item)
+    }
+
+
+def search_album(item) -> dict:
+    return {
+        "id": item.get('id'),
+        "name": item.get('name'),
+        "artists": artist_refs(item.get('artists')),
+        "image_url": first_image_url(item.get('images')),
+        "release_date": item.get('release_date'),
+        "total_tracks": item.get('total_tracks'),
+        "url": spotify_url(item)
+    }
+
+
+class _Entry:
+    __slots__ = ("result", "name", "words", "popularity")
+
+    def __init__(self, result, name, words, popularity):
+        self.result = result
+        self.name = name
+        self.words = words
+        self.popularity = popularity
+
+
+class _KindIndex:
+    """The entries of one kind, as sets of ids so a query is mostly set operations done in C"""
+
+    def __init__(self):
+        self.entries = {}  # id -> _Entry
+        self.postings = {}  # word -> ids of the entries with that word
+        self.words = []  # every indexed word, sorted, so a prefix is a contiguous range
+        self.short = {}  # prefix up to SHORT_PREFIX long -> ids of the entries with a word starting with it
+        self.names = []  # (name, id) sorted, the same for name prefixes
+        self.by_popularity = [set() for _ in range(101)]  # popularity -> ids
+
+    def link(self, item_id, entry):
+        self.entries[item_id] = entry
+        for word in entry.words:
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = set()
+                bisect.insort(self.words, word)
+            ids.add(item_id)
+        for prefix in self.short_prefixes(entry.words):
+            self.short.setdefault(prefix, set()).add(item_id)
+        bisect.insort(self.names, (entry.name, item_id))
+        self.by_popularity[entry.popularity].add(item_id)
+
+    def unlink(self, item_id):
+        entry = self.entries.pop(item_id)
+        for word in entry.words:
+            ids = self.postings[word]
+            ids.discard(item_id)
+            if not ids:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+        for prefix in self.short_prefixes(entry.words):
+            ids = self.short[prefix]
+            ids.discard(item_id)
+            if not ids:
+                del self.short[prefix]
+        del self.names[bisect.bisect_left(self.names, (entry.name, item_id))]
+        self.by_popularity[entry.popularity].discard(item_id)
+        return entry
+
+    @staticmethod
+    def short_prefixes(words) -> set:
+        return {word[:length] for word in words for length in range(1, min(len(word), SHORT_PREFIX) + 1)}
+
+    def matching(self, prefix) -> set:
+        """Ids of the entries with a word starting with prefix, not to be modified"""
+        if len(prefix) <= SHORT_PREFIX:
+            return self.short.get(prefix, set())
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + "\U0010ffff", start)
+        return set().union(*(self.postings[word] for word in self.words[start:end]))
+
+    def named(self, prefix) -> set:
+        """Ids of the entries whose name starts with prefix"""
+        start = bisect.bisect_left(self.names, (prefix,))
+        end = bisect.bisect_left(self.names, (prefix + "\U0010ffff",), start)
+        return {item_id for _, item_id in self.names[start:end]}
+
+    def most_popular(self, ids, limit) -> list:
+        """The `limit` most popular of ids, shorter names first on ties"""
+        best = []
+        for popularity in range(100, -1, -1):
+            if len(best) >= limit or not ids:
+                break
+            tied = self.by_popularity[popularity] & ids
+            if tied:
+                ids = ids - tied
+                best.extend(sorted(tied, key=lambda item_id: (len(self.entries[item_id].name), self.entries[item_id].name)))
+        return best[:limit]
+
+    def search(self, words, normalized, limit, boost) -> list:
+        # The longest word is usually the most selective, start from it
+        first, *others = sorted(words, key=len, reverse=True)
+        candidates = self.matching(first)
+        for other in others:
+            if not candidates:
+                return []
+            candidates = candidates & self.matching(other)
+        if not candidates:
+            return []
+
+        named = self.named(normalized) & candidates
+        boosted = candidates.intersection(boost)
+        best = []
+        # Name-prefix matches, then the user's library, then the rest, by popularity in each group
+        for group in (named & boosted, named - boosted, boosted - named, candidates - named - boosted):
+            best.extend(self.most_popular(group, limit - len(best)))
+            if len(best) >= limit:
+                break
+        return [self.entries[item_id].result for item_id in best]
+
+
+class PrefixIndex:
+    """Thread-safe word-prefix index of compact search results."""
+
+    def __init__(self, maxsize: int = SEARCH_INDEX_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # (kind, id) -> _Entry, oldest first
+        self._kinds = {kind: _KindIndex() for kind in SEARCH_KINDS}
+        self._lock = threading.Lock()
+        self._warmed = False
+        self.queries = 0
+        self.answered = 0
+
+    def add(self, kind: str, item: dict):
+        """Index a Spotify track, artist or album object (or a catalog document of one)."""
+        if not item or not item.get("id") or not item.get("name"):
+            return
+        result = {"track": search_track, "artist": search_artist, "album": search_album}[kind](item)
+        name = normalize(item["name"])
+        words = frozenset(name.split() + normalize(" ".join(a["name"] for a in result.get("artists", []))).split())
+        key = (kind, item["id"])
+        with self._lock:
+            previous = None
+            if self._entries.pop(key, None):
+                previous = self._kinds[kind].unlink(item["id"])
+            # Simplified objects carry no popularity, keep what a full one told us
+            popularity = item.get("popularity", previous.popularity if previous else 0)
+            entry = self._entries[key] = _Entry(result, name, words, min(max(int(popularity or 0), 0), 100))
+            self._kinds[kind].link(item["id"], entry)
+            while len(self._entries) > self.maxsize:
+                (old_kind, old_id), _ = self._entries.popitem(last=False)
+                self._kinds[old_kind].unlink(old_id)
+
+    def add_spotify(self, tracks=(), artists=(), albums=()):
+        """Index the objects of a Spotify payload, the catalog's record hook."""
+        for track in tracks:
+            self.add("track", track)
+            if track and track.get("album", {}).get("artists"):
+                self.add("album", track["album"])
+        for artist in artists:
+            self.add("artist", artist)
+        for album in albums:
+            self.add("album", album)
+
+    def search(self, query: str, kinds=tuple(SEARCH_KINDS), limit: int = 5, boost=frozenset()) -> dict:
+        """The best `limit` results of every kind for a typeahead query, in the shape of
+        a search response. Results whose id is in boost (e.g. the user's library) rank first."""
+        normalized = normalize(query)
+        results = {SEARCH_KINDS[kind]: [] for kind in kinds}
+        if len(normalized) < TYPEAHEAD_MIN_QUERY:
+            return results
+        words = normalized.split()
+        with self._lock:
+            self.queries += 1
+            for kind in kinds:
+                results[SEARCH_KINDS[kind]] = self._kinds[kind].search(words, normalized, limit, boost)
+            if any(results.values()):
+                self.answered += 1
+        return results
+
+    def warm(self, db, limit: int = SEARCH_INDEX_WARM):
+        """Load the most popular catalog tracks and artists, once per process."""
+        with self._lock:
+            if self._warmed:
+                return
+            self._warmed = True
+        try:
+            for kind, collection in (("track", db.tracks), ("artist", db.artists)):
+                for doc in collection.find().sort("popularity", DESCENDING).limit(limit):
+                    self.add(kind, dict(doc, id=doc["_id"]))
+            logger.info(f"SEARCH: Warmed the typeahead index with {len(self)} entries")
+        except Exception as e:
+            logger.error(f"SEARCH: Warming the typeahead index failed: {str(e)}")
+
+    def warm_in_background(self, db):
+        if not self._warmed:
+            threading.Thread(target=self.warm, args=(db,), name="search-index-warm", daemon=True).start()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "words": sum(len(index.words) for index in self._kinds.values()), "queries": self.queries, "answered": self.answered}
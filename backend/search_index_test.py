@@ -0,0 +1,48 @@
+from search_index import PrefixIndex, normalize
+
+def track(track_id, name, artist, popularity=50):
+    return {"id": track_id, "name": name, "popularity": popularity,
+            "artists": [{"id": artist.lower(), "name": artist}],
+            "album": {"id": f"{track_id}-album", "name": f"{name} (Album)", "images": [], "artists": [{"id": artist.lower(), "name": artist}]}}
+
+# Test that queries are matched without case, accents or punctuation
+def test_normalize():
+    assert normalize("Beyoncé - Halo!") == "beyonce halo"
+    assert normalize("  AC/DC  ") == "ac dc"
+
+# Test that every query word must start a word of the name or of the artists
+def test_prefix_index_matches_word_prefixes():
+    index = PrefixIndex()
+    index.add_spotify(tracks=[track("t1", "Halo", "Beyoncé"), track("t2", "Hallelujah", "Leonard Cohen"), track("t3", "Single Ladies", "Beyoncé")])
+
+    assert [t["id"] for t in index.search("hal", ["track"])["tracks"]] == ["t1", "t2"]
+    assert [t["id"] for t in index.search("beyonce hal", ["track"])["tracks"]] == ["t1"]
+    assert index.search("hal", ["album"])["albums"][0]["id"] == "t1-album"
+    assert index.search("h")["tracks"] == []
+    assert index.search("xyz") == {"tracks": [], "artists": [], "albums": []}
+
+# Test that name-prefix matches, then the user's library, then popularity rank first
+def test_prefix_index_ranking():
+    index = PrefixIndex()
+    index.add_spotify(tracks=[
+        track("popular", "Love Story", "Taylor Swift", popularity=90),
+        track("mine", "Love Song", "Adele", popularity=10),
+        track("other", "Crazy in Love", "Beyoncé", popularity=99),
+    ])
+    assert [t["id"] for t in index.search("love", ["track"])["tracks"]] == ["popular", "mine", "other"]
+    assert [t["id"] for t in index.search("love", ["track"], boost={"mine"})["tracks"]] == ["mine", "popular", "other"]
+    assert [t["id"] for t in index.search("love", ["track"], limit=1)["tracks"]] == ["popular"]
+
+# Test that the oldest entries are evicted, words included, and re-adding keeps known popularity
+def test_prefix_index_eviction():
+    index = PrefixIndex(maxsize=2)
+    index.add("track", track("t1", "Alpha", "A", popularity=70))
+    index.add("track", track("t2", "Beta", "B"))
+    index.add("track", track("t3", "Gamma", "C"))
+    assert len(index) == 2
+    assert index.search("alpha")["tracks"] == []
+    assert index.stats()["words"] == 4
+
+    simplified = {"id": "t3", "name": "Gamma", "artists": [{"id": "c", "name": "C"}]}
+    index.add("track", simplified)
+    assert index._entries[("track", "t3")].popularity == 50
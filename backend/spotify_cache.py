@@ -0,0 +1,222 @@
+# Process-wide cache for Spotify responses that are the same for every user
+# (artist top tracks, related artists, artist albums).
+# Entries are bounded in number, evicted least-recently-used first, expire after a
+# per-kind TTL, and concurrent misses for the same key share one upstream call.
+# When a reload fails (e.g. we are being rate limited) the expired value is served instead.
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+ARTIST_CACHE_SIZE = int(os.getenv("ARTIST_CACHE_SIZE", 5000))
+ARTIST_CACHE_TTLS = {
+    "artist_top_tracks": int(os.getenv("ARTIST_CACHE_TTL_TOP_TRACKS", 6 * 3600)),
+    "artist_related_artists": int(os.getenv("ARTIST_CACHE_TTL_RELATED", 24 * 3600)),
+    "artist_albums": int(os.getenv("ARTIST_CACHE_TTL_ALBUMS", 12 * 3600)),
+}
+
+
+class _Flight:
+    """A load in progress that other callers for the same key can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a TTL per kind of entry and single-flight loading."""
+
+    def __init__(self, maxsize: int, ttls: dict, default_ttl: int = 300, stale_on_error: bool = False):
+        self.maxsize = maxsize
+        self.ttls = dict(ttls)
+        self.default_ttl = default_ttl
+        self.stale_on_error = stale_on_error
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._async_inflight = {}  # key -> task, for get_or_load_async()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get_or_load(self, kind: str, key, loader):
+        """Return the cached value for (kind, key), calling loader() on a miss."""
+        full_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return entry[1]
+
+            flight = self._inflight.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[full_key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        # Someone else is already fetching this key, wait for their result
+        if not leader:
+            flight.event.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            if not (self.stale_on_error and entry):
+                flight.error = e
+                raise
+            # Better an expired value than none while upstream is failing
+            flight.value = entry[1]
+            with self._lock:
+                self.stale += 1
+        else:
+            self._store(full_key, flight.value, self.ttls.get(kind, self.default_ttl))
+        finally:
+            with self._lock:
+                self._inflight.pop(full_key, None)
+            flight.event.set()
+        return flight.value
+
+    async def get_or_load_async(self, kind: str, key, loader):
+        """get_or_load() for the event loop: loader() returns an awaitable, and concurrent
+        misses for the same key await one shared load instead of blocking the loop."""
+        full_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return entry[1]
+
+            task = self._async_inflight.get(full_key)
+            if task is None:
+                task = self._async_inflight[full_key] = asyncio.ensure_future(self._load_async(kind, full_key, entry, loader))
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        # Shielded, so one caller giving up doesn't cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load_async(self, kind, full_key, entry, loader):
+        try:
+            value = await loader()
+        except Exception:
+            if not (self.stale_on_error and entry):
+                raise
+            with self._lock:
+                self.stale += 1
+            return entry[1]
+        else:
+            self._store(full_key, value, self.ttls.get(kind, self.default_ttl))
+            return value
+        finally:
+            with self._lock:
+                self._async_inflight.pop(full_key, None)
+
+    def _store(self, full_key, value, ttl):
+        with self._lock:
+            self._entries[full_key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "stale": self.stale,
+            }
+
+
+# Shared by every request in this process
+artist_cache = TTLCache(ARTIST_CACHE_SIZE, ARTIST_CACHE_TTLS, stale_on_error=True)
+
+
+def _album_tracks(albums):
+    return [
+        dict(track, album=album)
+        for album in albums if album
+        for track in album.get("tracks", {}).get("items", [])
+    ]
+
+
+# How to pull track and artist objects out of each Spotify response, for the catalog.
+# Lookups by id (track, tracks, artists) go through the catalog itself, which stores what it fetches.
+CATALOG_EXTRACTORS = {
+    "artist_top_tracks": lambda result: (result.get("tracks", []), []),
+    "artist_related_artists": lambda result: ([], result.get("artists", [])),
+    "albums": lambda result: (_album_tracks(result.get("albums", [])), []),
+    "search": lambda result: (
+        (result.get("tracks") or {}).get("items", []),
+        (result.get("artists") or {}).get("items", []),
+    ),
+    "current_user_saved_tracks": lambda result: ([item.get("track") for item in result.get("items", [])], []),
+    "current_user_top_tracks": lambda result: (result.get("items", []), []),
+}
+
+
+class CachedSpotify:
+    """Wraps a Spotify client so artist-level calls are served from the shared cache.
+
+    Every other attribute is passed straight through to the wrapped client. When a
+    catalog is given, every upstream response that carries tracks or artists is also
+    recorded in it.
+    """
+
+    def __init__(self, client, cache: TTLCache = None, catalog=None):
+        self._client = client
+        self._cache = cache or artist_cache
+        self._catalog = catalog
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        return self._cache.get_or_load(
+            "artist_top_tracks", (artist_id, country),
+            lambda: self._call("artist_top_tracks", artist_id, country=country)
+        )
+
+    def artist_related_artists(self, artist_id):
+        return self._cache.get_or_load(
+            "artist_related_artists", artist_id,
+            lambda: self._call("artist_related_artists", artist_id)
+        )
+
+    def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        return self._cache.get_or_load(
+            "artist_albums", (artist_id, album_type, country, limit, offset),
+            lambda: self._call(
+                "artist_albums", artist_id, album_type=album_type, country=country, limit=limit, offset=offset
+            )
+        )
+
+    def _call(self, name, *args, **kwargs):
+        result = getattr(self._client, name)(*args, **kwargs)
+        if self._catalog and result and name in CATALOG_EXTRACTORS:
+            tracks, artists = CATALOG_EXTRACTORS[name](result)
+            self._catalog.record(tracks=tracks, artists=artists)
+        return result
+
+    def __getattr__(self, name):
+        if self._catalog and name in CATALOG_EXTRACTORS:
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+        return getattr(self._client, name)
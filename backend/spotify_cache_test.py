@@ -0,0 +1,84 @@
+import pytest
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+from spotify_cache import TTLCache, CachedSpotify
+
+# Test that a second lookup for the same key is a hit and never calls upstream again
+def test_cache_hit_and_miss_counters():
+    cache = TTLCache(10, {"artist_top_tracks": 60})
+    loader = MagicMock(return_value={"tracks": []})
+    cache.get_or_load("artist_top_tracks", "a", loader)
+    cache.get_or_load("artist_top_tracks", "a", loader)
+    assert loader.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+# Test that the least recently used entry is evicted when the cache is full
+def test_cache_lru_eviction():
+    cache = TTLCache(2, {})
+    cache.get_or_load("k", "a", lambda: 1)
+    cache.get_or_load("k", "b", lambda: 2)
+    cache.get_or_load("k", "a", lambda: 1)  # touch a so b is the oldest
+    cache.get_or_load("k", "c", lambda: 3)
+    loader = MagicMock(return_value=2)
+    cache.get_or_load("k", "b", loader)
+    assert loader.call_count == 1
+    assert cache.stats()["evictions"] >= 1
+
+# Test that entries expire after their kind's TTL
+def test_cache_ttl_expiry():
+    cache = TTLCache(10, {"short": 0})
+    loader = MagicMock(return_value=1)
+    cache.get_or_load("short", "a", loader)
+    cache.get_or_load("short", "a", loader)
+    assert loader.call_count == 2
+
+# Test that an expired value is served when reloading it fails, and only with stale_on_error
+def test_cache_stale_on_error():
+    failing = MagicMock(side_effect=RuntimeError("429"))
+    cache = TTLCache(10, {"short": 0}, stale_on_error=True)
+    cache.get_or_load("short", "a", lambda: 1)
+    assert cache.get_or_load("short", "a", failing) == 1
+    assert cache.stats()["stale"] == 1
+
+    strict = TTLCache(10, {"short": 0})
+    strict.get_or_load("short", "a", lambda: 1)
+    with pytest.raises(RuntimeError):
+        strict.get_or_load("short", "a", failing)
+
+# Test that a burst of concurrent misses for one artist makes a single upstream call
+def test_cache_single_flight():
+    client = MagicMock()
+    def slow_top_tracks(artist_id, country="US"):
+        time.sleep(0.1)
+        return {"tracks": [{"id": "t1"}]}
+    client.artist_top_tracks.side_effect = slow_top_tracks
+    cached = CachedSpotify(client, TTLCache(10, {}))
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cached.artist_top_tracks("artist"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert client.artist_top_tracks.call_count == 1
+    assert len(results) == 8
+
+# Test that concurrent async misses for one key share a single load
+def test_cache_get_or_load_async_single_flight():
+    cache = TTLCache(10, {})
+    calls = []
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"tracks": [{"id": "t1"}]}
+    async def burst():
+        return await asyncio.gather(*(cache.get_or_load_async("top", "artist", load) for _ in range(8)))
+    results = asyncio.run(burst())
+    assert len(calls) == 1
+    assert all(result == {"tracks": [{"id": "t1"}]} for result in results)
+    assert asyncio.run(cache.get_or_load_async("top", "artist", load)) is results[0]
+    assert cache.stats()["coalesced"] == 7
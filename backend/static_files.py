@@ -0,0 +1,160 @@
+# Serving of the built frontend (Vite's dist, copied to STATIC_PATH).
+# A manifest of every file is built once at startup, so a request for an asset is a dict
+# lookup instead of a filesystem probe. Files are served through the WSGI file wrapper
+# (sendfile under gunicorn), with the precompressed .br or .gz variant next to them when the
+# browser accepts it. Vite's fingerprinted files under assets/ never change, so they are
+# cached for a year as immutable; everything else is revalidated with a strong ETag.
+# The variants are made once, at image build time: python -m static_files compress static templates
+
+import os
+import re
+import sys
+import gzip
+import hashlib
+import logging
+import mimetypes
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:  # Optional, only .gz variants are made without it
+    brotli = None
+
+# Vite names built assets name-<8 character hash>.ext under assets/
+HASHED_ASSET = re.compile(r"(^|/)assets/.+-[\w-]{8}\.\w+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 3600))  # seconds unhashed files (favicons, ...) may be reused
+
+# Encodings we make variants for, preferred first, and their file suffixes
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/wasm", "image/svg+xml")
+COMPRESS_MIN_SIZE = 1024  # smaller files gain too little to be worth a variant
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def guess_mimetype(path) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def is_compressible(path) -> bool:
+    return guess_mimetype(path).startswith(COMPRESSIBLE_TYPES) and os.path.getsize(path) >= COMPRESS_MIN_SIZE
+
+
+def is_asset_path(path: str) -> bool:
+    """Paths that name a file (assets/..., favicon.ico), as opposed to the frontend's own routes"""
+    return path.startswith("assets/") or "." in path.rsplit("/", 1)[-1]
+
+
+class StaticAsset:
+    __slots__ = ("path", "mimetype", "etag", "cache_control", "variants")
+
+    def __init__(self, path, relative):
+        self.path = path
+        self.mimetype = guess_mimetype(path)
+        self.etag = file_digest(path)
+        if HASHED_ASSET.search(relative):
+            self.cache_control = IMMUTABLE_CACHE_CONTROL
+        elif relative.endswith(".html"):
+            self.cache_control = REVALIDATE_CACHE_CONTROL
+        else:
+            self.cache_control = f"public, max-age={STATIC_MAX_AGE}"
+        self.variants = {
+            encoding: path + suffix for encoding, suffix in ENCODINGS.items() if os.path.isfile(path + suffix)
+        }
+
+    def encoding_for(self, accept_encodings) -> str | None:
+        """The best precompressed variant the client accepts, None for the file itself"""
+        for encoding in self.variants:
+            if accept_encodings[encoding]:
+                return encoding
+        return None
+
+
+class StaticManifest:
+    """Every file under root, by its path relative to root. Compressed variants are not
+    listed themselves, they belong to the file they were made from."""
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        if not os.path.isdir(root):
+            logger.warning(f"STATIC: {root} does not exist, no static files will be served from it")
+            return
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if any(name.endswith(suffix) and os.path.isfile(path[:-len(suffix)]) for suffix in ENCODINGS.values()):
+                    continue
+                relative = os.path.relpath(path, root).replace(os.sep, "/")
+                self.assets[relative] = StaticAsset(path, relative)
+        compressed = sum(1 for asset in self.assets.values() if asset.variants)
+        logger.info(f"STATIC: {len(self.assets)} files under {root}, {compressed} with compressed variants")
+
+    def get(self, path: str) -> StaticAsset | None:
+        return self.assets.get(path)
+
+    def __len__(self):
+        return len(self.assets)
+
+
+def send_asset(asset: StaticAsset) -> Response:
+    """The asset for the current request, compressed if the client accepts it, or a 304"""
+    encoding = asset.encoding_for(request.accept_encodings)
+    # Each representation has its own strong ETag
+    etag = asset.etag if encoding is None else f"{asset.etag}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        response = send_file(asset.variants.get(encoding, asset.path), mimetype=asset.mimetype, etag=etag, conditional=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    if asset.variants:
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = asset.cache_control
+    return response
+
+
+def compress_file(path) -> list:
+    """Write the .gz (and .br) variants of a file, keeping only those that are smaller"""
+    with open(path, "rb") as f:
+        data = f.read()
+    written = []
+    compressors = {"gzip": lambda body: gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli:
+        compressors["br"] = lambda body: brotli.compress(body, quality=11)
+    for encoding, compress in compressors.items():
+        body = compress(data)
+        if len(body) < len(data) * 0.9:
+            with open(path + ENCODINGS[encoding], "wb") as f:
+                f.write(body)
+            written.append(path + ENCODINGS[encoding])
+    return written
+
+
+def compress_tree(root) -> list:
+    written = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if not name.endswith(tuple(ENCODINGS.values())) and is_compressible(path):
+                written += compress_file(path)
+    return written
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "compress":
+        sys.exit("usage: python -m static_files compress DIRECTORY...")
+    for root in sys.argv[2:]:
+        print(f"{root}: wrote {len(compress_tree(root))} compressed variants" + ("" if brotli else " (gzip only, brotli is not installed)"))
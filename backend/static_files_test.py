@@ -0,0 +1,33 @@
+import gzip
+from static_files import StaticManifest, compress_tree, is_asset_path, IMMUTABLE_CACHE_CONTROL
+
+def build_dist(root):
+    (root / "assets").mkdir()
+    (root / "assets" / "index-Bx3kQ9aZ.js").write_text("console.log('hello');\n" * 200)
+    (root / "assets" / "logo-Aa11Bb22.png").write_bytes(b"\x89PNG" + bytes(2000))
+    (root / "index.html").write_text("<!doctype html><div id=app></div>")
+    (root / "vite.svg").write_text("<svg/>")
+    return root
+
+# Test that only compressible files large enough get variants, and variants aren't listed as files
+def test_compress_and_manifest(tmp_path):
+    root = build_dist(tmp_path)
+    written = compress_tree(str(root))
+    assert [path.rsplit("/", 1)[-1] for path in written if path.endswith(".gz")] == ["index-Bx3kQ9aZ.js.gz"]
+    assert gzip.decompress((root / "assets" / "index-Bx3kQ9aZ.js.gz").read_bytes()).startswith(b"console.log")
+
+    manifest = StaticManifest(str(root))
+    assert sorted(manifest.assets) == ["assets/index-Bx3kQ9aZ.js", "assets/logo-Aa11Bb22.png", "index.html", "vite.svg"]
+    script = manifest.get("assets/index-Bx3kQ9aZ.js")
+    assert "gzip" in script.variants
+    assert script.cache_control == IMMUTABLE_CACHE_CONTROL
+    assert manifest.get("index.html").cache_control == "no-cache"
+    assert manifest.get("vite.svg").cache_control.startswith("public, max-age=")
+    assert len(StaticManifest(str(root / "missing"))) == 0
+
+# Test that file-like paths are told apart from the frontend's routes
+def test_is_asset_path():
+    assert is_asset_path("assets/index-old.js")
+    assert is_asset_path("favicon.ico")
+    assert not is_asset_path("explore")
+    assert not is_asset_path("")